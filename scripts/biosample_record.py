@@ -0,0 +1,64 @@
+"""
+Compact in-memory representation of the BioSamples records kept by import_from_biosamples until the end of the run
+Only the parts of the BioSamples JSON read when building the organism and specimen documents are kept
+"""
+from typing import Dict
+
+# the keys of each characteristic value used to build the documents and the custom fields
+CHARACTERISTIC_KEYS = ('text', 'value', 'unit', 'ontologyTerms')
+# the keys of each relationship used to work out the derived from, child of and alternative ids
+RELATIONSHIP_KEYS = ('type', 'source', 'target')
+
+
+class CompactBioSample:
+    """
+    The projection of a BioSamples record, accessed like the original dict, e.g. item['characteristics']
+    """
+    __slots__ = ('accession', 'name', 'etag', 'release', 'update', 'organization', 'characteristics',
+                 'relationships')
+
+    def __init__(self, record: Dict):
+        """
+        :param record: the BioSamples record as returned by the API, with the etag added
+        """
+        self.accession = record.get('accession')
+        self.name = record.get('name')
+        self.etag = record.get('etag')
+        self.release = record.get('release')
+        self.update = record.get('update')
+        self.organization = record.get('organization')
+        self.characteristics = {name: compact_characteristic(values)
+                                for name, values in record.get('characteristics', dict()).items()}
+        self.relationships = None
+        if 'relationships' in record:
+            self.relationships = [{key: relation[key] for key in RELATIONSHIP_KEYS if key in relation}
+                                  for relation in record['relationships']]
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        # the fields missing from the original record are stored as None
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def compact_characteristic(values):
+    """
+    Keep only the used keys of the values of one characteristic
+    :param values: the list of values of the characteristic
+    :return: the projected list of values
+    """
+    if not isinstance(values, list):
+        return values
+    return [{key: value[key] for key in CHARACTERISTIC_KEYS if key in value} if isinstance(value, dict) else value
+            for value in values]
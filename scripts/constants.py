@@ -2,6 +2,7 @@
 Different constants that could be used by faang backend workflow
 It is organized into sections General setting, and Script-specific sections
 """
+import os
 from typing import Dict
 
 ######################################
@@ -32,6 +33,16 @@ ALIASES_IN_USE = {
     'faang_build_3_article': 'article'
 }
 
+# Base addresses of the external services, each could be overridden by the environment variable of the same name,
+# e.g. to point the scripts to the local stand-in services started by standin_services.py
+BIOSAMPLES_API_URL = os.environ.get('BIOSAMPLES_API_URL', 'https://www.ebi.ac.uk/biosamples')
+ENA_PORTAL_API_URL = os.environ.get('ENA_PORTAL_API_URL', 'https://www.ebi.ac.uk/ena/portal/api')
+ENA_XREF_API_URL = os.environ.get('ENA_XREF_API_URL', 'https://www.ebi.ac.uk/ena/xref/rest/json')
+EUROPE_PMC_API_URL = os.environ.get('EUROPE_PMC_API_URL', 'https://www.ebi.ac.uk/europepmc/webservices/rest')
+OLS_API_URL = os.environ.get('OLS_API_URL', 'http://www.ebi.ac.uk/ols/api')
+EVA_API_URL = os.environ.get('EVA_API_URL', 'http://www.ebi.ac.uk/eva/webservices/rest/v1')
+VALIDATION_API_URL = os.environ.get('VALIDATION_API_URL', 'https://www.ebi.ac.uk/vg/faang')
+
 # Current indices in use
 TYPES = ['organism', 'specimen', 'file', 'experiment', 'dataset', 'analysis', 'article', 'log']
 
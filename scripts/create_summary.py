@@ -4,6 +4,43 @@ import json
 from utils import *
 from constants import STAGING_NODE1, STAGING_NODE2, MALES, FEMALES
 
+# only the fields needed by the summaries are retrieved when reading the indices
+ORGANISM_SUMMARY_FIELDS = ['standardMet', 'paperPublished', 'sex.text', 'organism.text', 'breed.text']
+SPECIMEN_SUMMARY_FIELDS = ['standardMet', 'paperPublished', 'organism.sex.text', 'organism.organism.text',
+                           'organism.breed.text', 'cellType.text', 'material.text']
+DATASET_SUMMARY_FIELDS = ['standardMet', 'paperPublished', 'species.text', 'assayType']
+FILE_SUMMARY_FIELDS = ['paperPublished', 'species.text', 'experiment.standardMet', 'experiment.assayType']
+
+# the maximum number of distinct values returned by one terms aggregation
+SUMMARY_TERMS_SIZE = 10000
+# the fields used by the aggregations for each index:
+# standard: the field holding the standard, also used to select the FAANG only records
+# sex: the field holding the sex which is mapped into male, female or not determined
+# terms: the summary names and the fields counted for them
+# breed: the fields holding the species and the breed
+SUMMARY_AGGREGATION_FIELDS = {
+    'organism': {
+        'standard': 'standardMet',
+        'sex': 'sex.text',
+        'terms': {'organism': 'organism.text'},
+        'breed': ('organism.text', 'breed.text')
+    },
+    'specimen': {
+        'standard': 'standardMet',
+        'sex': 'organism.sex.text',
+        'terms': {'cellType': 'cellType.text', 'organism': 'organism.organism.text', 'material': 'material.text'},
+        'breed': ('organism.organism.text', 'organism.breed.text')
+    },
+    'dataset': {
+        'standard': 'standardMet',
+        'terms': {'species': 'species.text', 'assayType': 'assayType'}
+    },
+    'file': {
+        'standard': 'experiment.standardMet',
+        'terms': {'species': 'species.text', 'assayType': 'experiment.assayType'}
+    }
+}
+
 
 class CreateSummary:
     """
@@ -12,82 +49,31 @@ class CreateSummary:
     and summary_file indexes; This data will be used by frontend to
     create charts in summary tab
     """
-    def __init__(self, es_instance, logger_instance):
+    def __init__(self, es_instance, logger_instance, use_aggregations=False):
         """
         :param es_instance: staging es instance to write data to
         :param logger_instance: logger to write logs
+        :param use_aggregations: compute the counts with Elasticsearch aggregations, one request per index (True) or
+        by reading all documents (False, default value)
         """
         self.es_instance = es_instance
         self.logger_instance = logger_instance
+        self.use_aggregations = use_aggregations
 
     def create_organism_summary(self):
         """
         This function will parse organism data and create summary document for es
         """
         data = dict()
+        counts = self.get_counts('organism', self.count_organism_records)
         for legacy in [False, True]:
-            body = dict()
-            sex_summary_name = 'sexSummary'
-            paper_published_summary_name = 'paperPublishedSummary'
-            standard_summary_name = 'standardSummary'
-            organism_summary_name = 'organismSummary'
-            breed_summary_name = 'breedSummary'
-            if legacy:
-                body = {
-                    'query': {
-                        'bool': {
-                            'filter': {
-                                'term': {'standardMet': 'FAANG'}
-                            }
-                        }
-                    }
-                }
-                sex_summary_name = 'sexSummaryFAANGOnly'
-                paper_published_summary_name = 'paperPublishedSummaryFAANGOnly'
-                standard_summary_name = 'standardSummaryFAANGOnly'
-                organism_summary_name = 'organismSummaryFAANGOnly'
-                breed_summary_name = 'breedSummaryFAANGOnly'
-            results = self.es_instance.search(index='organism', doc_type='_doc',
-                                              body=body, size=1000000)
-            standard_data = get_standard(results['hits']['hits'])
-            sex_data = dict()
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
-            organism_data = dict()
-            breed_data = dict()
-            for item in results['hits']['hits']:
-                # get data for sex_data
-                sex = item['_source']['sex']['text']
-                if sex in MALES:
-                    sex = 'male'
-                elif sex in FEMALES:
-                    sex = 'female'
-                else:
-                    sex = 'not determined'
-                sex_data.setdefault(sex, 0)
-                sex_data[sex] += 1
-
-                # get data for organism_data
-                organism = item['_source']['organism']['text']
-                organism_data.setdefault(organism, 0)
-                organism_data[organism] += 1
-
-                # get data for breed_data
-                breed = item['_source']['breed']['text']
-                breed_data.setdefault(organism, {})
-                breed_data[organism].setdefault(breed, 0)
-                breed_data[organism][breed] += 1
-
-            # create document for es
-            data[sex_summary_name] = create_summary_document_for_es(sex_data)
-            data[paper_published_summary_name] = create_summary_document_for_es(
-                paper_published_data)
-            data[standard_summary_name] = create_summary_document_for_es(
-                standard_data)
-            data[organism_summary_name] = create_summary_document_for_es(
-                organism_data)
-            data[breed_summary_name] = create_summary_document_for_breeds(
-                breed_data)
+            suffix = 'FAANGOnly' if legacy else ''
+            data[f'sexSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['sex'])
+            data[f'paperPublishedSummary{suffix}'] = create_summary_document_for_es(
+                counts[legacy]['paperPublished'])
+            data[f'standardSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['standard'])
+            data[f'organismSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['organism'])
+            data[f'breedSummary{suffix}'] = create_summary_document_for_breeds(counts[legacy]['breed'])
         body = json.dumps(data)
         self.es_instance.index(index="summary_organism", doc_type="_doc",
                                id="summary_organism", body=body)
@@ -97,100 +83,17 @@ class CreateSummary:
         This function will parse specimen data and create summary document for es
         """
         data = dict()
+        counts = self.get_counts('specimen', self.count_specimen_records)
         for legacy in [False, True]:
-            body = dict()
-            sex_summary_name = 'sexSummary'
-            paper_published_summary_name = 'paperPublishedSummary'
-            standard_summary_name = 'standardSummary'
-            cell_type_summary_name = 'cellTypeSummary'
-            organism_summary_name = 'organismSummary'
-            material_summary_name = 'materialSummary'
-            breed_summary_name = 'breedSummary'
-            if legacy:
-                body = {
-                    'query': {
-                        'bool': {
-                            'filter': {
-                                'term': {'standardMet': 'FAANG'}
-                            }
-                        }
-                    }
-                }
-                sex_summary_name = 'sexSummaryFAANGOnly'
-                paper_published_summary_name = 'paperPublishedSummaryFAANGOnly'
-                standard_summary_name = 'standardSummaryFAANGOnly'
-                cell_type_summary_name = 'cellTypeSummaryFAANGOnly'
-                organism_summary_name = 'organismSummaryFAANGOnly'
-                material_summary_name = 'materialSummaryFAANGOnly'
-                breed_summary_name = 'breedSummaryFAANGOnly'
-            results = self.es_instance.search(index='specimen', doc_type='_doc',
-                                              body=body, size=1000000)
-            sex_data = dict()
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
-            standard_data = get_standard(results['hits']['hits'])
-            cell_type_data = dict()
-            organism_data = dict()
-            material_data = dict()
-            breed_data = dict()
-
-            # get data for sex_data
-            for item in results['hits']['hits']:
-                # get data for sex_data
-                if 'sex' in item['_source']['organism']:
-                    sex = item['_source']['organism']['sex']['text']
-                    if sex in MALES:
-                        sex = 'male'
-                    elif sex in FEMALES:
-                        sex = 'female'
-                    else:
-                        sex = 'not determined'
-                else:
-                    sex = 'not determined'
-                sex_data.setdefault(sex, 0)
-                sex_data[sex] += 1
-
-                # get data for cell_type_data
-                if 'cellType' in item['_source']:
-                    cell_type_data.setdefault(
-                        item['_source']['cellType']['text'], 0)
-                    cell_type_data[item['_source']['cellType']['text']] += 1
-
-                # get data for organism_data
-                if 'organism' in item['_source']:
-                    organism = item['_source']['organism']['organism']['text']
-                    organism_data.setdefault(organism, 0)
-                    organism_data[organism] += 1
-
-                # get data for material_data
-                if 'material' in item['_source']:
-                    material = item['_source']['material']['text']
-                    material_data.setdefault(material, 0)
-                    material_data[material] += 1
-
-                # get data for breed_data
-                if 'organism' in item['_source'] and 'breed' in \
-                        item['_source']['organism']:
-                    organism = item['_source']['organism']['organism']['text']
-                    breed = item['_source']['organism']['breed']['text']
-                    breed_data.setdefault(organism, {})
-                    breed_data[organism].setdefault(breed, 0)
-                    breed_data[organism][breed] += 1
-
-            # create document for es
-            data[sex_summary_name] = create_summary_document_for_es(sex_data)
-            data[paper_published_summary_name] = \
-                create_summary_document_for_es(paper_published_data)
-            data[standard_summary_name] = create_summary_document_for_es(
-                standard_data)
-            data[cell_type_summary_name] = create_summary_document_for_es(
-                cell_type_data)
-            data[organism_summary_name] = create_summary_document_for_es(
-                organism_data)
-            data[material_summary_name] = create_summary_document_for_es(
-                material_data)
-            data[breed_summary_name] = create_summary_document_for_breeds(
-                breed_data)
+            suffix = 'FAANGOnly' if legacy else ''
+            data[f'sexSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['sex'])
+            data[f'paperPublishedSummary{suffix}'] = create_summary_document_for_es(
+                counts[legacy]['paperPublished'])
+            data[f'standardSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['standard'])
+            data[f'cellTypeSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['cellType'])
+            data[f'organismSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['organism'])
+            data[f'materialSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['material'])
+            data[f'breedSummary{suffix}'] = create_summary_document_for_breeds(counts[legacy]['breed'])
         body = json.dumps(data)
         self.es_instance.index(index="summary_specimen", doc_type="_doc",
                                id="summary_specimen", body=body)
@@ -200,53 +103,14 @@ class CreateSummary:
         This function will parse dataset data and create summary document for es
         """
         data = dict()
+        counts = self.get_counts('dataset', self.count_dataset_records)
         for legacy in [False, True]:
-            body = dict()
-            standard_summary_name = 'standardSummary'
-            paper_published_summary_name = 'paperPublishedSummary'
-            specie_summary_name = 'specieSummary'
-            assay_type_summary_name = 'assayTypeSummary'
-            if legacy:
-                body = {
-                    'query': {
-                        'bool': {
-                            'filter': {
-                                'term': {'standardMet': 'FAANG'}
-                            }
-                        }
-                    }
-                }
-                standard_summary_name = 'standardSummaryFAANGOnly'
-                paper_published_summary_name = 'paperPublishedSummaryFAANGOnly'
-                specie_summary_name = 'specieSummaryFAANGOnly'
-                assay_type_summary_name = 'assayTypeSummaryFAANGOnly'
-            results = self.es_instance.search(index='dataset', doc_type='_doc',
-                                              body=body, size=1000000)
-            standard_data = get_standard(results['hits']['hits'])
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
-            species_data = dict()
-            assay_type_data = dict()
-            for item in results['hits']['hits']:
-                # get data for species_data
-                for specie in item['_source']['species']:
-                    species_data.setdefault(specie['text'], 0)
-                    species_data[specie['text']] += 1
-
-                # get data for assay_type_data
-                for assay_type in item['_source']['assayType']:
-                    assay_type_data.setdefault(assay_type, 0)
-                    assay_type_data[assay_type] += 1
-
-            # create document for es
-            data[standard_summary_name] = create_summary_document_for_es(
-                standard_data)
-            data[paper_published_summary_name] = create_summary_document_for_es(
-                paper_published_data)
-            data[specie_summary_name] = create_summary_document_for_es(
-                species_data)
-            data[assay_type_summary_name] = create_summary_document_for_es(
-                assay_type_data)
+            suffix = 'FAANGOnly' if legacy else ''
+            data[f'standardSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['standard'])
+            data[f'paperPublishedSummary{suffix}'] = create_summary_document_for_es(
+                counts[legacy]['paperPublished'])
+            data[f'specieSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['species'])
+            data[f'assayTypeSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['assayType'])
         body = json.dumps(data)
         self.es_instance.index(index="summary_dataset", doc_type="_doc",
                                id="summary_dataset", body=body)
@@ -256,61 +120,316 @@ class CreateSummary:
         This function will parse file data and create summary document for es
         """
         data = dict()
+        counts = self.get_counts('file', self.count_file_records)
         for legacy in [False, True]:
-            body = dict()
-            standard_summary_name = 'standardSummary'
-            paper_published_summary_name = 'paperPublishedSummary'
-            specie_summary_name = 'specieSummary'
-            assay_type_summary_name = 'assayTypeSummary'
+            suffix = 'FAANGOnly' if legacy else ''
+            data[f'standardSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['standard'])
+            data[f'paperPublishedSummary{suffix}'] = create_summary_document_for_es(
+                counts[legacy]['paperPublished'])
+            data[f'specieSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['species'])
+            data[f'assayTypeSummary{suffix}'] = create_summary_document_for_es(counts[legacy]['assayType'])
+        body = json.dumps(data)
+        self.es_instance.index(index="summary_file", doc_type="_doc",
+                               id="summary_file", body=body)
+
+    def get_counts(self, index, count_records):
+        """
+        This function will get the counts of one index for all records (key False) and FAANG only records (key True)
+        :param index: the name of the index
+        :param count_records: the function counting the records by reading all documents
+        :return: dict having legacy flag as keys and the counts as values
+        """
+        if self.use_aggregations:
+            return self.aggregate_records(index)
+        counts = dict()
+        for legacy in [False, True]:
+            query = None
             if legacy:
-                body = {
-                    'query': {
-                        'bool': {
-                            'filter': {
-                                'term': {'experiment.standardMet': 'FAANG'}
-                            }
+                query = {
+                    'bool': {
+                        'filter': {
+                            'term': {SUMMARY_AGGREGATION_FIELDS[index]['standard']: 'FAANG'}
                         }
                     }
                 }
-                standard_summary_name = 'standardSummaryFAANGOnly'
-                paper_published_summary_name = 'paperPublishedSummaryFAANGOnly'
-                specie_summary_name = 'specieSummaryFAANGOnly'
-                assay_type_summary_name = 'assayTypeSummaryFAANGOnly'
-            results = self.es_instance.search(index='file', doc_type='_doc',
-                                              body=body, size=1000000)
-            standard_data = dict()
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
-            species_data = dict()
-            assay_type_data = dict()
-            for item in results['hits']['hits']:
-                # get data for standard_data
-                standard = item['_source']['experiment']['standardMet']
-                standard_data.setdefault(standard, 0)
-                standard_data[standard] += 1
-
-                # get data for species_data
-                specie = item['_source']['species']['text']
-                species_data.setdefault(specie, 0)
-                species_data[specie] += 1
-
-                # get data for assay_type_data
-                assay_type = item['_source']['experiment']['assayType']
+            counts[legacy] = count_records(query)
+        return counts
+
+    def aggregate_records(self, index):
+        """
+        This function will count the records of one index with a single aggregation request, the FAANG only counts
+        are computed in a filter bucket holding the same aggregations
+        :param index: the name of the index
+        :return: dict having legacy flag as keys and the counts as values
+        """
+        fields = SUMMARY_AGGREGATION_FIELDS[index]
+        aggs = {
+            'standard': {'terms': {'field': fields['standard'], 'size': SUMMARY_TERMS_SIZE}},
+            'standardMissing': {'missing': {'field': fields['standard']}},
+            'paperPublished': {'filter': {'term': {'paperPublished': 'true'}}}
+        }
+        if 'sex' in fields:
+            aggs['sex'] = {'terms': {'field': fields['sex'], 'size': SUMMARY_TERMS_SIZE,
+                                     'missing': 'not determined'}}
+        for name, field in fields['terms'].items():
+            aggs[name] = {'terms': {'field': field, 'size': SUMMARY_TERMS_SIZE}}
+        if 'breed' in fields:
+            species_field, breed_field = fields['breed']
+            aggs['breed'] = {
+                'terms': {'field': species_field, 'size': SUMMARY_TERMS_SIZE},
+                'aggs': {
+                    'breed': {'terms': {'field': breed_field, 'size': SUMMARY_TERMS_SIZE}}
+                }
+            }
+        body = {
+            'size': 0,
+            'aggs': dict(aggs)
+        }
+        body['aggs']['FAANGOnly'] = {
+            'filter': {'term': {fields['standard']: 'FAANG'}},
+            'aggs': aggs
+        }
+        results = self.es_instance.search(index=index, doc_type='_doc', body=body)
+        return {
+            False: parse_aggregations(results['aggregations'], results['hits']['total'], fields),
+            True: parse_aggregations(results['aggregations']['FAANGOnly'],
+                                     results['aggregations']['FAANGOnly']['doc_count'], fields)
+        }
+
+    def count_organism_records(self, query):
+        """
+        This function will count the organism records by reading all matching documents
+        :param query: the query clause selecting the records, None for all records
+        :return: dict having the summary names as keys and the counts as values
+        """
+        standard_data = dict()
+        sex_data = dict()
+        paper_published_data = {'yes': 0, 'no': 0}
+        organism_data = dict()
+        breed_data = dict()
+        for item in iterate_records(self.es_instance, 'organism', ORGANISM_SUMMARY_FIELDS, query):
+            count_standard_and_paper(item, standard_data, paper_published_data)
+
+            # get data for sex_data
+            sex = convert_sex(item['_source']['sex']['text'])
+            sex_data.setdefault(sex, 0)
+            sex_data[sex] += 1
+
+            # get data for organism_data
+            organism = item['_source']['organism']['text']
+            organism_data.setdefault(organism, 0)
+            organism_data[organism] += 1
+
+            # get data for breed_data
+            breed = item['_source']['breed']['text']
+            breed_data.setdefault(organism, {})
+            breed_data[organism].setdefault(breed, 0)
+            breed_data[organism][breed] += 1
+        return {
+            'standard': standard_data,
+            'sex': sex_data,
+            'paperPublished': paper_published_data,
+            'organism': organism_data,
+            'breed': breed_data
+        }
+
+    def count_specimen_records(self, query):
+        """
+        This function will count the specimen records by reading all matching documents
+        :param query: the query clause selecting the records, None for all records
+        :return: dict having the summary names as keys and the counts as values
+        """
+        sex_data = dict()
+        paper_published_data = {'yes': 0, 'no': 0}
+        standard_data = dict()
+        cell_type_data = dict()
+        organism_data = dict()
+        material_data = dict()
+        breed_data = dict()
+        for item in iterate_records(self.es_instance, 'specimen', SPECIMEN_SUMMARY_FIELDS, query):
+            count_standard_and_paper(item, standard_data, paper_published_data)
+
+            # get data for sex_data
+            if 'sex' in item['_source']['organism']:
+                sex = convert_sex(item['_source']['organism']['sex']['text'])
+            else:
+                sex = 'not determined'
+            sex_data.setdefault(sex, 0)
+            sex_data[sex] += 1
+
+            # get data for cell_type_data
+            if 'cellType' in item['_source']:
+                cell_type_data.setdefault(
+                    item['_source']['cellType']['text'], 0)
+                cell_type_data[item['_source']['cellType']['text']] += 1
+
+            # get data for organism_data
+            if 'organism' in item['_source']:
+                organism = item['_source']['organism']['organism']['text']
+                organism_data.setdefault(organism, 0)
+                organism_data[organism] += 1
+
+            # get data for material_data
+            if 'material' in item['_source']:
+                material = item['_source']['material']['text']
+                material_data.setdefault(material, 0)
+                material_data[material] += 1
+
+            # get data for breed_data
+            if 'organism' in item['_source'] and 'breed' in \
+                    item['_source']['organism']:
+                organism = item['_source']['organism']['organism']['text']
+                breed = item['_source']['organism']['breed']['text']
+                breed_data.setdefault(organism, {})
+                breed_data[organism].setdefault(breed, 0)
+                breed_data[organism][breed] += 1
+        return {
+            'standard': standard_data,
+            'sex': sex_data,
+            'paperPublished': paper_published_data,
+            'cellType': cell_type_data,
+            'organism': organism_data,
+            'material': material_data,
+            'breed': breed_data
+        }
+
+    def count_dataset_records(self, query):
+        """
+        This function will count the dataset records by reading all matching documents
+        :param query: the query clause selecting the records, None for all records
+        :return: dict having the summary names as keys and the counts as values
+        """
+        standard_data = dict()
+        paper_published_data = {'yes': 0, 'no': 0}
+        species_data = dict()
+        assay_type_data = dict()
+        for item in iterate_records(self.es_instance, 'dataset', DATASET_SUMMARY_FIELDS, query):
+            count_standard_and_paper(item, standard_data, paper_published_data)
+
+            # get data for species_data
+            for specie in item['_source']['species']:
+                species_data.setdefault(specie['text'], 0)
+                species_data[specie['text']] += 1
+
+            # get data for assay_type_data
+            for assay_type in item['_source']['assayType']:
                 assay_type_data.setdefault(assay_type, 0)
                 assay_type_data[assay_type] += 1
+        return {
+            'standard': standard_data,
+            'paperPublished': paper_published_data,
+            'species': species_data,
+            'assayType': assay_type_data
+        }
 
-            # create document for es
-            data[standard_summary_name] = create_summary_document_for_es(
-                standard_data)
-            data[paper_published_summary_name] = create_summary_document_for_es(
-                paper_published_data)
-            data[specie_summary_name] = create_summary_document_for_es(
-                species_data)
-            data[assay_type_summary_name] = create_summary_document_for_es(
-                assay_type_data)
-        body = json.dumps(data)
-        self.es_instance.index(index="summary_file", doc_type="_doc",
-                               id="summary_file", body=body)
+    def count_file_records(self, query):
+        """
+        This function will count the file records by reading all matching documents
+        :param query: the query clause selecting the records, None for all records
+        :return: dict having the summary names as keys and the counts as values
+        """
+        standard_data = dict()
+        paper_published_data = {'yes': 0, 'no': 0}
+        species_data = dict()
+        assay_type_data = dict()
+        for item in iterate_records(self.es_instance, 'file', FILE_SUMMARY_FIELDS, query):
+            # the standard of files is counted from their experiments
+            count_standard_and_paper(item, dict(), paper_published_data)
+
+            # get data for standard_data
+            standard = item['_source']['experiment']['standardMet']
+            standard_data.setdefault(standard, 0)
+            standard_data[standard] += 1
+
+            # get data for species_data
+            specie = item['_source']['species']['text']
+            species_data.setdefault(specie, 0)
+            species_data[specie] += 1
+
+            # get data for assay_type_data
+            assay_type = item['_source']['experiment']['assayType']
+            assay_type_data.setdefault(assay_type, 0)
+            assay_type_data[assay_type] += 1
+        return {
+            'standard': standard_data,
+            'paperPublished': paper_published_data,
+            'species': species_data,
+            'assayType': assay_type_data
+        }
+
+
+def count_standard_and_paper(item, standard_data, paper_published_data):
+    """
+    This function will add one document to the standard and paper published counts
+    :param item: the document to count
+    :param standard_data: dict with standards names as keys and number of documents as values
+    :param paper_published_data: dict with yes and no as keys and number of documents as values
+    """
+    standard = item['_source'].get('standardMet', None)
+    standard_data.setdefault(standard, 0)
+    standard_data[standard] += 1
+    if item['_source'].get('paperPublished', None) == 'true':
+        paper_published_data['yes'] += 1
+    else:
+        paper_published_data['no'] += 1
+
+
+def convert_sex(sex):
+    """
+    This function will group the sex values into male, female and not determined
+    :param sex: the sex value of the record
+    :return: the group of the sex value
+    """
+    if sex in MALES:
+        return 'male'
+    elif sex in FEMALES:
+        return 'female'
+    return 'not determined'
+
+
+def parse_aggregations(aggregations, total, fields):
+    """
+    This function will convert the aggregation results into the same counts as reading all documents
+    :param aggregations: the aggregation results of one variant, all records or FAANG only records
+    :param total: the number of records in the variant
+    :param fields: the aggregation fields of the index from SUMMARY_AGGREGATION_FIELDS
+    :return: dict having the summary names as keys and the counts as values
+    """
+    counts = dict()
+    standard_data = dict()
+    for bucket in aggregations['standard']['buckets']:
+        standard_data[bucket['key']] = bucket['doc_count']
+    if aggregations['standardMissing']['doc_count'] > 0:
+        standard_data[None] = aggregations['standardMissing']['doc_count']
+    counts['standard'] = standard_data
+
+    published = aggregations['paperPublished']['doc_count']
+    counts['paperPublished'] = {'yes': published, 'no': total - published}
+
+    if 'sex' in fields:
+        sex_data = dict()
+        for bucket in aggregations['sex']['buckets']:
+            sex = convert_sex(bucket['key'])
+            sex_data.setdefault(sex, 0)
+            sex_data[sex] += bucket['doc_count']
+        counts['sex'] = sex_data
+
+    for name in fields['terms']:
+        counts[name] = dict()
+        for bucket in aggregations[name]['buckets']:
+            counts[name][bucket['key']] = bucket['doc_count']
+
+    if 'breed' in fields:
+        breed_data = dict()
+        for species_bucket in aggregations['breed']['buckets']:
+            # species without any breed are not part of the breed summary
+            if not species_bucket['breed']['buckets']:
+                continue
+            breed_data[species_bucket['key']] = dict()
+            for breed_bucket in species_bucket['breed']['buckets']:
+                breed_data[species_bucket['key']][breed_bucket['key']] = breed_bucket['doc_count']
+        counts['breed'] = breed_data
+    return counts
 
 
 if __name__ == "__main__":
@@ -322,7 +441,8 @@ if __name__ == "__main__":
 
     # Create summary data for each of the indeces and write it to staging es
     summary_object = CreateSummary(es_instance=es_staging,
-                                   logger_instance=logger)
+                                   logger_instance=logger,
+                                   use_aggregations=True)
     summary_object.create_organism_summary()
     summary_object.create_specimen_summary()
     summary_object.create_dataset_summary()
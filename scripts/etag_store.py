@@ -0,0 +1,141 @@
+"""
+Local persistent store of the BioSamples etags, keyed by the BioSamples accession
+Each entry records when the etag was fetched from BioSamples and when the accession was last seen in the FAANG
+accession list, so that only new, updated or stale entries need to be fetched again
+"""
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Set, Tuple
+
+ETAG_STORE_FILENAME = 'etag_store.db'
+# the fixed width format keeps the stored times comparable as strings
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class EtagStore:
+    def __init__(self, filename=ETAG_STORE_FILENAME):
+        """
+        Open the store, the file and the tables are created if not existing
+        :param filename: the SQLite file holding the store
+        """
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS etags (accession TEXT PRIMARY KEY, etag TEXT NOT NULL, '
+                                'fetched_at TEXT NOT NULL, seen_at TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM etags').fetchone()[0]
+
+    def __contains__(self, accession):
+        return self.get(accession) is not None
+
+    def get(self, accession: str):
+        """
+        Get the etag of one accession
+        :param accession: the BioSamples accession
+        :return: the etag, None if not in the store
+        """
+        row = self.connection.execute('SELECT etag FROM etags WHERE accession = ?', (accession,)).fetchone()
+        return row[0] if row else None
+
+    def get_all(self) -> Dict[str, str]:
+        """
+        Get the etags of all accessions seen in the last refresh
+        :return: dict having accessions as keys and etags as values
+        """
+        last_refresh = self.get_last_refresh()
+        if last_refresh is None:
+            return dict()
+        rows = self.connection.execute('SELECT accession, etag FROM etags WHERE seen_at >= ? ORDER BY accession',
+                                       (last_refresh.strftime(TIME_FORMAT),))
+        return dict(rows)
+
+    def get_accessions(self) -> Set[str]:
+        """
+        Get all accessions in the store
+        :return: set of accessions
+        """
+        return {row[0] for row in self.connection.execute('SELECT accession FROM etags')}
+
+    def get_stale(self, max_age_days: int) -> Set[str]:
+        """
+        Get the accessions whose etag was fetched more than the given number of days ago
+        :param max_age_days: the maximum age of the etags
+        :return: set of accessions
+        """
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime(TIME_FORMAT)
+        rows = self.connection.execute('SELECT accession FROM etags WHERE fetched_at < ?', (cutoff,))
+        return {row[0] for row in rows}
+
+    def upsert_many(self, etags: Iterable[Tuple[str, str]], fetched_at: datetime = None):
+        """
+        Insert or replace the etags
+        :param etags: pairs of accession and etag
+        :param fetched_at: the time when the etags were fetched, default to be now
+        """
+        fetched_at = (fetched_at or datetime.now()).strftime(TIME_FORMAT)
+        self.connection.executemany('INSERT OR REPLACE INTO etags (accession, etag, fetched_at, seen_at) '
+                                    'VALUES (?, ?, ?, ?)',
+                                    ((accession, etag, fetched_at, fetched_at) for accession, etag in etags))
+        self.connection.commit()
+
+    def mark_seen(self, accessions: Iterable[str], seen_at: datetime):
+        """
+        Record that the accessions are still listed in BioSamples
+        :param accessions: the accessions in the current FAANG accession list
+        :param seen_at: the time of the listing
+        """
+        self.connection.executemany('UPDATE etags SET seen_at = ? WHERE accession = ?',
+                                    ((seen_at.strftime(TIME_FORMAT), accession) for accession in accessions))
+        self.connection.commit()
+
+    def prune(self, days_to_keep: int) -> int:
+        """
+        Remove the accessions which have not been seen in BioSamples for the given number of days
+        :param days_to_keep: the number of days
+        :return: the number of removed accessions
+        """
+        cutoff = (datetime.now() - timedelta(days=days_to_keep)).strftime(TIME_FORMAT)
+        cursor = self.connection.execute('DELETE FROM etags WHERE seen_at < ?', (cutoff,))
+        self.connection.commit()
+        self.connection.execute('VACUUM')
+        return cursor.rowcount
+
+    def get_failed(self) -> Set[str]:
+        """
+        Get the accessions whose etag could not be fetched in the last refresh
+        :return: set of accessions
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'failed'").fetchone()
+        return set(json.loads(row[0])) if row else set()
+
+    def set_failed(self, accessions: Iterable[str]):
+        """
+        Record the accessions whose etag could not be fetched, replacing the ones of the previous refresh
+        :param accessions: the accessions
+        """
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('failed', ?)",
+                                (json.dumps(sorted(accessions)),))
+        self.connection.commit()
+
+    def get_last_refresh(self):
+        """
+        Get the start time of the last completed refresh
+        :return: the time, None if the store has never been refreshed
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'last_refresh'").fetchone()
+        return datetime.strptime(row[0], TIME_FORMAT) if row else None
+
+    def set_last_refresh(self, refreshed_at: datetime):
+        """
+        Record the start time of the completed refresh
+        :param refreshed_at: the time when the refresh started
+        """
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_refresh', ?)",
+                                (refreshed_at.strftime(TIME_FORMAT),))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -8,11 +8,13 @@ dataset
 Using the example above, each individual sample between SAMN11119414-SAMN11119461 will have the article PMC6500009
 """
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from elasticsearch import Elasticsearch
 import click
 from utils import write_system_log, get_line_number, remove_underscore_from_end_prefix, get_record_ids, \
-    get_record_details, insert_into_es
-from constants import STAGING_NODE1, DEFAULT_PREFIX, STANDARD_FAANG
+    get_record_details, insert_into_es, flush_bulk_writer, create_http_session, request_with_retry, RateLimiter, \
+    get_bulk_writer
+from constants import STAGING_NODE1, DEFAULT_PREFIX, STANDARD_FAANG, EUROPE_PMC_API_URL, ENA_XREF_API_URL
 from typing import Dict, Set, List
 
 
@@ -32,6 +34,8 @@ ARTICLE_MAPPING = {
     'isOpenAccess': 'isOpenAccess'
 }
 ARTICLE_BASIC_FIELDS = {'title', 'year', 'journal'}
+EPMC_SEARCH_API = f'{EUROPE_PMC_API_URL}/search'
+ENA_XREF_API = f'{ENA_XREF_API_URL}/search'
 
 to_es_flag = True
 es = None
@@ -56,12 +60,25 @@ es = None
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
-def main(es_hosts, es_index_prefix, to_es):
+@click.option(
+    '--concurrency',
+    default="8",
+    help='Specify how many requests could be sent to Europe PMC and ENA at the same time, default to be 8'
+)
+@click.option(
+    '--rate_limit',
+    default="10",
+    help='Specify the maximum number of requests per second sent to Europe PMC and ENA, default to be 10. '
+         '0 means no limit'
+)
+def main(es_hosts, es_index_prefix, to_es, concurrency, rate_limit):
     """
     Main function that will import publications for all entities
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param concurrency: the number of requests sent to the remote apis at the same time
+    :param rate_limit: the maximum number of requests per second sent to the remote apis
     :return:
     """
     global to_es_flag
@@ -72,6 +89,12 @@ def main(es_hosts, es_index_prefix, to_es):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    try:
+        concurrency = int(concurrency)
+        rate_limit = float(rate_limit)
+    except ValueError:
+        print(f'concurrency {concurrency} and rate_limit {rate_limit} parameters need to be numbers')
+        exit(1)
 
     global es
     hosts = es_hosts.split(";")
@@ -104,58 +127,21 @@ def main(es_hosts, es_index_prefix, to_es):
     # one dataset could have multiple articles, keys are dataset id, same naming pattern for other record type
     article_for_datasets: Dict[str, Set] = dict()
 
-    # for all datasets existing in the Elasticsearch, search for the publications based on the dataset accession
-    for dataset_id in datasets.keys():
-        # logging progress, not related to the main algorithm
-        dataset_count = dataset_count + 1
-        if dataset_count % 200 == 0:
-            write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Processed {dataset_count} datasets',
-                             to_es_flag)
-        # get dataset related publication using europe PMC search API
-        url = f"https://www.ebi.ac.uk/europepmc/webservices/rest/search?query={dataset_id}&format=json"
-        epmc_result = requests.get(url).json()
-        epmc_hits = epmc_result['resultList']['result']
-
-        manual_hits = list()
-        # if article not found directly from EuropePMC, use the information annotated in the ENA
-        if not epmc_hits:
-            xref_results = get_article_from_xref(dataset_id)
-            for xref_result in xref_results:
-                url = f"https://www.ebi.ac.uk/europepmc/webservices/rest/search?query={xref_result}&format=json"
-                manual_result = requests.get(url).json()
-                manual_hits.append(manual_result['resultList']['result'][0])
-
-        for hit in epmc_hits + manual_hits:
-            # ignore preprints determined by two fields pubType and source
-            if 'pubType' in hit and hit['pubType'] == 'preprint':
-                continue
-            if 'source' in hit and hit['source'] == 'PPR':
-                continue
-            # determine the article id which will be used in ES, PMC id is preferred, because
-            # 1) it has PMC prefix rather than a string of digits
-            # 2) PMC guarantees open access, more likely to have dataset accession linked
-            article_id = determine_article_id(hit)
-            if len(article_id) == 0:
-                write_system_log(es, SCRIPT_NAME, 'error', get_line_number(),
-                                 f'Study {dataset_id} has related article without Identifier', to_es_flag)
-                continue
-            # new article
-            if article_id not in article_details:
-                es_article = dict()
-                for k, v in ARTICLE_MAPPING.items():
-                    es_article = parse_field(es_article, hit, k, v)
-                article_details[article_id] = es_article
-                article_basic_info = dict()
-                # the article information displayed in other entities
-                article_basic_info['articleId'] = article_id
-                for k in ARTICLE_BASIC_FIELDS:
-                    article_basic_info = parse_field(article_basic_info, hit, k, ARTICLE_MAPPING[k])
-                article_basics[article_id] = article_basic_info
-
-            article_datasets.setdefault(article_id, set())
-            article_datasets[article_id].add(dataset_id)
-            article_for_datasets.setdefault(dataset_id, set())
-            article_for_datasets[dataset_id].add(article_id)
+    # the publications of all datasets are searched concurrently, the results are consumed in the dataset order
+    session = create_http_session(concurrency)
+    rate_limiter = RateLimiter(rate_limit)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        dataset_hits = executor.map(lambda dataset_id: fetch_articles_for_dataset(session, rate_limiter, dataset_id),
+                                    datasets.keys())
+        # for all datasets existing in the Elasticsearch, search for the publications based on the dataset accession
+        for dataset_id, hits in zip(datasets.keys(), dataset_hits):
+            # logging progress, not related to the main algorithm
+            dataset_count = dataset_count + 1
+            if dataset_count % 200 == 0:
+                write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Processed {dataset_count} datasets',
+                                 to_es_flag)
+            add_articles_for_dataset(dataset_id, hits, article_details, article_basics, article_datasets,
+                                     article_for_datasets)
 
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
                      f'Retrieved {len(article_details)} articles from all datasets', to_es_flag)
@@ -217,9 +203,79 @@ def main(es_hosts, es_index_prefix, to_es):
     update_article_info(article_basics, article_for_organisms, es_index_prefix, 'organism',
                         organism_with_publications)
 
+    flush_bulk_writer(es)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finishing importing article', to_es_flag)
 
 
+def fetch_articles_for_dataset(session, rate_limiter, dataset_id):
+    """
+    Search the publications of one dataset in Europe PMC, if nothing found, use the publications annotated in the ENA
+    This function is run concurrently for all datasets, so it must not change any shared data
+    :param session: the http session shared by all threads
+    :param rate_limiter: the rate limiter shared by all threads
+    :param dataset_id: the dataset accession
+    :return: the list of Europe PMC hits
+    """
+    # get dataset related publication using europe PMC search API
+    epmc_result = request_with_retry(session, EPMC_SEARCH_API, rate_limiter=rate_limiter,
+                                     params={'query': dataset_id, 'format': 'json'}).json()
+    epmc_hits = epmc_result['resultList']['result']
+
+    manual_hits = list()
+    # if article not found directly from EuropePMC, use the information annotated in the ENA
+    if not epmc_hits:
+        xref_results = get_article_from_xref(dataset_id, session, rate_limiter)
+        for xref_result in xref_results:
+            manual_result = request_with_retry(session, EPMC_SEARCH_API, rate_limiter=rate_limiter,
+                                               params={'query': xref_result, 'format': 'json'}).json()
+            manual_hits.append(manual_result['resultList']['result'][0])
+    return epmc_hits + manual_hits
+
+
+def add_articles_for_dataset(dataset_id, hits, article_details, article_basics, article_datasets,
+                             article_for_datasets):
+    """
+    Add the publications found for one dataset into the article collections
+    :param dataset_id: the dataset accession
+    :param hits: the Europe PMC hits of the dataset
+    :param article_details: detailed article information, keys are article id
+    :param article_basics: basic article information used in related records, keys are article id
+    :param article_datasets: the datasets of each article, keys are article id
+    :param article_for_datasets: the articles of each dataset, keys are dataset id
+    """
+    for hit in hits:
+        # ignore preprints determined by two fields pubType and source
+        if 'pubType' in hit and hit['pubType'] == 'preprint':
+            continue
+        if 'source' in hit and hit['source'] == 'PPR':
+            continue
+        # determine the article id which will be used in ES, PMC id is preferred, because
+        # 1) it has PMC prefix rather than a string of digits
+        # 2) PMC guarantees open access, more likely to have dataset accession linked
+        article_id = determine_article_id(hit)
+        if len(article_id) == 0:
+            write_system_log(es, SCRIPT_NAME, 'error', get_line_number(),
+                             f'Study {dataset_id} has related article without Identifier', to_es_flag)
+            continue
+        # new article
+        if article_id not in article_details:
+            es_article = dict()
+            for k, v in ARTICLE_MAPPING.items():
+                es_article = parse_field(es_article, hit, k, v)
+            article_details[article_id] = es_article
+            article_basic_info = dict()
+            # the article information displayed in other entities
+            article_basic_info['articleId'] = article_id
+            for k in ARTICLE_BASIC_FIELDS:
+                article_basic_info = parse_field(article_basic_info, hit, k, ARTICLE_MAPPING[k])
+            article_basics[article_id] = article_basic_info
+
+        article_datasets.setdefault(article_id, set())
+        article_datasets[article_id].add(dataset_id)
+        article_for_datasets.setdefault(dataset_id, set())
+        article_for_datasets[dataset_id].add(article_id)
+
+
 def extract_article_from_related_entity(source_data, source_article_data,
                                         relationship_key, relationship_secondary_key=''):
     """
@@ -247,6 +303,10 @@ def extract_article_from_related_entity(source_data, source_article_data,
             for record in tmp:
                 if len(relationship_secondary_key) == 0:
                     target_id = record
+                elif relationship_secondary_key not in record:
+                    # legacy specimens only keep organism, sex and breed in the organism section,
+                    # the animal they come from is in derivedFrom
+                    continue
                 else:
                     target_id = record[relationship_secondary_key]
                 result.setdefault(target_id, set())
@@ -266,6 +326,10 @@ def update_article_info(article_basics, article_for_others, es_index_prefix, rec
     :param records_with_publication: the existing publication information within the records, optional
     :return:
     """
+    # the updates are sent in bulk, the records failed to be updated are reported into the log index
+    writer = get_bulk_writer(es)
+    failed_before = writer.failed
+    updated = 0
     for record_id in article_for_others:
         # compare the articles already linked to the record with the newly calculated one
         # if they are identical, that record does not need to be updated for article information
@@ -295,16 +359,15 @@ def update_article_info(article_basics, article_for_others, es_index_prefix, rec
             for article_id in article_for_others[record_id]:
                 publications.append(article_basics[article_id])
             body = {
-                "doc":
-                    {"paperPublished": "true",
-                     "publishedArticles": publications
-                     }
+                "paperPublished": "true",
+                "publishedArticles": publications
             }
-            try:
-                es.update(index=f'{es_index_prefix}_{record_type}', doc_type="_doc", id=record_id, body=body)
-            except ValueError:
-                print(f"Update goes wrong {record_id} in {record_type}")
-                continue
+            writer.update(es_index_prefix, record_type, record_id, body)
+            updated += 1
+    flush_bulk_writer(es)
+    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                     f'{updated} out of {len(article_for_others)} {record_type} records need article update, '
+                     f'{writer.failed - failed_before} failed', to_es_flag)
 
 
 def get_records_with_publications(es_host: str, es_index_prefix: str, record_type: str):
@@ -359,10 +422,17 @@ def determine_article_id(epmc_hit):
         return ""
 
 
-def get_article_from_xref(study_accession: str):
-    url = f'https://www.ebi.ac.uk/ena/xref/rest/json/search?accession={study_accession}'
+def get_article_from_xref(study_accession: str, session=requests, rate_limiter=None):
+    """
+    Get the publications annotated for the study in the ENA
+    :param study_accession: the study accession
+    :param session: the http session to use, by default a new connection for each request
+    :param rate_limiter: the optional rate limiter shared with other requests
+    :return: the list of PubMed and Europe PMC ids
+    """
     results = list()
-    query_results = requests.get(url).json()
+    query_results = request_with_retry(session, ENA_XREF_API, rate_limiter=rate_limiter,
+                                       params={'accession': study_accession}).json()
     for result in query_results:
         if result['Source'] == 'PubMed' or result['Source'] == 'EuropePMC':
             results.append(result['Source Primary Accession'])
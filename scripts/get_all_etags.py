@@ -1,52 +1,181 @@
+"""
+Refresh the local etag store with the etags of all FAANG BioSamples records
+Only the etags of new accessions, accessions updated in BioSamples since the last refresh and entries older than
+the maximum age are fetched, all others are kept from the previous refresh
+"""
 import aiohttp
 import asyncio
+import click
+import random
 import requests
-from datetime import date
-ETAG = []
-ETAG_IDS = []
-ACCESSION_API = 'https://www.ebi.ac.uk/biosamples/accessions?filter=attr:project:FAANG&size=100000'
+import time
+from datetime import datetime, timedelta
+from etag_store import EtagStore
+from constants import BIOSAMPLES_API_URL
+# keys are accessions, values are the fetched etags
+ETAG = dict()
+# the accessions whose etag could not be fetched after all retries
+FAILED_IDS = set()
+ACCESSION_API = f'{BIOSAMPLES_API_URL}/accessions?filter=attr:project:FAANG&size=100000'
+SAMPLE_API = f'{BIOSAMPLES_API_URL}/samples'
+# the number of etag requests sent at the same time
+CONCURRENCY = 50
+RETRIES = 5
+# the base waiting time in seconds before trying again, doubled after each failed attempt
+BACKOFF = 1
+REQUEST_TIMEOUT = 60
+# print the progress after this number of accessions
+PROGRESS_INTERVAL = 5000
 
-def main():
+
+@click.command()
+@click.option(
+    '--max_age',
+    default="7",
+    help='Specify after how many days the stored etags are fetched again even if not reported as updated, '
+         'default to be 7'
+)
+@click.option(
+    '--concurrency',
+    default=str(CONCURRENCY),
+    help=f'Specify how many etag requests are sent to BioSamples at the same time, default to be {CONCURRENCY}'
+)
+def main(max_age, concurrency):
+    """
+    The main function
+    :param max_age: the maximum age in days of the stored etags
+    :param concurrency: the number of etag requests sent at the same time
+    """
+    try:
+        max_age = int(max_age)
+        concurrency = int(concurrency)
+    except ValueError:
+        print(f"The provided parameter values {max_age} and {concurrency} need to be integers")
+        exit(1)
+    refresh_started = datetime.now()
+    store = EtagStore()
+    last_refresh = store.get_last_refresh()
     biosample_ids = fetch_biosample_ids()
     if len(biosample_ids) < 5000:
         print(f"The number of returned BioSamples accessions is {len(biosample_ids)}, "
               f"less than 5000 and very suspicious.\n"
               f"Please manually check {ACCESSION_API}")
-    asyncio.get_event_loop().run_until_complete(fetch_all_etags(biosample_ids))
-    if len(biosample_ids) != len(ETAG_IDS):
-        for my_id in biosample_ids:
-            if my_id not in ETAG_IDS:
-                resp = requests.get("http://www.ebi.ac.uk/biosamples/samples/{}".format(my_id)).headers
-                if 'ETag' in resp and resp['ETag']:
-                    ETAG.append("{}\t{}".format(my_id, resp['ETag']))
+    store.mark_seen(biosample_ids, refresh_started)
+
+    to_fetch = set(biosample_ids) - store.get_accessions()
+    print(f"{len(to_fetch)} new accessions")
+    if last_refresh:
+        # one day overlap to cover the records updated during the last refresh
+        updated_from = (last_refresh - timedelta(days=1)).strftime('%Y-%m-%d')
+        try:
+            updated = set(fetch_biosample_ids(updated_from)) & set(biosample_ids)
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            print("Could not get the list of updated accessions, fetching all etags")
+            updated = set(biosample_ids)
+        print(f"{len(updated)} accessions updated since {updated_from}")
+        to_fetch.update(updated)
+    stale = store.get_stale(max_age) & set(biosample_ids)
+    print(f"{len(stale)} etags older than {max_age} days")
+    to_fetch.update(stale)
+    # the accessions failed last time are not reported as updated again once the last refresh time moves on
+    failed = store.get_failed() & set(biosample_ids)
+    print(f"{len(failed)} etags failed in the last refresh")
+    to_fetch.update(failed)
+
+    asyncio.get_event_loop().run_until_complete(fetch_all_etags(to_fetch, concurrency))
+    if FAILED_IDS:
+        print(f"Could not fetch the etags of {len(FAILED_IDS)} accessions: {sorted(FAILED_IDS)}")
+    store.upsert_many(ETAG.items())
+    store.set_failed(FAILED_IDS)
+    store.set_last_refresh(refresh_started)
+    print(f"Fetched {len(ETAG)} etags, {len(store.get_all())} etags in the store")
+    store.close()
+
+
+async def fetch_all_etags(ids, concurrency=CONCURRENCY):
+    """
+    Fetch the etags of the given accessions with a fixed number of workers sharing the connections
+    :param ids: the accessions
+    :param concurrency: the number of workers, i.e. the number of requests sent at the same time
+    """
+    queue = asyncio.Queue()
+    for my_id in ids:
+        queue.put_nowait(my_id)
+    progress = {'done': 0, 'start': time.monotonic()}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        workers = [asyncio.ensure_future(etag_worker(session, queue, progress, len(ids)))
+                   for _ in range(concurrency)]
+        await asyncio.gather(*workers)
+    elapsed = time.monotonic() - progress['start']
+    print(f"Fetched {len(ids)} etags in {elapsed:.0f} seconds")
 
 
-async def fetch_all_etags(ids):
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for my_id in ids:
-            task = asyncio.ensure_future(fetch_etag(session, my_id))
-            tasks.append(task)
-        await asyncio.gather(*tasks, return_exceptions=True)
+async def etag_worker(session, queue, progress, total):
+    """
+    Fetch the etags of the accessions in the queue until it is empty
+    :param session: the aiohttp session shared by all workers
+    :param queue: the queue of accessions
+    :param progress: the number of processed accessions and the start time shared by all workers
+    :param total: the total number of accessions to report the progress
+    """
+    while not queue.empty():
+        my_id = queue.get_nowait()
+        etag_value = await fetch_etag(session, my_id)
+        if etag_value:
+            ETAG[my_id] = etag_value
+        else:
+            FAILED_IDS.add(my_id)
+        progress['done'] += 1
+        if progress['done'] % PROGRESS_INTERVAL == 0:
+            elapsed = time.monotonic() - progress['start']
+            print(f"{progress['done']}/{total} etags fetched, {progress['done'] / elapsed:.1f} per second")
 
 
 async def fetch_etag(session, my_id):
-    url = "http://www.ebi.ac.uk/biosamples/samples/{}".format(my_id)
-    resp = await session.get(url)
-    etag_value = resp.headers.get('ETag')
-    if etag_value:
-        ETAG.append("{}\t{}".format(my_id, etag_value))
-    ETAG_IDS.append(my_id)
+    """
+    Fetch the etag of one accession with a HEAD request, trying again with exponential backoff and jitter on
+    connection errors, too many requests and server side errors
+    :param session: the aiohttp session
+    :param my_id: the accession
+    :return: the etag, None if it could not be fetched
+    """
+    url = f"{SAMPLE_API}/{my_id}"
+    for attempt in range(RETRIES):
+        try:
+            async with session.head(url, allow_redirects=True) as resp:
+                if resp.status == 429 or resp.status >= 500:
+                    raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+                etag_value = resp.headers.get('ETag')
+            if etag_value:
+                return etag_value
+            # some responses only carry the etag with the content
+            async with session.get(url) as resp:
+                if resp.status == 429 or resp.status >= 500:
+                    raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+                return resp.headers.get('ETag')
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == RETRIES - 1:
+                return None
+            await asyncio.sleep(BACKOFF * 2 ** attempt + random.uniform(0, BACKOFF))
+    return None
 
 
-def fetch_biosample_ids():
-    result = requests.get(ACCESSION_API).json()
+def fetch_biosample_ids(updated_from=None):
+    """
+    Get the accessions of all FAANG BioSamples records
+    :param updated_from: only get the records updated since the given date (YYYY-MM-DD), optional
+    :return: list of accessions
+    """
+    url = ACCESSION_API
+    if updated_from:
+        url = f"{url}&filter=dt:update:from={updated_from}"
+    result = requests.get(url).json()
+    if '_embedded' not in result:
+        return list()
     return result['_embedded']['accessions']
 
 
 if __name__ == "__main__":
     main()
-    today = date.today().strftime('%Y-%m-%d')
-    with open("etag_list_{}.txt".format(today), 'w') as w:
-        for item in sorted(ETAG):
-            w.write(item + "\n")
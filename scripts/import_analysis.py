@@ -2,7 +2,7 @@ import click
 from constants import STAGING_NODE1
 from elasticsearch import Elasticsearch
 from utils import remove_underscore_from_end_prefix, write_system_log, get_line_number, get_record_ids, \
-    convert_analysis, generate_ena_api_endpoint, process_validation_result
+    convert_analysis, generate_ena_api_endpoint, process_validation_result, flush_bulk_writer
 from misc import get_filename_from_url
 import requests
 import validate_analysis_record
@@ -106,6 +106,7 @@ def main(es_hosts, es_index_prefix, to_es: str):
     validation_results = validator.validate()
     ruleset_version = validator.get_ruleset_version()
     process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, RULESETS, to_es_flag)
+    flush_bulk_writer(es)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finish importing analysis', to_es_flag)
 
 
@@ -1,8 +1,11 @@
 import click
-from constants import STAGING_NODE1
+from constants import STAGING_NODE1, EVA_API_URL
 from elasticsearch import Elasticsearch
 from utils import remove_underscore_from_end_prefix, write_system_log, get_line_number, get_record_ids, \
-    convert_analysis, generate_ena_api_endpoint, process_validation_result
+    convert_analysis, generate_ena_api_endpoint, process_validation_result, flush_bulk_writer, create_http_session, \
+    request_with_retry
+from concurrent.futures import ThreadPoolExecutor
+from local_cache import LocalCache
 import requests
 import validate_analysis_record
 
@@ -17,6 +20,11 @@ FIELD_LIST = [
     "broker_name", "pipeline_name", "pipeline_version", "assembly_type", "accession", "description", "germline"
 ]
 
+# the number of studies whose EVA summary and ENA analyses are retrieved at the same time
+STUDY_WORKERS = 8
+# the number of days before the cached EVA study summaries are retrieved again
+EVA_SUMMARY_CACHE_DAYS = 7
+
 to_es_flag = True
 es = None
 
@@ -40,13 +48,20 @@ es = None
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
+@click.option(
+    '--concurrency',
+    default=str(STUDY_WORKERS),
+    help=f'Specify for how many studies the data are retrieved from EVA and ENA at the same time, '
+         f'default to be {STUDY_WORKERS}'
+)
 # TODO check single or double quotes
-def main(es_hosts, es_index_prefix, to_es: str):
+def main(es_hosts, es_index_prefix, to_es: str, concurrency: str):
     """
     Main function that will import analysis data from ena
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param concurrency: the number of studies retrieved at the same time
     :return:
     """
     global to_es_flag
@@ -57,6 +72,11 @@ def main(es_hosts, es_index_prefix, to_es: str):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    try:
+        concurrency = int(concurrency)
+    except ValueError:
+        print(f"The provided parameter value {concurrency} is not an integer")
+        exit(1)
 
     global es
     hosts = es_hosts.split(";")
@@ -86,21 +106,24 @@ def main(es_hosts, es_index_prefix, to_es: str):
                          '2 ES server has connection issue, index does not exist etc.', to_es_flag)
         exit()
 
-    for study_accession in eva_datasets:
-        url = f"http://www.ebi.ac.uk/eva/webservices/rest/v1/studies/{study_accession}/summary"
-        # expect always to have data from EVA as the list is retrieved live
-        # get EVA summary
-        eva_summary = requests.get(url).json()['response'][0]['result'][0]
-
-        # f"https://www.ebi.ac.uk/ena/portal/api/search/?result=analysis&format=JSON&limit=0&" \
-        #    f"query=study_accession%3D%22{study_accession}%22&fields={field_str}"
-        # extra constraint based on study accession
-        optional_str = f"query=study_accession%3D%22{study_accession}%22"
-        url = generate_ena_api_endpoint('analysis', 'ena', field_str, optional_str)
-        response = requests.get(url)
-        if response.status_code == 204:  # 204 is the status code for no content => the current term does not have match
+    # the SQLite connection can only be used in this thread, so the cache is read and written here
+    summary_cache = LocalCache('eva_study_summary')
+    cached_summaries = summary_cache.get_many(eva_datasets)
+    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                     f'{len(cached_summaries)} of {len(eva_datasets)} EVA study summaries cached', to_es_flag)
+    session = create_http_session(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        study_data = list(executor.map(
+            lambda study_accession: fetch_study(session, study_accession, field_str,
+                                                cached_summaries.get(study_accession)), eva_datasets))
+    summary_cache.set_many(((study_accession, eva_summary)
+                            for study_accession, (eva_summary, _) in zip(eva_datasets, study_data)
+                            if study_accession not in cached_summaries), EVA_SUMMARY_CACHE_DAYS)
+    summary_cache.close()
+
+    for study_accession, (eva_summary, data) in zip(eva_datasets, study_data):
+        if data is None:  # the study does not have analyses in ENA
             continue
-        data = response.json()
         displayed = set()
         for record in data:
             analysis_accession = record['analysis_accession']
@@ -136,14 +159,40 @@ def main(es_hosts, es_index_prefix, to_es: str):
     validation_results = validator.validate()
     ruleset_version = validator.get_ruleset_version()
     process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, RULESETS, to_es_flag)
+    flush_bulk_writer(es)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finish importing analysis legacy', to_es_flag)
 
 
+def fetch_study(session, study_accession, field_str, eva_summary=None):
+    """
+    Retrieve the EVA summary and the ENA analyses of one study
+    :param session: the http session shared by all threads
+    :param study_accession: the study accession
+    :param field_str: the ENA analysis fields to retrieve separated by ','
+    :param eva_summary: the cached EVA summary, retrieved from EVA if not provided
+    :return: the EVA summary and the list of ENA analysis records (None if no analysis)
+    """
+    if eva_summary is None:
+        url = f"{EVA_API_URL}/studies/{study_accession}/summary"
+        # expect always to have data from EVA as the list is retrieved live
+        eva_summary = request_with_retry(session, url).json()['response'][0]['result'][0]
+
+    # f"https://www.ebi.ac.uk/ena/portal/api/search/?result=analysis&format=JSON&limit=0&" \
+    #    f"query=study_accession%3D%22{study_accession}%22&fields={field_str}"
+    # extra constraint based on study accession
+    optional_str = f"query=study_accession%3D%22{study_accession}%22"
+    url = generate_ena_api_endpoint('analysis', 'ena', field_str, optional_str)
+    response = request_with_retry(session, url)
+    if response.status_code == 204:  # 204 is the status code for no content => the current term does not have match
+        return eva_summary, None
+    return eva_summary, response.json()
+
+
 def get_eva_dataset_list():
     species_str = ",".join(EVA_SPECIES)
     write_system_log(es, 'import_analysis_legacy', 'info', get_line_number(),
                      f'Species to retrieve from EVA: {species_str}', to_es_flag)
-    url = f'http://www.ebi.ac.uk/eva/webservices/rest/v1/meta/studies/all?species={species_str}'
+    url = f'{EVA_API_URL}/meta/studies/all?species={species_str}'
     data = requests.get(url).json()
     write_system_log(es, 'import_analysis_legacy', 'info', get_line_number(),
                      f"Total number of datasets in EVA: {data['response'][0]['numResults']}", to_es_flag)
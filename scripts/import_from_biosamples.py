@@ -1,16 +1,24 @@
 from elasticsearch import Elasticsearch
 from datetime import datetime
 from utils import remove_underscore_from_end_prefix, insert_into_es, insert_es_log, \
-    write_system_log, get_line_number
+    write_system_log, get_line_number, flush_bulk_writer, iterate_records, create_http_session, request_with_retry, \
+    delete_from_es
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Thread
 from get_all_etags import fetch_biosample_ids
+from etag_store import EtagStore
+from local_cache import LocalCache
+from biosample_record import CompactBioSample
 from columns import *
 from misc import *
-from typing import Dict
+from typing import Dict, Tuple
 import validate_organism_record
 import validate_specimen_record
 import requests
 import json
 import sys
+import time
 import click
 import os
 import os.path
@@ -27,10 +35,24 @@ ORGANISM_FOR_SPECIMEN = dict()
 SPECIMEN_ORGANISM_RELATIONSHIP = dict()
 ORGANISM_REFERRED_BY_SPECIMEN = dict()
 ALL_DERIVED_SPECIMEN = dict()
+# keys are the accessions of the samples already in ES, values are their material types
+SAMPLE_MATERIAL = dict()
 RULESETS = ["FAANG Samples", "FAANG Legacy Samples"]
 TOTAL_RECORDS_TO_UPDATE = 0
 ETAGS_CACHE = dict()
 ERROR_ESSENTIAL_FILENAME = 'biosamples_without_essential_fields.txt'
+# the number of BioSamples records fetched at the same time in the individual route
+FETCH_WORKERS = 16
+# the number of pages downloaded ahead of the page being processed in the project route
+PREFETCH_PAGES = 2
+# the number of records validated together in the import pipeline, two full batches of the validation service
+PIPELINE_CHUNK_SIZE = 1200
+# the number of chunks waiting for each stage of the import pipeline
+PIPELINE_QUEUE_SIZE = 4
+# by default nothing is deleted if more than this fraction of the organisms or specimens would be deleted
+CLEAN_MAX_RATIO = 0.2
+# set while the records are being imported, validates and indexes the converted records in the background
+PIPELINE = None
 known_missing_essential_records = set()
 to_es_flag = True
 
@@ -43,6 +65,10 @@ MATERIAL_TYPES = {
     "cell line": "CLO_0000031"
 }
 ALL_MATERIAL_TYPES = dict()
+# bump the version when the way of resolving the material types changes to ignore the cached maps
+MATERIAL_TYPES_CACHE_VERSION = 1
+# the number of days before the cached material type map is fetched again from OLS
+MATERIAL_TYPES_CACHE_DAYS = 7
 
 
 @click.command()
@@ -65,17 +91,39 @@ ALL_MATERIAL_TYPES = dict()
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
+@click.option(
+    '--concurrency',
+    default=str(FETCH_WORKERS),
+    help=f'Specify how many changed records are fetched from BioSamples at the same time, '
+         f'default to be {FETCH_WORKERS}'
+)
+@click.option(
+    '--clean_dry_run',
+    default="false",
+    help='Specify whether the records no longer in BioSamples are only counted rather than deleted. '
+         'It only allows two values: true (only count) or false (delete)'
+)
+@click.option(
+    '--clean_max_ratio',
+    default=str(CLEAN_MAX_RATIO),
+    help=f'Specify the maximum fraction of the organisms or specimens which could be deleted as no longer in '
+         f'BioSamples, nothing is deleted above it, default to be {CLEAN_MAX_RATIO}'
+)
 # TODO check single or double quotes
-def main(es_hosts, es_index_prefix, to_es: str):
+def main(es_hosts, es_index_prefix, to_es: str, concurrency: str, clean_dry_run: str, clean_max_ratio: str):
     """
     Main function that will import data from biosamples
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param concurrency: the number of records fetched from BioSamples at the same time
+    :param clean_dry_run: determine whether the records no longer in BioSamples are only counted (True)
+    :param clean_max_ratio: the maximum fraction of the records which could be deleted
     :return:
     """
     global ETAGS_CACHE
     global ALL_MATERIAL_TYPES
+    global PIPELINE
     global to_es_flag
     # initialize ES first as needed to do logging
     hosts = es_hosts.split(";")
@@ -88,24 +136,34 @@ def main(es_hosts, es_index_prefix, to_es: str):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    try:
+        concurrency = int(concurrency)
+        clean_max_ratio = float(clean_max_ratio)
+    except ValueError:
+        print(f"The provided parameter values {concurrency} and {clean_max_ratio} need to be numbers")
+        exit(1)
+    if clean_dry_run.lower() not in ['true', 'false']:
+        print('clean_dry_run parameter can only accept value of true or false')
+        exit(1)
+    clean_dry_run = clean_dry_run.lower() == 'true'
 
     today = datetime.now().strftime('%Y-%m-%d')
-    cache_filename = f'etag_list_{today}.txt'
-    if not os.path.isfile(cache_filename):
+    # the store is closed before get_all_etags.py writes into it
+    etag_store = EtagStore()
+    last_refresh = etag_store.get_last_refresh()
+    etag_store.close()
+    if last_refresh is None or last_refresh.strftime('%Y-%m-%d') != today:
         write_system_log(es, 'import_biosamples', 'info', get_line_number(),
-                         'Could not find today etag cache file. Generating', to_es_flag)
+                         'The local etag store has not been refreshed today. Refreshing', to_es_flag)
         code_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
         etag_script_file = f'{code_dir}{os.sep}get_all_etags.py'
         os.system(f'python3 {etag_script_file}')
-    try:
-        with open(cache_filename, 'r') as f:
-            for line in f:
-                line = line.rstrip()
-                data = line.split("\t")
-                ETAGS_CACHE[data[0]] = data[1]
-    except FileNotFoundError:
+    etag_store = EtagStore()
+    ETAGS_CACHE = etag_store.get_all()
+    etag_store.close()
+    if not ETAGS_CACHE:
         write_system_log(es, 'import_biosamples', 'error', get_line_number(),
-                         f'Could not find the local etag cache file etag_list_{today}.txt', to_es_flag)
+                         'Could not find any etag in the local etag store', to_es_flag)
         sys.exit(1)
     try:
         with open(ERROR_ESSENTIAL_FILENAME, 'r') as f:
@@ -119,36 +177,7 @@ def main(es_hosts, es_index_prefix, to_es: str):
     # However it is encouraged to use more specific ontology term, e.g. primary cell culture preferred than cell culture
     # ALL_MATERAIL_TYPES will be populated with all possible allowed terms as keys
     # and corresponding base material type as values
-    for base_material in MATERIAL_TYPES.keys():
-        ALL_MATERIAL_TYPES[base_material] = base_material
-        host = f"http://www.ebi.ac.uk/ols/api/terms?id={MATERIAL_TYPES[base_material]}"
-        request = requests.get(host)
-
-        response = request.json()
-        num = response['page']['totalElements']
-        detail = None
-        if num:
-            if num > 20:
-                host = host + "&size=" + str(num)
-                request = requests.get(host)
-                response = request.json()
-            terms = response['_embedded']['terms']
-            for term in terms:
-                if term['is_defining_ontology']:
-                    detail = term
-                    break
-        host = f"http://www.ebi.ac.uk/ols/api/ontologies/{detail['ontology_name']}/children?" \
-            f"id={MATERIAL_TYPES[base_material]}"
-        response = requests.get(host).json()
-        num = response['page']['totalElements']
-        if num:
-            if num > 20:
-                host = host + "&size=" + str(num)
-                request = requests.get(host)
-                response = request.json()
-            terms = response['_embedded']['terms']
-            for term in terms:
-                ALL_MATERIAL_TYPES[term['label']] = base_material
+    ALL_MATERIAL_TYPES, material_types_complete = get_all_material_types(es)
 
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'Command line parameters', to_es_flag)
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'Hosts: ' + str(hosts), to_es_flag)
@@ -177,13 +206,20 @@ def main(es_hosts, es_index_prefix, to_es: str):
         fetch_records_by_project(es, es_index_prefix)
     else:
         write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'By individual route', to_es_flag)
-        fetch_records_by_project_via_etag(etags_es, es, es_index_prefix)
+        fetch_records_by_project_via_etag(etags_es, es, es_index_prefix, concurrency)
 
     if TOTAL_RECORDS_TO_UPDATE == 0:
         write_system_log(es, 'import_biosamples', 'critical', get_line_number(),
                          'Did not obtain any records which need to be updated from BioSamples', to_es_flag)
         sys.exit(0)
 
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     'Loading organisms and specimens already in ES', to_es_flag)
+    preload_existing_samples(es, es_index_prefix)
+
+    # the records are converted here in order, the validation and indexing of the converted records overlap with
+    # the conversion of the following records
+    PIPELINE = ImportPipeline(es)
     # the order of importation could not be changed due to derive from
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'Indexing organism starts', to_es_flag)
     process_organisms(es, es_index_prefix)
@@ -204,6 +240,10 @@ def main(es_hosts, es_index_prefix, to_es: str):
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'Indexing cell line starts', to_es_flag)
     process_cell_lines(es, es_index_prefix)
 
+    # wait until all records have been validated and indexed
+    PIPELINE.close()
+    PIPELINE = None
+
     all_organism_list = list(ORGANISM.keys())
     organism_referred_list = list(ORGANISM_REFERRED_BY_SPECIMEN.keys())
     union = dict()
@@ -223,82 +263,171 @@ def main(es_hosts, es_index_prefix, to_es: str):
         if union[acc]['count'] == 1:
             write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
                              f"{acc} only in source {union[acc]['source']}", to_es_flag)
-    clean_elasticsearch(f'{es_index_prefix}_specimen', es)
-    clean_elasticsearch(f'{es_index_prefix}_organism', es)
+    # the documents need to be searchable before working out which ones are not in BioSamples anymore
+    flush_bulk_writer(es, refresh=True)
+    # without the child material terms, the records using them have not been imported in this run
+    if material_types_complete:
+        clean_elasticsearch(es_index_prefix, 'specimen', es, clean_dry_run, clean_max_ratio)
+        clean_elasticsearch(es_index_prefix, 'organism', es, clean_dry_run, clean_max_ratio)
+    else:
+        write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
+                         'Skip cleaning ES as the material types could not be retrieved from OLS', to_es_flag)
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'Program ends', to_es_flag)
 
 
+def get_all_material_types(es) -> Tuple[Dict[str, str], bool]:
+    """
+    Get the map of all allowed material terms to their base material types, from the local cache if fetched within
+    MATERIAL_TYPES_CACHE_DAYS, otherwise from OLS. When OLS is not available, the outdated cached map is used or only
+    the base material types are allowed if never cached. Records with a child term are then not imported, so the map
+    is flagged as incomplete and the records missing from this run must not be deleted from ES
+    :param es: the Elastic search instance to write log
+    :return: dict having the material terms as keys and the base material types as values, and whether the map has
+    all child terms
+    """
+    cache = LocalCache('ols_material_types')
+    # the cached map is only valid for the same base material types
+    key = f'{MATERIAL_TYPES_CACHE_VERSION}|{content_hash(MATERIAL_TYPES)}'
+    cached = cache.get(key)
+    try:
+        if cached:
+            fetched_at = datetime.strptime(cached['fetchedAt'], '%Y-%m-%d %H:%M:%S')
+            if (datetime.now() - fetched_at).days < MATERIAL_TYPES_CACHE_DAYS:
+                return cached['terms'], True
+        all_material_types = dict()
+        session = create_http_session(len(MATERIAL_TYPES))
+        with ThreadPoolExecutor(max_workers=len(MATERIAL_TYPES)) as executor:
+            children = executor.map(lambda base_material: get_material_children(session, base_material),
+                                    MATERIAL_TYPES.keys())
+            for base_material, terms in zip(MATERIAL_TYPES.keys(), children):
+                all_material_types[base_material] = base_material
+                for label in terms:
+                    all_material_types[label] = base_material
+        cache.set(key, {'fetchedAt': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'terms': all_material_types})
+        return all_material_types, True
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        if cached:
+            write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
+                             f'Could not get material types from OLS ({e}), using the map cached at '
+                             f'{cached["fetchedAt"]}', to_es_flag)
+            return cached['terms'], True
+        write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
+                         f'Could not get material types from OLS ({e}), only the base material types are allowed '
+                         f'and ES will not be cleaned', to_es_flag)
+        return {base_material: base_material for base_material in MATERIAL_TYPES.keys()}, False
+    finally:
+        cache.close()
+
+
+def get_material_children(session, base_material):
+    """
+    Get the labels of the child terms of the base material type from OLS
+    :param session: the http session shared by all threads
+    :param base_material: one of the keys in MATERIAL_TYPES
+    :return: list of the labels
+    """
+    host = f"{constants.OLS_API_URL}/terms?id={MATERIAL_TYPES[base_material]}"
+    response = request_with_retry(session, host).json()
+    num = response['page']['totalElements']
+    detail = None
+    if num:
+        if num > 20:
+            host = host + "&size=" + str(num)
+            response = request_with_retry(session, host).json()
+        terms = response['_embedded']['terms']
+        for term in terms:
+            if term['is_defining_ontology']:
+                detail = term
+                break
+    host = f"{constants.OLS_API_URL}/ontologies/{detail['ontology_name']}/children?" \
+        f"id={MATERIAL_TYPES[base_material]}"
+    response = request_with_retry(session, host).json()
+    num = response['page']['totalElements']
+    if num:
+        if num > 20:
+            host = host + "&size=" + str(num)
+            response = request_with_retry(session, host).json()
+        return [term['label'] for term in response['_embedded']['terms']]
+    return list()
+
+
 def get_existing_etags(host: str, es, es_index_prefix) -> Dict[str, str]:
     """
     Function gets etags from organisms and specimens in elastic search
     :return: list of etags
     """
-    if not host.endswith(":9200"):
-        host = host + ":9200"
     results = dict()
     for item in ("organism", "specimen"):
-        url = f'http://{host}/{es_index_prefix}_{item}/_search?_source=biosampleId,etag&sort=biosampleId&size=100000'
-        response = requests.get(url).json()
+        index_name = f'{es_index_prefix}_{item}'
         try:
-            for result in response['hits']['hits']:
+            for result in iterate_records(es, index_name, ['biosampleId', 'etag']):
                 if 'etag' in result['_source']:
                     results[result['_source']['biosampleId']] = result['_source']['etag']
-        except KeyError:
+        except Exception as e:
             write_system_log(es, 'import_biosamples', 'error', get_line_number(),
-                             f'Failing to get hits from result {url}', to_es_flag)
+                             f'Failing to get hits from index {index_name} on {host}: {str(e.args)}', to_es_flag)
             exit()
     return results
 
 
-def fetch_records_by_project_via_etag(etags, es, es_index_prefix):
+def fetch_records_by_project_via_etag(etags, es, es_index_prefix, concurrency=FETCH_WORKERS):
     global TOTAL_RECORDS_TO_UPDATE
     counts = dict()
-    today = datetime.now().strftime('%Y-%m-%d')
-    with open("etag_list_{}.txt".format(today), 'r') as f:
-        for line in f:
-            line = line.rstrip()
-            data = line.split("\t")
-            # etag in ES matches the live version, no change
-            if data[0] in etags and etags[data[0]] and etags[data[0]] == data[1]:
-                INDEXED_SAMPLES[data[0]] = 1
+    changed = list()
+    for data in ETAGS_CACHE.items():
+        # etag in ES matches the live version, no change
+        if data[0] in etags and etags[data[0]] and etags[data[0]] == data[1]:
+            INDEXED_SAMPLES[data[0]] = 1
+        else:
+            changed.append(data)
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'Fetching {len(changed)} changed records with {concurrency} workers', to_es_flag)
+    for data, single in zip(changed, fetch_changed_records([data[0] for data in changed], concurrency)):
+        if single is None:
+            # keep the version already in ES rather than removing it when cleaning
+            INDEXED_SAMPLES[data[0]] = 1
+            write_system_log(es, 'import_biosamples', 'error', get_line_number(),
+                             f'Could not fetch {data[0]} from BioSamples, the existing record is kept', to_es_flag)
+            continue
+        else:
+            single = unify_field_names(single)
+            single['etag'] = data[1]
+            # only the used fields are kept until the end of the run
+            single = CompactBioSample(single)
+            if not check_is_faang(single):
+                sample_type = determine_sample_type(single)
+                insert_es_log(es, es_index_prefix, sample_type, single['accession'], 'error', 'no project=FAANG')
                 continue
+            material = single['characteristics']['Material'][0]['text']
+            if material in ALL_MATERIAL_TYPES and material != ALL_MATERIAL_TYPES[material]:
+                material = ALL_MATERIAL_TYPES[material]
+                single['characteristics']['Material'][0]['text'] = material
+                single['characteristics']['Material'][0]['ontologyTerms'][0] = MATERIAL_TYPES[material]
+            if material == 'organism':
+                ORGANISM[data[0]] = single
+                # this may seem to be duplicate, however necessary: any unrecognized material type will be stored
+                # in counts, but will not be loaded into ES and need to inform FAANG DCC
+                TOTAL_RECORDS_TO_UPDATE += 1
+            elif material == 'specimen from organism':
+                SPECIMEN_FROM_ORGANISM[data[0]] = single
+                TOTAL_RECORDS_TO_UPDATE += 1
+            elif material == 'cell specimen':
+                CELL_SPECIMEN[data[0]] = single
+                TOTAL_RECORDS_TO_UPDATE += 1
+            elif material == 'cell culture':
+                CELL_CULTURE[data[0]] = single
+                TOTAL_RECORDS_TO_UPDATE += 1
+            elif material == 'cell line':
+                CELL_LINE[data[0]] = single
+                TOTAL_RECORDS_TO_UPDATE += 1
+            elif material == 'pool of specimens':
+                POOL_SPECIMEN[data[0]] = single
+                TOTAL_RECORDS_TO_UPDATE += 1
             else:
-                single = unify_field_names(fetch_single_record(data[0]))
-                single['etag'] = data[1]
-                if not check_is_faang(single):
-                    sample_type = determine_sample_type(single)
-                    insert_es_log(es, es_index_prefix, sample_type, single['accession'], 'error', 'no project=FAANG')
-                    continue
-                material = single['characteristics']['Material'][0]['text']
-                if material in ALL_MATERIAL_TYPES and material != ALL_MATERIAL_TYPES[material]:
-                    material = ALL_MATERIAL_TYPES[material]
-                    single['characteristics']['Material'][0]['text'] = material
-                    single['characteristics']['Material'][0]['ontologyTerms'][0] = MATERIAL_TYPES[material]
-                if material == 'organism':
-                    ORGANISM[data[0]] = single
-                    # this may seem to be duplicate, however necessary: any unrecognized material type will be stored
-                    # in counts, but will not be loaded into ES and need to inform FAANG DCC
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'specimen from organism':
-                    SPECIMEN_FROM_ORGANISM[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'cell specimen':
-                    CELL_SPECIMEN[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'cell culture':
-                    CELL_CULTURE[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'cell line':
-                    CELL_LINE[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'pool of specimens':
-                    POOL_SPECIMEN[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                else:
-                    insert_es_log(es, es_index_prefix, 'sample', data[0], 'error',
-                                  f'not recognized material type {material}')
-                counts.setdefault(material, 0)
-                counts[material] += 1
+                insert_es_log(es, es_index_prefix, 'sample', data[0], 'error',
+                              f'not recognized material type {material}')
+            counts.setdefault(material, 0)
+            counts[material] += 1
     if TOTAL_RECORDS_TO_UPDATE == 0:
         write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                          'All records have not been modified since last importation.', to_es_flag)
@@ -361,32 +490,39 @@ def fetch_records_by_project(es, es_index_prefix):
     biosamples = list()
     counts = dict()
 
-    url = 'https://www.ebi.ac.uk/biosamples/samples?size=1000&filter=attr%3Aproject%3AFAANG'
+    missing_essential = list()
+
+    url = f'{constants.BIOSAMPLES_API_URL}/samples?size=1000&filter=attr%3Aproject%3AFAANG'
     write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                      f'Size of local etag cache: {str(len(ETAGS_CACHE))}', to_es_flag)
-    while url:
-        write_system_log(es, 'import_biosamples', 'info', get_line_number(), f'Fetching data from {url}', to_es_flag)
-        response = requests.get(url).json()
+    started = time.monotonic()
+    num_pages = 0
+    for page_url, response in iterate_biosamples_pages(url):
+        write_system_log(es, 'import_biosamples', 'info', get_line_number(), f'Fetched data from {page_url}',
+                         to_es_flag)
+        num_pages += 1
         for biosample in response['_embedded']['samples']:
             if biosample['accession'] in known_missing_essential_records:
                 continue
             biosample = unify_field_names(biosample)
             if find_essential_fields(biosample):
                 biosample['etag'] = ETAGS_CACHE[biosample['accession']]
-                biosamples.append(biosample)
+                # only the used fields are kept until the end of the run
+                biosamples.append(CompactBioSample(biosample))
             else:
-                with open(ERROR_ESSENTIAL_FILENAME , 'a') as w:
-                    w.write(f"{biosample['accession']}\n")
-                    sample_type = determine_sample_type(biosample)
-                    insert_es_log(es, es_index_prefix, sample_type, biosample['accession'], 'error',
-                                  'missing essential fields')
-                    # to activate cronjob email notification
-                    print(f"{biosample['accession']} does not have essential fields\n")
-
-        if 'next' in response['_links']:
-            url = response['_links']['next']['href']
-        else:
-            url = ''
+                missing_essential.append(biosample['accession'])
+                sample_type = determine_sample_type(biosample)
+                insert_es_log(es, es_index_prefix, sample_type, biosample['accession'], 'error',
+                              'missing essential fields')
+                # to activate cronjob email notification
+                print(f"{biosample['accession']} does not have essential fields\n")
+    elapsed = time.monotonic() - started
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'Fetched {num_pages} pages in {elapsed:.0f} seconds, '
+                     f'{num_pages / elapsed if elapsed else 0:.2f} pages per second', to_es_flag)
+    if missing_essential:
+        with open(ERROR_ESSENTIAL_FILENAME, 'a') as w:
+            w.writelines(f"{accession}\n" for accession in missing_essential)
 
     for i, biosample in enumerate(biosamples):
         if not check_is_faang(biosample):
@@ -424,6 +560,42 @@ def fetch_records_by_project(es, es_index_prefix):
     # logger.info(f"The sum is {TOTAL_RECORDS_TO_UPDATE}")
 
 
+def iterate_biosamples_pages(url, prefetch=PREFETCH_PAGES):
+    """
+    Follow the HAL next links of a BioSamples search, the next pages are downloaded in a background thread
+    while the current page is being processed
+    :param url: the url of the first page
+    :param prefetch: the maximum number of pages downloaded but not processed yet
+    :return: generator of the url and the parsed response of each page
+    """
+    pages = Queue(maxsize=prefetch)
+
+    def download():
+        session = create_http_session(1)
+        next_url = url
+        try:
+            while next_url:
+                response = request_with_retry(session, next_url)
+                response.raise_for_status()
+                page = response.json()
+                pages.put((next_url, page))
+                next_url = page['_links']['next']['href'] if 'next' in page['_links'] else ''
+        except Exception as e:
+            pages.put((None, e))
+            return
+        pages.put((None, None))
+
+    Thread(target=download, daemon=True).start()
+    while True:
+        page_url, page = pages.get()
+        if page_url is None:
+            # the download failed, raise the error in the processing thread
+            if page is not None:
+                raise page
+            return
+        yield page_url, page
+
+
 def determine_sample_type(biosample):
     """
     Determine the sample type, organism, specimen or sample (no value provided)
@@ -442,14 +614,42 @@ def determine_sample_type(biosample):
     return sample_type
 
 
-def fetch_single_record(biosample_id):
+def fetch_changed_records(accessions, concurrency=FETCH_WORKERS):
+    """
+    Fetch the records from BioSamples with a fixed number of threads sharing the connections
+    :param accessions: the accessions of the records
+    :param concurrency: the number of records fetched at the same time
+    :return: generator of the records in the same order as the accessions, None for the records failed to fetch
+    """
+    session = create_http_session(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        yield from executor.map(lambda accession: fetch_record_or_none(accession, session), accessions)
+
+
+def fetch_record_or_none(biosample_id, session):
+    """
+    Fetch a single record, failures are reported as None so that one record could not stop the whole import
+    :param biosample_id: accession id or record to return
+    :param session: the http session shared by all threads
+    :return: json file of sample with biosampleId, None if failed after all retries
+    """
+    try:
+        return fetch_single_record(biosample_id, session)
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+def fetch_single_record(biosample_id, session=requests):
     """
     Function returns json file of single record from biosamples
     :param biosample_id: accession id or record to return
+    :param session: the http session to use, by default a new connection for each request
     :return: json file of sample with biosampleId
     """
-    url = f"https://www.ebi.ac.uk/biosamples/samples/{biosample_id}.json?curationdomain=self.FAANG_DCC_curation"
-    result = unify_field_names(requests.get(url).json())
+    url = f"{constants.BIOSAMPLES_API_URL}/samples/{biosample_id}.json?curationdomain=self.FAANG_DCC_curation"
+    response = request_with_retry(session, url)
+    response.raise_for_status()
+    result = unify_field_names(response.json())
     result['etag'] = ETAGS_CACHE[biosample_id]
     return result
 
@@ -479,11 +679,11 @@ def deal_with_decimal_degrees(item):
         try:
             if item['characteristics']['birth location latitude'][0]['unit'] == 'decimal degree' or \
                     item['characteristics']['birth location longitude'][0]['unit'] == 'decimal degree':
-                url = "https://www.ebi.ac.uk/biosamples/samples/{}.json?curationdomain=self.FAANG_DCC_curation".format(
-                    item['accession'])
+                url = f"{constants.BIOSAMPLES_API_URL}/samples/{item['accession']}.json?" \
+                    f"curationdomain=self.FAANG_DCC_curation"
                 biosample = requests.get(url).json()
                 biosample['etag'] = ETAGS_CACHE[biosample['accession']]
-                return biosample
+                return CompactBioSample(biosample)
             else:
                 return item
         except KeyError:
@@ -660,6 +860,57 @@ def process_specimens(es, es_index_prefix) -> None:
     import_into_es(converted, es_index_prefix, 'specimen', es)
 
 
+def preload_existing_samples(es, es_index_prefix):
+    """
+    Fill ORGANISM_FOR_SPECIMEN, SPECIMEN_ORGANISM_RELATIONSHIP, ALL_DERIVED_SPECIMEN and SAMPLE_MATERIAL with the
+    records already in ES, so that the specimens referring to unchanged records do not need to fetch them from
+    BioSamples. The records imported in this run overwrite the loaded values when processed
+    :param es: Elasticsearch object
+    :param es_index_prefix: the index prefix (build version)
+    """
+    for hit in iterate_records(es, f'{es_index_prefix}_organism',
+                               ['biosampleId', 'organism', 'sex', 'breed', 'healthStatus']):
+        organism = hit['_source']
+        if 'organism' not in organism:
+            continue
+        ORGANISM_FOR_SPECIMEN[hit['_id']] = {
+            'biosampleId': hit['_id'],
+            'organism': organism['organism'],
+            'sex': organism.get('sex', {'text': None, 'ontologyTerms': None}),
+            'breed': organism.get('breed', {'text': None, 'ontologyTerms': None}),
+            'healthStatus': organism.get('healthStatus', list())
+        }
+        SAMPLE_MATERIAL[hit['_id']] = 'organism'
+    for hit in iterate_records(es, f'{es_index_prefix}_specimen',
+                               ['material.text', 'organism.biosampleId', 'allDeriveFromSpecimens']):
+        specimen = hit['_source']
+        material = specimen.get('material', {}).get('text')
+        SAMPLE_MATERIAL[hit['_id']] = material
+        # pool of specimens and cell lines do not refer to a single organism record
+        organism_accession = specimen.get('organism', {}).get('biosampleId')
+        if organism_accession:
+            SPECIMEN_ORGANISM_RELATIONSHIP[hit['_id']] = organism_accession
+        if material in ['cell specimen', 'cell culture', 'cell line']:
+            derived = specimen.get('allDeriveFromSpecimens') or list()
+            ALL_DERIVED_SPECIMEN[hit['_id']] = [derived] if isinstance(derived, str) else derived
+
+
+def get_sample_material(accession):
+    """
+    Get the material type of a sample, only fetched from BioSamples if neither imported in this run nor in ES
+    :param accession: the BioSamples accession
+    :return: the material type
+    """
+    for material, records in [('organism', ORGANISM), ('specimen from organism', SPECIMEN_FROM_ORGANISM),
+                              ('cell specimen', CELL_SPECIMEN), ('cell culture', CELL_CULTURE),
+                              ('pool of specimens', POOL_SPECIMEN), ('cell line', CELL_LINE)]:
+        if accession in records:
+            return material
+    if accession not in SAMPLE_MATERIAL:
+        SAMPLE_MATERIAL[accession] = fetch_single_record(accession)['characteristics']['Material'][0]['text']
+    return SAMPLE_MATERIAL[accession]
+
+
 def add_organism(es, es_index_prefix, specimen_accession, organism_accession):
     try:
         if organism_accession not in ORGANISM_FOR_SPECIMEN:
@@ -853,14 +1104,14 @@ def process_pool_specimen(es, es_index_prefix) -> None:
             doc_for_update['allDeriveFromSpecimens'] = derived_from
 
             for acc in derived_from:
-                if acc not in SPECIMEN_FROM_ORGANISM:
-                    tmp_specimen = fetch_single_record(acc)
-                    SPECIMEN_FROM_ORGANISM[acc] = tmp_specimen
+                # the specimen record is only needed when its organism is not known yet
                 if acc not in SPECIMEN_ORGANISM_RELATIONSHIP:
-                    item = SPECIMEN_FROM_ORGANISM[acc]
-                    relationships = parse_relationship(item)
-                    if 'derivedFrom' in relationships:
-                        organism_accession = list(relationships['derivedFrom'].keys())[0]
+                    if acc not in SPECIMEN_FROM_ORGANISM:
+                        tmp_specimen = fetch_single_record(acc)
+                        SPECIMEN_FROM_ORGANISM[acc] = CompactBioSample(tmp_specimen)
+                    specimen_relationships = parse_relationship(SPECIMEN_FROM_ORGANISM[acc])
+                    if 'derivedFrom' in specimen_relationships:
+                        organism_accession = list(specimen_relationships['derivedFrom'].keys())[0]
                         SPECIMEN_ORGANISM_RELATIONSHIP[acc] = organism_accession
                 organism_accession = SPECIMEN_ORGANISM_RELATIONSHIP[acc]
                 ORGANISM_REFERRED_BY_SPECIMEN.setdefault(organism_accession, 0)
@@ -971,8 +1222,7 @@ def process_cell_lines(es, es_index_prefix) -> None:
 
             derive_from_accession = relationships['derivedFrom'][0]
             doc_for_update['derivedFrom'] = derive_from_accession
-            candidate = fetch_single_record(derive_from_accession)
-            if candidate['characteristics']['Material'][0]['text'] != 'organism':
+            if get_sample_material(derive_from_accession) != 'organism':
                 if derive_from_accession in ALL_DERIVED_SPECIMEN:
                     tmp_set = set(ALL_DERIVED_SPECIMEN[derive_from_accession])
                 tmp_set.add(derive_from_accession)
@@ -1218,22 +1468,121 @@ def add_organism_info_for_specimen(accession, item):
     ORGANISM_FOR_SPECIMEN[accession]['healthStatus'] = get_health_status(item)
 
 
+class ImportPipeline:
+    """
+    Validate and index the converted records in two background threads connected by bounded queues, so that
+    converting, validating and indexing of different chunks of records happen at the same time
+    The converted records must not be changed after being submitted
+    """
+    def __init__(self, es, chunk_size=PIPELINE_CHUNK_SIZE, queue_size=PIPELINE_QUEUE_SIZE):
+        """
+        :param es: elasticsearch object
+        :param chunk_size: the number of records validated together
+        :param queue_size: the number of chunks waiting for each stage
+        """
+        self.es = es
+        self.chunk_size = chunk_size
+        self.to_validate = Queue(maxsize=queue_size)
+        self.to_index = Queue(maxsize=queue_size)
+        # the first exception raised in any stage, raised again in the main thread
+        self.error = None
+        self.threads = [Thread(target=self.validate_worker, daemon=True),
+                        Thread(target=self.index_worker, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, data, index_prefix, my_type):
+        """
+        Queue the converted records for validation and indexing, blocked when the validation is behind
+        :param data: the converted records, keys are accessions
+        :param index_prefix: combined with my_type to generate the actual index value to operate on
+        :param my_type: name of index to update
+        """
+        accessions = sorted(data.keys())
+        for start in range(0, len(accessions), self.chunk_size):
+            self.raise_error()
+            chunk = {accession: data[accession] for accession in accessions[start:start + self.chunk_size]}
+            self.to_validate.put((chunk, index_prefix, my_type))
+
+    def close(self):
+        """
+        Wait until all submitted records have been indexed, raise the exception of any stage
+        """
+        self.to_validate.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def validate_worker(self):
+        while True:
+            task = self.to_validate.get()
+            if task is None:
+                self.to_index.put(None)
+                return
+            # after a failure the remaining chunks are only taken off the queue so that submit is never blocked
+            if self.error is not None:
+                continue
+            try:
+                chunk, index_prefix, my_type = task
+                self.to_index.put((chunk, validate_records(chunk, my_type), index_prefix, my_type))
+            except Exception as e:
+                self.error = e
+
+    def index_worker(self):
+        while True:
+            task = self.to_index.get()
+            if task is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                index_records(*task, self.es)
+            except Exception as e:
+                self.error = e
+
+
 def import_into_es(data, index_prefix, my_type, es):
     """
-    This function will update current index with new data
+    This function will update current index with new data, in the background if the import pipeline is running
     :param data: data to update elasticsearch with
     :param index_prefix: combined with my_type to generate the actual index value to operate on
     :param my_type: name of index to update
     :param es: elasticsearch object
     :return: updates index or return error it it was impossible ot sample didn't go through validation
     """
+    if PIPELINE is not None:
+        PIPELINE.submit(data, index_prefix, my_type)
+    else:
+        index_records(data, validate_records(data, my_type), index_prefix, my_type, es)
+
+
+def validate_records(data, my_type):
+    """
+    Validate the converted records against the sample rulesets
+    :param data: the converted records, keys are accessions
+    :param my_type: either organism or specimen
+    :return: the validation results of each ruleset
+    """
     if my_type == 'organism':
         validator = validate_organism_record.ValidateOrganismRecord(data, RULESETS)
-        validation_results = validator.validate()
     else:
-        # validation_results = validate_total_sample_records(data, my_type, RULESETS)
         validator = validate_specimen_record.ValidateSpecimenRecord(data, RULESETS)
-        validation_results = validator.validate()
+    return validator.validate()
+
+
+def index_records(data, validation_results, index_prefix, my_type, es):
+    """
+    Index the converted records with the standard they meet and log their validation results
+    :param data: the converted records, keys are accessions
+    :param validation_results: the validation results of each ruleset
+    :param index_prefix: combined with my_type to generate the actual index value to operate on
+    :param my_type: name of index to update
+    :param es: elasticsearch object
+    """
     for biosample_id in sorted(list(data.keys())):
         INDEXED_SAMPLES[biosample_id] = 1
         es_doc = data[biosample_id]
@@ -1255,21 +1604,37 @@ def import_into_es(data, index_prefix, my_type, es):
         insert_into_es(es, index_prefix, my_type, biosample_id, body)
 
 
-def clean_elasticsearch(index, es):
+def clean_elasticsearch(es_index_prefix, doc_type, es, dry_run=False, max_ratio=CLEAN_MAX_RATIO):
     """
     This function will delete all records that do not exist in biosamples anymore
-    :param index: name of index to check
+    :param es_index_prefix: combined with doc_type to determine the index to check
+    :param doc_type: either organism or specimen
     :param es: elasticsearch object
+    :param dry_run: if True, only report the number of records to be deleted
+    :param max_ratio: nothing is deleted if more than this fraction of the records would be deleted
     """
-    data = es.search(index=index, size=100000, _source="_id,standardMet")
-    for hit in data['hits']['hits']:
+    index = f'{es_index_prefix}_{doc_type}'
+    total = 0
+    stale = list()
+    for hit in iterate_records(es, index, ['standardMet']):
+        total += 1
         if hit['_id'] not in INDEXED_SAMPLES:
             # Legacy (basic) data imported in import_from_ena_legacy, not here, so could not be cleaned
-            to_be_cleaned = True
-            if 'standardMet' in hit['_source'] and hit['_source']['standardMet'] == constants.STANDARD_BASIC:
-                to_be_cleaned = False
-            if to_be_cleaned:
-                es.delete(index=index, doc_type='_doc', id=hit['_id'])
+            if hit['_source'].get('standardMet') != constants.STANDARD_BASIC:
+                stale.append(hit['_id'])
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'{len(stale)} of {total} records in {index} no longer exist in BioSamples', to_es_flag)
+    if not stale or dry_run:
+        return
+    # a partial BioSamples response must not wipe out the index
+    if len(stale) > total * max_ratio:
+        write_system_log(es, 'import_biosamples', 'critical', get_line_number(),
+                         f'Not deleting the records from {index} as more than {max_ratio:.0%} of the records would be '
+                         f'deleted, please check and run with a larger --clean_max_ratio if expected', to_es_flag)
+        return
+    for biosample_id in stale:
+        delete_from_es(es, es_index_prefix, doc_type, biosample_id)
+    flush_bulk_writer(es)
 
 
 if __name__ == "__main__":
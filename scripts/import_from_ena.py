@@ -8,16 +8,51 @@ import click
 from constants import TECHNOLOGIES, STANDARDS, STAGING_NODE1, STANDARD_LEGACY, STANDARD_FAANG
 from elasticsearch import Elasticsearch
 from utils import determine_file_and_source, check_existsence, remove_underscore_from_end_prefix, \
-    write_system_log, insert_into_es, generate_ena_api_endpoint, insert_es_log, get_line_number
+    write_system_log, insert_into_es, generate_ena_api_endpoint, insert_es_log, get_line_number, flush_bulk_writer, \
+    iterate_records, iterate_ena_tsv
 import validate_experiment_record
 import validate_record
 import sys
 import json
+import os
 import requests
 import re
-from misc import convert_readable, get_filename_from_url
+from datetime import datetime
+from urllib.parse import quote
+from misc import convert_readable, get_filename_from_url, content_hash
+from local_cache import LocalCache
 
 RULESETS = ["FAANG Experiments", "FAANG Legacy Experiments"]
+# the read_run fields used to build the experiment, file and dataset documents, only these are downloaded
+READ_RUN_FIELDS = [
+    'study_accession', 'secondary_study_accession', 'study_alias', 'study_title', 'study_type', 'sample_accession',
+    'experiment_accession', 'run_accession', 'run_alias', 'submission_accession', 'project', 'secondary_project',
+    'first_public', 'last_updated', 'library_strategy', 'library_name', 'assay_type', 'experiment_target',
+    'instrument_platform', 'instrument_model', 'center_name', 'read_count', 'base_count',
+    'fastq_ftp', 'fastq_galaxy', 'fastq_aspera', 'fastq_bytes', 'fastq_md5',
+    'sra_ftp', 'sra_galaxy', 'sra_aspera', 'sra_bytes', 'sra_md5',
+    'cram_index_ftp', 'cram_index_galaxy', 'cram_index_aspera',
+    'submitted_ftp', 'submitted_bytes', 'submitted_md5', 'submitted_format',
+    'sample_storage', 'sample_storage_processing', 'sample_prep_interval', 'sample_prep_interval_units',
+    'experimental_protocol', 'extraction_protocol', 'library_prep_location', 'library_prep_latitude',
+    'library_prep_longitude', 'library_prep_date', 'library_prep_date_format', 'sequencing_location',
+    'sequencing_latitude', 'sequencing_longitude', 'sequencing_date', 'sequencing_date_format',
+    'transposase_protocol', 'bisulfite_protocol', 'pcr_isolation_protocol', 'faang_library_selection',
+    'bisulfite_percent', 'restriction_enzyme', 'restriction_site', 'restriction_enzyme_target_sequence',
+    'chip_protocol', 'chip_target', 'chip_ab_provider', 'chip_ab_catalog', 'chip_ab_lot', 'control_experiment',
+    'library_max_fragment_size', 'library_min_fragment_size', 'dnase_protocol', 'hi_c_protocol',
+    'library_pcr_isolation_protocol', 'library_gen_protocol', 'cage_protocol', 'rna_purity_280_ratio',
+    'rna_purity_230_ratio', 'rna_integrity_num', 'read_strand', 'rna_prep_3_protocol', 'rna_prep_5_protocol',
+    'rt_prep_protocol', 'sequencing_primer_provider', 'sequencing_primer_catalog', 'sequencing_primer_lot'
+]
+
+# keys are the index prefixes, values are the last_updated date the import has caught up with and the date of the
+# last full import
+WATERMARK_FILENAME = 'ena_import_watermarks.json'
+# ENA only records the date of the last update, so the watermarks are kept at day precision
+WATERMARK_DATE_FORMAT = '%Y-%m-%d'
+# the number of studies queried at once when retrieving the runs of the updated studies
+STUDY_QUERY_BATCH_SIZE = 50
 
 to_es_flag = True
 alias_cache = dict()
@@ -43,13 +78,26 @@ alias_cache = dict()
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
+@click.option(
+    '--incremental',
+    default="false",
+    help='Specify whether only the studies having runs updated in ENA since the last import are processed. '
+         'It only allows two values: true or false (import all studies)'
+)
+@click.option(
+    '--full_reconciliation_days',
+    default="7",
+    help='Specify after how many days an incremental import falls back to import all studies, default to be 7'
+)
 # TODO check single or double quotes
-def main(es_hosts: str, es_index_prefix: str, to_es: str):
+def main(es_hosts: str, es_index_prefix: str, to_es: str, incremental: str, full_reconciliation_days: str):
     """
     Main function that will import data from ena
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param incremental: determine whether only the studies updated since the last import are processed
+    :param full_reconciliation_days: the maximum number of days between two imports of all studies
     :return:
     """
     global to_es_flag
@@ -65,6 +113,15 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
         print('to_es parameter can only accept value of true or false')
         exit(1)
 
+    if incremental.lower() not in ['true', 'false']:
+        print('incremental parameter can only accept value of true or false')
+        exit(1)
+    try:
+        full_reconciliation_days = int(full_reconciliation_days)
+    except ValueError:
+        print(f"The provided parameter value {full_reconciliation_days} is not an integer")
+        exit(1)
+
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Command line parameters', to_es_flag)
     write_system_log(es, 'import_ena', 'info', get_line_number(), f'Hosts: {str(hosts)}', to_es_flag)
 
@@ -74,7 +131,7 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
 
     write_system_log(es, 'import_ena', 'info', get_line_number(), f'Get current specimens stored in the corresponding '
                                                                   f'ES index {es_index_prefix}_specimen', to_es_flag)
-    biosample_ids = get_all_specimen_ids(hosts[0], es_index_prefix)
+    biosample_ids = get_all_specimen_ids(es, es_index_prefix)
 
     if not biosample_ids:
         write_system_log(es, 'import_ena', 'error', get_line_number(),
@@ -89,8 +146,26 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
     write_system_log(es, 'import_ena', 'info', get_line_number(),
                      f'Current experiment ruleset version: {ruleset_version}', to_es_flag)
 
+    import_started = datetime.now().strftime(WATERMARK_DATE_FORMAT)
+    watermarks = load_watermarks()
+    updated_since = get_updated_since(watermarks.get(es_index_prefix), incremental.lower() == 'true',
+                                      full_reconciliation_days)
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Retrieving data from ENA', to_es_flag)
-    data = get_ena_data(es)
+    if updated_since:
+        updated_studies = get_updated_studies(es, updated_since)
+        write_system_log(es, 'import_ena', 'info', get_line_number(),
+                         f'{len(updated_studies)} studies have runs updated since {updated_since}', to_es_flag)
+        if not updated_studies:
+            save_watermark(watermarks, es_index_prefix, import_started, False)
+            flush_bulk_writer(es)
+            write_system_log(es, 'import_ena', 'info', get_line_number(), 'Finish importing ena', to_es_flag)
+            return
+        data = get_ena_data(es, updated_studies)
+    else:
+        updated_studies = None
+        data = get_ena_data(es)
+    # the control experiments of ChIP-seq are often given as aliases, resolve them all before processing the runs
+    prefetch_experiment_aliases(es, updated_studies)
 
     indexed_files = dict()
     datasets = dict()
@@ -604,6 +679,8 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
         indexed_files[file_id] = 1
 
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Start to import Datasets', to_es_flag)
+    existing_hashes = get_dataset_hashes(es, es_index_prefix)
+    unchanged_datasets = 0
     for dataset_id in datasets:
         if dataset_id == 'tmp':
             continue
@@ -668,8 +745,15 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
         es_doc_dataset['centerName'] = list(datasets['tmp'][dataset_id]['center_name'].keys())
         es_doc_dataset['secondaryProject'] = list(datasets['tmp'][dataset_id]['secondaryProject'].keys())
         es_doc_dataset['archive'] = sorted(list(datasets['tmp'][dataset_id]['archive'].keys()))
+        # the document embeds its experiments, files and specimens, so the hash changes whenever any of them changes
+        es_doc_dataset['contentHash'] = content_hash(es_doc_dataset)
+        if existing_hashes.get(dataset_id) == es_doc_dataset['contentHash']:
+            unchanged_datasets += 1
+            continue
         body = json.dumps(es_doc_dataset)
         insert_into_es(es, es_index_prefix, 'dataset', dataset_id, body)
+    write_system_log(es, 'import_ena', 'info', get_line_number(),
+                     f'{unchanged_datasets} datasets unchanged since the last import, not rewritten', to_es_flag)
     with open('ena_not_in_biosample.txt', 'a') as w:
         for study in new_errors:
             tmp = new_errors[study]
@@ -685,37 +769,140 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
         msg = "specimens " + ",".join(missing_specimens) + " missing"
         insert_es_log(es, es_index_prefix, 'dataset', dataset_id, 'warning', msg)
 
+    flush_bulk_writer(es)
+    # only move the watermark once all documents have been written
+    save_watermark(watermarks, es_index_prefix, import_started, updated_since is None)
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Finish importing ena', to_es_flag)
 
 
-def get_ena_data(es):
+def get_ena_data(es, studies=None):
     """
     This function will fetch data from ena FAANG data portal read_run result
+    The data is downloaded as TSV and the records are yielded one by one while downloading
     :param es: the Elastic search instance to write log
-    :return: json representation of data from ena
+    :param studies: only fetch the runs of the given study accessions, all runs if not provided
+    :return: generator of records from ena
     """
-    # 'https://www.ebi.ac.uk/ena/portal/api/search/?result=read_run&format=JSON&limit=0&dataPortal=faang&fields=all'
-    url = generate_ena_api_endpoint('read_run', 'faang', 'all')
+    if studies is None:
+        yield from get_read_runs(es)
+        return
+    # all runs of a study are needed to rebuild its dataset document, not only the updated ones
+    for start in range(0, len(studies), STUDY_QUERY_BATCH_SIZE):
+        batch = studies[start:start + STUDY_QUERY_BATCH_SIZE]
+        yield from get_read_runs(es, ' OR '.join(f'study_accession="{study}"' for study in batch))
+
+
+def get_read_runs(es, query=''):
+    """
+    Download the read_run records of ena FAANG data portal as TSV, yielded one by one while downloading
+    :param es: the Elastic search instance to write log
+    :param query: ENA portal API query to restrict the records, e.g. study_accession="PRJEB1", optional
+    :return: generator of records from ena
+    """
+    optional = f'query={quote(query)}' if query else ''
+    # 'https://www.ebi.ac.uk/ena/portal/api/search/?result=read_run&format=TSV&limit=0&dataPortal=faang&fields=...'
+    url = generate_ena_api_endpoint('read_run', 'faang', ','.join(READ_RUN_FIELDS), optional, data_format='TSV')
     write_system_log(es, 'import_ena', 'info', get_line_number(), f'Getting data from {url}', to_es_flag)
-    response = requests.get(url).json()
-    return response
+    try:
+        yield from iterate_ena_tsv(url)
+    except requests.exceptions.HTTPError as e:
+        # ENA rejects the whole request if any listed field is not available any more
+        if e.response is None or e.response.status_code != 400:
+            raise
+        url = generate_ena_api_endpoint('read_run', 'faang', 'all', optional, data_format='TSV')
+        write_system_log(es, 'import_ena', 'warning', get_line_number(),
+                         f'Field list rejected by ENA, getting data from {url}', to_es_flag)
+        yield from iterate_ena_tsv(url)
+
+
+def get_updated_studies(es, updated_since: str):
+    """
+    Get the studies having at least one run updated in ena FAANG data portal since the given date
+    :param es: the Elastic search instance to write log
+    :param updated_since: the date in the format of YYYY-MM-DD
+    :return: sorted list of study accessions
+    """
+    optional = f"query={quote(f'last_updated>={updated_since}')}"
+    url = generate_ena_api_endpoint('read_run', 'faang', 'study_accession', optional, data_format='TSV')
+    write_system_log(es, 'import_ena', 'info', get_line_number(), f'Getting updated studies from {url}', to_es_flag)
+    return sorted({record['study_accession'] for record in iterate_ena_tsv(url)})
+
+
+def load_watermarks():
+    """
+    Read the watermarks of the previous imports
+    :return: dict having index prefixes as keys and the watermarks as values
+    """
+    if not os.path.exists(WATERMARK_FILENAME):
+        return dict()
+    with open(WATERMARK_FILENAME, 'r') as f:
+        return json.load(f)
 
 
-def get_all_specimen_ids(host, es_index_prefix):
+def save_watermark(watermarks, es_index_prefix: str, import_started: str, full_import: bool):
+    """
+    Record that the import into the given indices has caught up with ENA
+    :param watermarks: the watermarks of all index prefixes
+    :param es_index_prefix: the index prefix points to a particular version of data
+    :param import_started: the date when the import started, runs updated afterwards are fetched next time
+    :param full_import: whether all studies were imported
+    """
+    watermark = watermarks.setdefault(es_index_prefix, dict())
+    watermark['lastUpdated'] = import_started
+    if full_import:
+        watermark['lastFullImport'] = import_started
+    # write the new file aside first so that an interrupted write never loses the previous watermarks
+    with open(f'{WATERMARK_FILENAME}.tmp', 'w') as w:
+        json.dump(watermarks, w, indent=2, sort_keys=True)
+    os.replace(f'{WATERMARK_FILENAME}.tmp', WATERMARK_FILENAME)
+
+
+def get_updated_since(watermark, incremental: bool, full_reconciliation_days: int, today: datetime = None):
+    """
+    Decide whether the import only needs to process the studies updated since the previous import
+    :param watermark: the watermark of the index prefix, None if never imported
+    :param incremental: whether incremental import is requested
+    :param full_reconciliation_days: the maximum number of days between two imports of all studies
+    :param today: the current date, default to be now
+    :return: the date since which the updated studies are imported, None if all studies need to be imported
+    """
+    if not incremental or not watermark or 'lastFullImport' not in watermark:
+        return None
+    today = today or datetime.now()
+    last_full_import = datetime.strptime(watermark['lastFullImport'], WATERMARK_DATE_FORMAT)
+    if (today - last_full_import).days >= full_reconciliation_days:
+        return None
+    return watermark['lastUpdated']
+
+
+def get_all_specimen_ids(es, es_index_prefix):
     """
     This function return dict with all information from the corresponding specimens
+    :param es: elasticsearch python library instance
+    :param es_index_prefix: the index prefix points to a particular version of data
     :return: A dict with keys as BioSamples id and values as the data stored in ES
     """
-    if not host.endswith(":9200"):
-        host = host + ":9200"
     results = dict()
-    url = f'http://{host}/{es_index_prefix}_specimen/_search?size=100000'
-    response = requests.get(url).json()
-    for item in response['hits']['hits']:
+    # only the fields used to build the dataset documents are retrieved
+    for item in iterate_records(es, f'{es_index_prefix}_specimen', ['biosampleId', 'material', 'cellType', 'organism']):
         results[item['_id']] = item['_source']
     return results
 
 
+def get_dataset_hashes(es, es_index_prefix):
+    """
+    Get the content hashes of the dataset documents currently stored in ES
+    :param es: elasticsearch python library instance
+    :param es_index_prefix: the index prefix points to a particular version of data
+    :return: A dict with keys as dataset accessions and values as content hashes
+    """
+    results = dict()
+    for item in iterate_records(es, f'{es_index_prefix}_dataset', ['contentHash']):
+        if 'contentHash' in item['_source']:
+            results[item['_id']] = item['_source']['contentHash']
+    return results
+
+
 def get_known_errors():
     """
     This function will read file with association from study to biosample
@@ -734,6 +921,55 @@ def get_known_errors():
     return known_errors
 
 
+def prefetch_experiment_aliases(es, studies=None):
+    """
+    Fill alias_cache with the experiment alias to accession maps of all ChIP-seq studies. The maps are kept in the
+    local cache and only queried again from ENA when any run of the study has been updated since
+    :param es: the Elastic search instance to write log
+    :param studies: only the ChIP-seq studies within the given study accessions, all if not provided
+    """
+    optional = 'query=' + quote('assay_type="ChIP-seq"')
+    url = generate_ena_api_endpoint('read_run', 'faang', 'study_accession,last_updated', optional, data_format='TSV')
+    cache = LocalCache('ena_experiment_alias')
+    if studies is not None:
+        studies = set(studies)
+    try:
+        # the latest update of the runs of each study decides whether the cached map is still valid
+        study_updates = dict()
+        for record in iterate_ena_tsv(url):
+            study = record['study_accession']
+            if studies is None or study in studies:
+                study_updates[study] = max(study_updates.get(study, ''), record['last_updated'])
+        cached = cache.get_many(study_updates.keys())
+        to_query = list()
+        for study, last_updated in study_updates.items():
+            if study in cached and cached[study]['lastUpdated'] == last_updated:
+                alias_cache[study] = cached[study]['aliases']
+            else:
+                to_query.append(study)
+        write_system_log(es, 'import_ena', 'info', get_line_number(),
+                         f'{len(study_updates) - len(to_query)} ChIP-seq studies with cached experiment aliases, '
+                         f'{len(to_query)} to be queried', to_es_flag)
+        for start in range(0, len(to_query), STUDY_QUERY_BATCH_SIZE):
+            batch = to_query[start:start + STUDY_QUERY_BATCH_SIZE]
+            aliases = {study: dict() for study in batch}
+            query = ' OR '.join(f'study_accession="{study}"' for study in batch)
+            url = generate_ena_api_endpoint('read_experiment', 'ena', 'experiment_accession,experiment_alias,'
+                                            'study_accession', f'query={quote(query)}', data_format='TSV')
+            for record in iterate_ena_tsv(url):
+                if record['study_accession'] in aliases:
+                    aliases[record['study_accession']][record['experiment_alias']] = record['experiment_accession']
+            alias_cache.update(aliases)
+            cache.set_many((study, {'lastUpdated': study_updates[study], 'aliases': aliases[study]})
+                           for study in batch)
+    except requests.exceptions.RequestException as e:
+        # the studies not prefetched are still queried one by one when needed
+        write_system_log(es, 'import_ena', 'warning', get_line_number(),
+                         f'Could not prefetch experiment aliases: {str(e)}', to_es_flag)
+    finally:
+        cache.close()
+
+
 def replace_alias_with_accession(study: str, to_be_replaced: str) -> str:
     """
     During the ENA submission, the alias used in the fields other than alias would not be replaced with the accession,
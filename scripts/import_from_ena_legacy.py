@@ -10,7 +10,10 @@ from elasticsearch import Elasticsearch
 import constants
 from typing import Set, Dict, List
 from utils import determine_file_and_source, check_existsence, remove_underscore_from_end_prefix, \
-    write_system_log, get_line_number, insert_into_es, get_record_ids, generate_ena_api_endpoint
+    write_system_log, get_line_number, insert_into_es, get_record_ids, generate_ena_api_endpoint, flush_bulk_writer, \
+    iterate_records, create_http_session, request_with_retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from local_cache import LocalCache
 import re
 import validate_experiment_record
 import sys
@@ -28,6 +31,8 @@ es = None
 RULESETS = ["FAANG Legacy Experiments"]
 
 SPECIES_TAXONOMY_LIST = list(SPECIES_DICT.keys())
+# the number of ENA queries sent at the same time when retrieving the runs
+ENA_QUERY_WORKERS = 4
 
 # holds all sample records from ES
 BIOSAMPLES_RECORDS = dict()
@@ -36,6 +41,18 @@ BIOSAMPLES_RECORDS = dict()
 # confirmed (boolean), material (dict), accession (str)
 CACHED_MATERIAL = dict()
 
+# the BioSamples responses (status code and the used part of the record) of the samples not in ES, prefetched before
+# processing the runs and kept between runs, keys are biosamples accessions
+FETCHED_BIOSAMPLES = dict()
+# the number of BioSamples records fetched at the same time
+BIOSAMPLES_FETCH_WORKERS = 8
+# the number of days before the cached BioSamples records are fetched again
+BIOSAMPLES_CACHE_DAYS = 30
+# the number of days before trying again the accessions which could not be retrieved
+BIOSAMPLES_RETRY_DAYS = 7
+# the parts of the BioSamples record used by retrieve_biosamples_record
+BIOSAMPLES_RECORD_KEYS = ['accession', 'name', 'release', 'update', 'characteristics', 'relationships']
+
 # control which assay types to be imported
 ASSAY_TYPES_TO_BE_IMPORTED = {
     "ATAC-seq": "ATAC-seq",
@@ -61,22 +78,22 @@ FIELD_LIST = [
 ]
 
 
-def get_biosamples_records_from_es(host, es_index_prefix, es_type):
+def get_biosamples_records_from_es(es_index_prefix, es_type):
     """
     Get existing biosample records from elastic search
-    :param host: elasticsearch python instance
     :param es_index_prefix: the name of the index set
     :param es_type: type of record, either organism or specimen
     """
     global BIOSAMPLES_RECORDS
-    url = f'http://{host}/{es_index_prefix}_{es_type}/_search?size=100000'
-    response = requests.get(url).json()
-    if 'hits' not in response:
+    index_name = f'{es_index_prefix}_{es_type}'
+    try:
+        # only the fields used to build the dataset documents are retrieved
+        for item in iterate_records(es, index_name, ['biosampleId', 'material', 'cellType', 'organism']):
+            BIOSAMPLES_RECORDS[item['_id']] = item['_source']
+    except Exception as e:
         write_system_log(es, SCRIPT_NAME, 'error', get_line_number(),
-                         f'No data retrieved from {url}, please double check whether the URL is correct', to_es_flag)
-        return
-    for item in response['hits']['hits']:
-        BIOSAMPLES_RECORDS[item['_id']] = item['_source']
+                         f'No data retrieved from {index_name}, please double check whether the index exists: '
+                         f'{str(e.args)}', to_es_flag)
 
 
 def retrieve_biosamples_record(es_index_prefix, biosample_id):
@@ -106,11 +123,12 @@ def retrieve_biosamples_record(es_index_prefix, biosample_id):
         CACHED_MATERIAL[biosample_id]['confirmed'] = True
         CACHED_MATERIAL[biosample_id]['source'] = 'ES records'
         return 0
-    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
-                     f'Try to get data for {biosample_id} from BioSamples', to_es_flag)
-    url = f"https://www.ebi.ac.uk/biosamples/samples/{biosample_id}"
-    response = requests.get(url)
-    status = response.status_code
+    if biosample_id not in FETCHED_BIOSAMPLES:
+        write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                         f'Try to get data for {biosample_id} from BioSamples', to_es_flag)
+        prefetch_biosamples_records([biosample_id])
+    # no status if BioSamples could not be reached
+    status, data = FETCHED_BIOSAMPLES.get(biosample_id, (None, None))
     # if not successful, return the status code and add to cache
     if status != 200:  # success
         tmp = {
@@ -125,8 +143,6 @@ def retrieve_biosamples_record(es_index_prefix, biosample_id):
         'text': 'specimen from organism',
         'ontologyTerms': 'http://purl.obolibrary.org/obo/OBI_0001479'
     }
-    # successfully get the sample record
-    data = response.json()
 
     material_key = get_field_name(data, 'Material', 'material')
     if material_key:
@@ -319,6 +335,72 @@ def retrieve_biosamples_record(es_index_prefix, biosample_id):
     return status
 
 
+def prefetch_biosamples_records(accessions, concurrency=BIOSAMPLES_FETCH_WORKERS):
+    """
+    Get the BioSamples records of the given accessions not in ES, and the records they are derived from, into
+    FETCHED_BIOSAMPLES. The responses are read from the local cache where possible, the others are fetched
+    concurrently and cached, including the failures which are only tried again after BIOSAMPLES_RETRY_DAYS
+    :param accessions: the biosamples accessions
+    :param concurrency: the number of records fetched at the same time
+    """
+    cache = LocalCache('legacy_biosamples')
+    session = create_http_session(concurrency)
+    to_resolve = {accession for accession in accessions
+                  if accession not in BIOSAMPLES_RECORDS and accession not in FETCHED_BIOSAMPLES}
+    # each round follows the derived from relationships of the records retrieved in the previous round
+    while to_resolve:
+        for accession, cached in cache.get_many(to_resolve).items():
+            FETCHED_BIOSAMPLES[accession] = (cached['status'], cached['data'])
+        to_fetch = sorted(to_resolve - set(FETCHED_BIOSAMPLES.keys()))
+        if to_fetch:
+            write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                             f'Fetching {len(to_fetch)} records from BioSamples', to_es_flag)
+        # the responses are written into the cache once per round, the successes and the failures expire differently
+        fetched = {BIOSAMPLES_CACHE_DAYS: list(), BIOSAMPLES_RETRY_DAYS: list()}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            responses = executor.map(lambda accession: fetch_biosamples_record(session, accession), to_fetch)
+            for accession, response in zip(to_fetch, responses):
+                # connection failures are neither cached nor kept, the record is tried again when used
+                if response is None:
+                    continue
+                FETCHED_BIOSAMPLES[accession] = response
+                status, data = response
+                fetched[BIOSAMPLES_CACHE_DAYS if status == 200 else BIOSAMPLES_RETRY_DAYS].append(
+                    (accession, {'status': status, 'data': data}))
+        for ttl_days, items in fetched.items():
+            if items:
+                cache.set_many(items, ttl_days)
+        derived_from = set()
+        for accession in to_resolve:
+            if accession not in FETCHED_BIOSAMPLES or FETCHED_BIOSAMPLES[accession][0] != 200:
+                continue
+            for relationship in FETCHED_BIOSAMPLES[accession][1].get('relationships', list()):
+                if relationship['type'] == 'derived from' and relationship['target'] != accession:
+                    derived_from.add(relationship['target'])
+        to_resolve = {accession for accession in derived_from
+                      if accession not in BIOSAMPLES_RECORDS and accession not in FETCHED_BIOSAMPLES}
+    session.close()
+    cache.close()
+
+
+def fetch_biosamples_record(session, biosample_id):
+    """
+    Fetch one record from BioSamples
+    :param session: the http session shared by all threads
+    :param biosample_id: the biosamples accession
+    :return: the status code and the used part of the record (None if not successful), None if failed to connect
+    """
+    url = f"{constants.BIOSAMPLES_API_URL}/samples/{biosample_id}"
+    try:
+        response = request_with_retry(session, url)
+        if response.status_code != 200:
+            return response.status_code, None
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    return 200, {key: data[key] for key in BIOSAMPLES_RECORD_KEYS if key in data}
+
+
 def extract_field_info(data, es_doc, found_fields, result_field_name, target_field_name, es_section=None):
     """
     extract data for particular field :param target_field_name from the BioSamples API record :param data
@@ -366,6 +448,27 @@ def get_field_name(data, original_key, alternative_value):
     return original_key
 
 
+def fetch_legacy_runs(session, term: str, taxonomy: str, field_str: str) -> List[Dict]:
+    """
+    Get the runs of one library strategy for the given species from the general ENA data portal
+    :param session: the http session shared by all threads
+    :param term: the library strategy
+    :param taxonomy: the taxonomy ids separated by ','
+    :param field_str: the fields to retrieve separated by ','
+    :return: list of runs
+    """
+    # f"https://www.ebi.ac.uk/ena/portal/api/search/?result=read_run&format=JSON&limit=0&" \
+    #    f"query=library_strategy%3D%22{term}%22%20AND%20tax_eq({species_str})&fields={field_str}"
+    # extra constraint based on species and library strategy
+    optional_str = f"query=library_strategy%3D%22{term}%22%20AND%20tax_eq({taxonomy})"
+    url = generate_ena_api_endpoint('read_run', 'ena', field_str, optional_str)
+    response = request_with_retry(session, url)
+    if response.status_code == 204:  # 204 is the status code for no content => the current term does not have match
+        return list()
+    response.raise_for_status()
+    return response.json()
+
+
 @click.command()
 @click.option(
     '--es_hosts',
@@ -386,12 +489,25 @@ def get_field_name(data, original_key, alternative_value):
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
-def main(es_hosts, es_index_prefix, to_es: str):
+@click.option(
+    '--concurrency',
+    default=str(ENA_QUERY_WORKERS),
+    help=f'Specify how many ENA queries are sent at the same time, default to be {ENA_QUERY_WORKERS}'
+)
+@click.option(
+    '--split_by_species',
+    default="false",
+    help='Specify whether each library strategy is queried once per species rather than once for all species. '
+         'It only allows two values: true or false'
+)
+def main(es_hosts, es_index_prefix, to_es: str, concurrency: str, split_by_species: str):
     """
     Main function that will import legacy data (not FAANG labelled) from ena
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param concurrency: the number of ENA queries sent at the same time
+    :param split_by_species: determine whether the queries are split by species into smaller queries
     """
     global to_es_flag
     if to_es.lower() == 'false':
@@ -401,6 +517,14 @@ def main(es_hosts, es_index_prefix, to_es: str):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    if split_by_species.lower() not in ['true', 'false']:
+        print('split_by_species parameter can only accept value of true or false')
+        exit(1)
+    try:
+        concurrency = int(concurrency)
+    except ValueError:
+        print(f"The provided parameter value {concurrency} is not an integer")
+        exit(1)
 
     global es
     hosts = es_hosts.split(";")
@@ -412,8 +536,8 @@ def main(es_hosts, es_index_prefix, to_es: str):
     if es_index_prefix:
         write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Index_prefix: {es_index_prefix}', to_es_flag)
 
-    get_biosamples_records_from_es(hosts[0], es_index_prefix, 'organism')
-    get_biosamples_records_from_es(hosts[0], es_index_prefix, 'specimen')
+    get_biosamples_records_from_es(es_index_prefix, 'organism')
+    get_biosamples_records_from_es(es_index_prefix, 'specimen')
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
                      f'There are {len(BIOSAMPLES_RECORDS)} sample records in the ES', to_es_flag)
     if not BIOSAMPLES_RECORDS:
@@ -434,36 +558,47 @@ def main(es_hosts, es_index_prefix, to_es: str):
     # collect all data from ENA API and saved into local dict which has keys as study accession
     # and values as array of data related to the study
     todo: Dict[str, List[Dict]] = dict()
-    for term in CATEGORIES.keys():
-        category = CATEGORIES[term]
-        if category not in ASSAY_TYPES_TO_BE_IMPORTED:
-            continue
-        write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
-                         f'term {term} in category {category}', to_es_flag)
-        # f"https://www.ebi.ac.uk/ena/portal/api/search/?result=read_run&format=JSON&limit=0&" \
-        #    f"query=library_strategy%3D%22{term}%22%20AND%20tax_eq({species_str})&fields={field_str}"
-        # extra constraint based on species and library strategy
-        # debug notes: category in records descending order RNA-Seq (32k), WGS,
-        # miRNA-Seq (4k), and others (around 1k or less)
-        optional_str = f"query=library_strategy%3D%22{term}%22%20AND%20tax_eq({species_str})"
-        url = generate_ena_api_endpoint('read_run', 'ena', field_str, optional_str)
-        response = requests.get(url)
-        if response.status_code == 204:  # 204 is the status code for no content => the current term does not have match
-            continue
-        data = response.json()
-        for hit in data:
-            study_accession = hit['study_accession']
-            if study_accession in existing_faang_datasets:  # already in the data portal
-                continue
-            # not replaced with constants.STANDARD_FAANG because they are separate concepts,
-            # here is a tag used in the ruleset, not a standard
-            if hit['project_name'] == 'FAANG':  # labelled as FAANG which is supposed to be deal with import_from _ena
-                continue
-            todo.setdefault(term, list())
-            todo[term].append(hit)
+    terms = [term for term in CATEGORIES.keys() if CATEGORIES[term] in ASSAY_TYPES_TO_BE_IMPORTED]
+    # debug notes: category in records descending order RNA-Seq (32k), WGS,
+    # miRNA-Seq (4k), and others (around 1k or less), so the total time is bound by the RNA-Seq query
+    if split_by_species.lower() == 'true':
+        queries = [(term, taxonomy) for term in terms for taxonomy in SPECIES_TAXONOMY_LIST]
+    else:
+        queries = [(term, species_str) for term in terms]
+    hits_by_term: Dict[str, List[Dict]] = dict()
+    session = create_http_session(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fetch_legacy_runs, session, term, taxonomy, field_str): (term, taxonomy)
+                   for term, taxonomy in queries}
+        for future in as_completed(futures):
+            term, taxonomy = futures[future]
+            data = future.result()
+            write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                             f'term {term} in category {CATEGORIES[term]} for taxonomy {taxonomy}: {len(data)} runs',
+                             to_es_flag)
+            for hit in data:
+                study_accession = hit['study_accession']
+                if study_accession in existing_faang_datasets:  # already in the data portal
+                    continue
+                # not replaced with constants.STANDARD_FAANG because they are separate concepts,
+                # here is a tag used in the ruleset, not a standard
+                # labelled as FAANG which is supposed to be deal with import_from _ena
+                if hit['project_name'] == 'FAANG':
+                    continue
+                hits_by_term.setdefault(term, list())
+                hits_by_term[term].append(hit)
+    # the queries finish in any order, keep the categories processed in the same order
+    for term in terms:
+        if term in hits_by_term:
+            todo[term] = hits_by_term[term]
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
                      'Finishing retrieving data from ENA', to_es_flag)
 
+    # the samples referred by the runs are retrieved all at once rather than one by one while processing the runs
+    referred_samples = {record['sample_accession'] for records in todo.values() for record in records
+                        if len(record['sample_accession']) >= 5}
+    prefetch_biosamples_records(referred_samples)
+
     indexed_files = dict()
     datasets = dict()
     experiments = dict()
@@ -755,6 +890,7 @@ def main(es_hosts, es_index_prefix, to_es: str):
         insert_into_es(es, es_index_prefix, 'dataset', dataset_id, body)
     write_system_log(es, SCRIPT_NAME, 'warning', get_line_number(),
                      f'finishing indexing datasets', to_es_flag)
+    flush_bulk_writer(es)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finish importing ena legacy', to_es_flag)
 
 
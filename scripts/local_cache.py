@@ -0,0 +1,113 @@
+"""
+Local persistent key value cache shared by the import scripts, the values are stored as JSON
+The entries are grouped by namespace and could expire after a given time
+"""
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Tuple
+
+LOCAL_CACHE_FILENAME = 'local_cache.db'
+# the fixed width format keeps the stored times comparable as strings
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# the maximum number of parameters in one SQLite statement
+SQLITE_BATCH_SIZE = 500
+
+
+class LocalCache:
+    def __init__(self, namespace: str, filename=LOCAL_CACHE_FILENAME):
+        """
+        Open the cache, the file and the table are created if not existing
+        :param namespace: the name of the group of entries, e.g. validation
+        :param filename: the SQLite file holding the cache
+        """
+        self.namespace = namespace
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS cache (namespace TEXT NOT NULL, key TEXT NOT NULL, '
+                                'value TEXT NOT NULL, updated_at TEXT NOT NULL, expires_at TEXT, '
+                                'PRIMARY KEY (namespace, key))')
+        self.connection.commit()
+
+    def get(self, key: str):
+        """
+        Get the value of one key
+        :param key: the key
+        :return: the value, None if not cached or expired
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict:
+        """
+        Get the values of the given keys, the keys not cached or expired are left out
+        :param keys: the keys
+        :return: dict having the cached keys as keys and their values as values
+        """
+        keys = list(keys)
+        now = datetime.now().strftime(TIME_FORMAT)
+        results = dict()
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start:start + SQLITE_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.connection.execute(f'SELECT key, value FROM cache WHERE namespace = ? AND key IN '
+                                           f'({placeholders}) AND (expires_at IS NULL OR expires_at > ?)',
+                                           [self.namespace] + batch + [now])
+            for key, value in rows:
+                results[key] = json.loads(value)
+        return results
+
+    def get_all(self) -> Dict:
+        """
+        Get all entries of the namespace which have not expired
+        :return: dict having the keys as keys and their values as values
+        """
+        now = datetime.now().strftime(TIME_FORMAT)
+        rows = self.connection.execute('SELECT key, value FROM cache WHERE namespace = ? AND '
+                                       '(expires_at IS NULL OR expires_at > ?)', (self.namespace, now))
+        return {key: json.loads(value) for key, value in rows}
+
+    def set(self, key: str, value, ttl_days: float = None):
+        """
+        Store the value of one key
+        :param key: the key
+        :param value: the JSON serializable value
+        :param ttl_days: the number of days before the entry expires, None means never
+        """
+        self.set_many([(key, value)], ttl_days)
+
+    def set_many(self, items: Iterable[Tuple[str, object]], ttl_days: float = None):
+        """
+        Store the values of the given keys
+        :param items: pairs of key and JSON serializable value
+        :param ttl_days: the number of days before the entries expire, None means never
+        """
+        now = datetime.now()
+        expires_at = (now + timedelta(days=ttl_days)).strftime(TIME_FORMAT) if ttl_days is not None else None
+        now = now.strftime(TIME_FORMAT)
+        self.connection.executemany('INSERT OR REPLACE INTO cache (namespace, key, value, updated_at, expires_at) '
+                                    'VALUES (?, ?, ?, ?, ?)',
+                                    ((self.namespace, key, json.dumps(value), now, expires_at)
+                                     for key, value in items))
+        self.connection.commit()
+
+    def delete_many(self, keys: Iterable[str]):
+        """
+        Remove the given keys
+        :param keys: the keys
+        """
+        self.connection.executemany('DELETE FROM cache WHERE namespace = ? AND key = ?',
+                                    ((self.namespace, key) for key in keys))
+        self.connection.commit()
+
+    def purge_expired(self) -> int:
+        """
+        Remove the expired entries of all namespaces
+        :return: the number of removed entries
+        """
+        now = datetime.now().strftime(TIME_FORMAT)
+        cursor = self.connection.execute('DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?',
+                                         (now,))
+        self.connection.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.connection.close()
@@ -1,6 +1,8 @@
 """
 A collection of commonly-used functions, could be cross-projects
 """
+import hashlib
+import json
 import re
 
 
@@ -82,3 +84,14 @@ def parse_date(date_str: str):
         else:
             return date_str
     return None
+
+
+def content_hash(data) -> str:
+    """
+    calculate a stable hash of JSON serializable data, the same content always gives the same hash regardless of
+    the order of the keys
+    :param data: the data to hash
+    :return: the hex digest of the hash
+    """
+    serialized = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
@@ -0,0 +1,969 @@
+"""
+Local stand-in services replacing BioSamples, ENA portal and xref, Europe PMC, OLS, EVA, the FAANG validator and
+Elasticsearch, so that the import scripts could be run, measured and tuned without the live services
+The EBI services share one port and keep the paths of www.ebi.ac.uk, Elasticsearch has its own port and keeps the
+documents in memory. The payloads are synthetic and consistent with each other, recorded payloads could be served
+instead from a directory mirroring the url paths. Latency and errors could be injected into every response.
+Point the scripts to the stand-in services with the environment variables printed at start, e.g.
+    eval $(python standin_services.py --print_env) && python import_from_biosamples.py --es_hosts localhost:9200
+"""
+import click
+import email.parser
+import hashlib
+import json
+import os
+import random
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List
+from urllib.parse import urlsplit, parse_qs
+
+# the environment variables read by constants.py and their paths in the EBI stand-in service
+SERVICE_PATHS = {
+    'BIOSAMPLES_API_URL': '/biosamples',
+    'ENA_PORTAL_API_URL': '/ena/portal/api',
+    'ENA_XREF_API_URL': '/ena/xref/rest/json',
+    'EUROPE_PMC_API_URL': '/europepmc/webservices/rest',
+    'OLS_API_URL': '/ols/api',
+    'EVA_API_URL': '/eva/webservices/rest/v1',
+    'VALIDATION_API_URL': '/vg/faang'
+}
+BIOSAMPLES_PAGE_SIZE = 1000
+# the share of the studies having a publication in Europe PMC and the ENA cross references
+PUBLISHED_RATIO = 0.5
+# the share of the studies not in the FAANG data portal, they are only returned by the general ENA portal
+# (dataPortal=ena) and refer to the legacy samples, which are not FAANG BioSamples records
+LEGACY_STUDY_RATIO = 0.3
+# the number of child terms of each material type in OLS
+OLS_CHILDREN = 3
+ENA_DATE = '2020-01-01'
+BIOSAMPLES_DATE = '2020-01-01T00:00:00Z'
+# the FAANG samples are all from the first species, the legacy samples from all species in turn
+SPECIES = (('Sus scrofa', '9823'), ('Bos taurus', '9913'), ('Gallus gallus', '9031'), ('Ovis aries', '9940'),
+           ('Equus caballus', '9796'), ('Capra hircus', '9925'))
+# the library strategies given to the studies in turn and the corresponding FAANG assay types
+LIBRARY_STRATEGIES = {
+    'WGS': 'whole genome sequencing assay',
+    'RNA-Seq': 'transcription profiling by high throughput sequencing',
+    'ChIP-Seq': 'ChIP-seq',
+    'Bisulfite-Seq': 'methylation profiling by high throughput sequencing',
+    'miRNA-Seq': 'microRNA profiling by high throughput sequencing',
+    'ATAC-seq': 'ATAC-seq',
+    'Hi-C': 'Hi-C',
+    'DNase': 'DNase-Hypersensitivity seq'
+}
+# the accessions of the FAANG and the legacy samples are numbered from these
+FAANG_SAMPLE_START = 9000000
+LEGACY_SAMPLE_START = 8000000
+# the values of the ENA fields shared by all runs and analyses, the other unknown fields are empty as in ENA
+ENA_FIELD_VALUES = {
+    'first_public': ENA_DATE,
+    'last_updated': ENA_DATE,
+    'instrument_platform': 'ILLUMINA',
+    'instrument_model': 'Illumina HiSeq 2500',
+    'library_layout': 'PAIRED',
+    'library_source': 'GENOMIC',
+    'library_selection': 'RANDOM',
+    'read_count': '10000000',
+    'base_count': '1500000000',
+    'center_name': 'FAANG stand-in',
+    'study_type': 'Other',
+    'analysis_type': 'SEQUENCE_VARIATION',
+    'analysis_protocol': 'ftp://ftp.faang.ebi.ac.uk/ftp/protocols/analysis/STANDIN_SOP_analysis_20200101.pdf',
+    'analysis_date': ENA_DATE,
+    'analysis_code_repository': 'https://github.com/FAANG/stand-in',
+    'reference_genome': 'Sscrofa11.1',
+    'secondary_project': '',
+    'related_analysis_accession': ''
+}
+MATERIALS = {
+    'organism': 'OBI_0100026',
+    'specimen from organism': 'OBI_0001479'
+}
+
+# the injected faults, set from the command line
+LATENCY = 0.0
+JITTER = 0.0
+ERROR_RATE = 0.0
+ERROR_STATUS = 503
+ES_LATENCY = 0.0
+# the directory of the recorded payloads, None to only serve the synthetic payloads
+DATA_DIR = None
+# the synthetic records, keys are record types, values are lists of records
+DATASET = dict()
+# the Elasticsearch documents, keys are index names, values are dicts having ids as keys and documents as values
+ES_INDICES = dict()
+ES_LOCK = threading.Lock()
+# the remaining hits of the open scrolls, keys are scroll ids
+ES_SCROLLS = dict()
+# the index administration apis which are acknowledged without effect, as the documents are schemaless here
+ES_NO_OP_APIS = ('_mapping', '_mappings', '_settings', '_alias', '_aliases')
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnsupportedQueryError(ValueError):
+    """
+    Raised for the query and aggregation clauses the Elasticsearch stand-in does not implement, answered with 400
+    rather than a silently wrong result
+    """
+
+
+@click.command()
+@click.option(
+    '--host',
+    default="localhost",
+    help='Specify the address the stand-in services listen on, default to be localhost'
+)
+@click.option(
+    '--port',
+    default="8000",
+    help='Specify the port of the EBI stand-in services, default to be 8000'
+)
+@click.option(
+    '--es_port',
+    default="9200",
+    help='Specify the port of the Elasticsearch stand-in service, default to be 9200'
+)
+@click.option(
+    '--num_samples',
+    default="10000",
+    help='Specify the number of FAANG BioSamples records, half organisms and half specimens, half as many legacy '
+         'records only found by accession are added, default to be 10000'
+)
+@click.option(
+    '--num_runs',
+    default="5000",
+    help='Specify the number of ENA runs and analyses, default to be 5000'
+)
+@click.option(
+    '--latency',
+    default="0",
+    help='Specify the seconds added to each response of the EBI stand-in services, default to be 0'
+)
+@click.option(
+    '--jitter',
+    default="0",
+    help='Specify the maximum random seconds added on top of the latency, default to be 0'
+)
+@click.option(
+    '--error_rate',
+    default="0",
+    help='Specify the share of the requests to the EBI stand-in services answered with an error, default to be 0'
+)
+@click.option(
+    '--error_status',
+    default="503",
+    help='Specify the status code of the injected errors, e.g. 429 or 503, default to be 503'
+)
+@click.option(
+    '--es_latency',
+    default="0",
+    help='Specify the seconds added to each response of the Elasticsearch stand-in service, default to be 0'
+)
+@click.option(
+    '--data_dir',
+    default="",
+    help='Specify the directory of the recorded payloads, the file at the url path (with or without .json) is '
+         'served instead of the synthetic payload, e.g. biosamples/samples/SAMEA1.json'
+)
+@click.option(
+    '--seed',
+    default="1",
+    help='Specify the seed of the injected latency and errors, default to be 1'
+)
+@click.option(
+    '--print_env',
+    is_flag=True,
+    help='Only print the environment variables pointing the scripts to the stand-in services'
+)
+def main(host, port, es_port, num_samples, num_runs, latency, jitter, error_rate, error_status, es_latency, data_dir,
+         seed, print_env):
+    """
+    Start the stand-in services until interrupted
+    :param host: the address to listen on
+    :param port: the port of the EBI stand-in services
+    :param es_port: the port of the Elasticsearch stand-in service
+    :param num_samples: the number of BioSamples records
+    :param num_runs: the number of ENA runs and analyses
+    :param latency: the seconds added to each response
+    :param jitter: the maximum random seconds added on top of the latency
+    :param error_rate: the share of the requests answered with an error
+    :param error_status: the status code of the injected errors
+    :param es_latency: the seconds added to each Elasticsearch response
+    :param data_dir: the directory of the recorded payloads
+    :param seed: the seed of the injected latency and errors
+    :param print_env: only print the environment variables
+    """
+    global LATENCY, JITTER, ERROR_RATE, ERROR_STATUS, ES_LATENCY, DATA_DIR
+    try:
+        port = int(port)
+        es_port = int(es_port)
+        num_samples = int(num_samples)
+        num_runs = int(num_runs)
+        ERROR_STATUS = int(error_status)
+        random.seed(int(seed))
+    except ValueError:
+        print("The provided ports, numbers, error status and seed need to be integers")
+        exit(1)
+    try:
+        LATENCY = float(latency)
+        JITTER = float(jitter)
+        ERROR_RATE = float(error_rate)
+        ES_LATENCY = float(es_latency)
+    except ValueError:
+        print("The provided latency, jitter, error rate and Elasticsearch latency need to be numbers")
+        exit(1)
+    if not 0 <= ERROR_RATE <= 1:
+        print("The error rate needs to be between 0 and 1")
+        exit(1)
+    if data_dir:
+        if not os.path.isdir(data_dir):
+            print(f"The provided data directory {data_dir} does not exist")
+            exit(1)
+        DATA_DIR = data_dir
+    if print_env:
+        for name, value in get_environment(host, port).items():
+            print(f"export {name}={value}")
+        return
+
+    DATASET.update(build_dataset(num_samples, num_runs))
+    servers = start_servers(host, port, es_port)
+    print(f"Serving {num_samples} BioSamples records and {num_runs} ENA runs, Elasticsearch at {host}:{es_port}")
+    for name, value in get_environment(host, port).items():
+        print(f"export {name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+def get_environment(host: str, port: int) -> Dict[str, str]:
+    """
+    Get the environment variables pointing the scripts to the EBI stand-in services
+    :param host: the address of the stand-in services
+    :param port: the port of the EBI stand-in services
+    :return: dict having the variable names as keys and the base urls as values
+    """
+    return {name: f"http://{host}:{port}{path}" for name, path in SERVICE_PATHS.items()}
+
+
+def start_servers(host: str, port: int, es_port: int) -> List[ThreadingHTTPServer]:
+    """
+    Start the EBI and Elasticsearch stand-in services in background threads
+    :param host: the address to listen on
+    :param port: the port of the EBI stand-in services, 0 to pick a free port
+    :param es_port: the port of the Elasticsearch stand-in service, 0 to pick a free port
+    :return: the two servers, the actual ports are in server_address
+    """
+    servers = [ThreadingHTTPServer((host, port), EbiHandler),
+               ThreadingHTTPServer((host, es_port), ElasticsearchHandler)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
+
+
+def build_dataset(num_samples: int, num_runs: int) -> Dict[str, List[Dict]]:
+    """
+    Generate the synthetic records. The runs and analyses are spread over the studies, ten per study, the runs of the
+    FAANG studies refer to the FAANG specimens and the runs of the legacy studies to the legacy specimens
+    :param num_samples: the number of FAANG BioSamples records, half as many legacy records are added
+    :param num_runs: the number of ENA runs and analyses
+    :return: dict having the record types as keys and lists of records as values
+    """
+    samples = [build_sample(i, True) for i in range(num_samples)]
+    legacy_samples = [build_sample(i, False) for i in range(max(2, num_samples // 2))]
+    studies = list()
+    faang_studies = set()
+    strategies = list(LIBRARY_STRATEGIES.keys())
+    for i in range(max(1, num_runs // 10)):
+        strategy = strategies[i % len(strategies)]
+        study = {
+            'study_accession': f"PRJEB{90000 + i}",
+            'secondary_study_accession': f"ERP{90000 + i}",
+            'study_title': f"Stand-in {strategy} study {i}",
+            'study_alias': f"study_{i}",
+            'library_strategy': strategy,
+            'assay_type': LIBRARY_STRATEGIES[strategy]
+        }
+        if i % 10 >= LEGACY_STUDY_RATIO * 10:
+            faang_studies.add(study['study_accession'])
+            study['project_name'] = 'FAANG'
+            study['project'] = 'FAANG'
+        studies.append(study)
+
+    faang_specimens = [sample for sample in samples if 'relationships' in sample] or samples
+    legacy_specimens = [sample for sample in legacy_samples if 'relationships' in sample]
+    runs = list()
+    for i in range(num_runs):
+        study = studies[i % len(studies)]
+        specimens = faang_specimens if study['study_accession'] in faang_studies else legacy_specimens
+        # the runs of one study refer to different specimens
+        sample = specimens[(i + i // len(studies)) % len(specimens)] if specimens else dict()
+        species = get_sample_species(sample.get('accession', ''))
+        run = dict(study)
+        run.update({
+            'sample_accession': sample.get('accession', ''),
+            'tax_id': species[1],
+            'scientific_name': species[0],
+            'experiment_accession': f"ERX{9000000 + i}",
+            'experiment_alias': f"experiment_{i}",
+            'run_accession': f"ERR{9000000 + i}",
+            'run_alias': f"run_{i}",
+            'analysis_accession': f"ERZ{9000000 + i}",
+            'analysis_alias': f"analysis_{i}",
+            'analysis_title': f"Stand-in analysis {i}",
+            'analysis_description': f"Variants called from the runs of {study['study_accession']}",
+            'submission_accession': f"ERA{9000000 + i}",
+            'fastq_ftp': f"ftp.sra.ebi.ac.uk/vol1/fastq/ERR{i}/ERR{9000000 + i}_1.fastq.gz;"
+                         f"ftp.sra.ebi.ac.uk/vol1/fastq/ERR{i}/ERR{9000000 + i}_2.fastq.gz",
+            'fastq_bytes': '1000000;1000000',
+            'fastq_md5': f"{md5(f'{i}_1')};{md5(f'{i}_2')}",
+            'submitted_ftp': f"ftp.sra.ebi.ac.uk/vol1/ERZ{i}/standin_{i}.vcf.gz",
+            'submitted_bytes': '1000000',
+            'submitted_md5': md5(f"{i}_vcf"),
+            'submitted_format': 'VCF'
+        })
+        if study['library_strategy'] == 'ChIP-Seq':
+            # the control is given by the alias of the first experiment of the study, replaced by its accession
+            run['control_experiment'] = f"experiment_{i % len(studies)}"
+        runs.append(run)
+    return {'samples': samples, 'legacy_samples': legacy_samples, 'runs': runs, 'studies': studies,
+            'faang_studies': faang_studies}
+
+
+def build_sample(number: int, faang: bool) -> Dict:
+    """
+    Generate one BioSamples record, the even numbers are organisms and the odd numbers specimens derived from the
+    organism before them. The legacy records only use the lower case field names and have no material and project,
+    like most samples of the legacy studies
+    :param number: the number of the record
+    :param faang: whether a FAANG record
+    :return: the BioSamples record
+    """
+    accession = f"SAMEA{(FAANG_SAMPLE_START if faang else LEGACY_SAMPLE_START) + number}"
+    material = 'organism' if number % 2 == 0 else 'specimen from organism'
+    name, tax_id = get_sample_species(accession)
+    characteristics = {
+        'organism': [{'text': name, 'ontologyTerms': [f"http://purl.obolibrary.org/obo/NCBITaxon_{tax_id}"]}],
+        'description': [{'text': f"stand-in {material} {number}"}]
+    }
+    if faang:
+        characteristics['Organism'] = characteristics.pop('organism')
+        characteristics['Material'] = [{'text': material,
+                                        'ontologyTerms': [f"http://purl.obolibrary.org/obo/{MATERIALS[material]}"]}]
+        characteristics['project'] = [{'text': 'FAANG'}]
+    sample = {
+        'accession': accession,
+        'name': f"standin_{'faang' if faang else 'legacy'}_{number}",
+        'release': BIOSAMPLES_DATE,
+        'update': BIOSAMPLES_DATE,
+        'characteristics': characteristics
+    }
+    if material == 'organism':
+        characteristics['Sex' if faang else 'sex'] = [
+            {'text': 'female', 'ontologyTerms': ['http://purl.obolibrary.org/obo/PATO_0000383']}]
+        characteristics['breed'] = [{'text': f"{name} stand-in breed"}]
+        characteristics['birth date'] = [{'text': '2019-01', 'unit': 'YYYY-MM'}]
+    else:
+        characteristics['organism part'] = [{'text': 'liver',
+                                             'ontologyTerms': ['http://purl.obolibrary.org/obo/UBERON_0002107']}]
+        characteristics['specimen collection date'] = [{'text': '2019-06', 'unit': 'YYYY-MM'}]
+        organism = f"SAMEA{int(accession[5:]) - 1}"
+        sample['relationships'] = [{'source': accession, 'type': 'derived from', 'target': organism}]
+    return sample
+
+
+def get_sample_species(accession: str):
+    """
+    Get the species of the sample, an organism and the specimen derived from it have the same species
+    :param accession: the sample accession
+    :return: the scientific name and the taxonomy id
+    """
+    match = re.match(r'^SAMEA(\d+)$', accession)
+    if not match or int(match.group(1)) >= FAANG_SAMPLE_START:
+        return SPECIES[0]
+    return SPECIES[(int(match.group(1)) - LEGACY_SAMPLE_START) // 2 % len(SPECIES)]
+
+
+def md5(text: str) -> str:
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    The common part of the stand-in services, subclasses implement route returning the status and the payload
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_HEAD(self):
+        self.respond(with_body=False)
+
+    def do_POST(self):
+        self.respond()
+
+    def do_PUT(self):
+        self.respond()
+
+    def do_DELETE(self):
+        self.respond()
+
+    def respond(self, with_body=True):
+        """
+        Read the request, inject the faults and send the routed response
+        :param with_body: false for HEAD requests
+        """
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        try:
+            status, payload, headers = self.route(url.path, parse_qs(url.query), body)
+        except Exception as e:
+            status, payload, headers = 500, {'error': str(e)}, dict()
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        elif isinstance(payload, str):
+            payload = payload.encode('utf-8')
+            headers.setdefault('Content-Type', 'text/plain')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(payload)
+
+    def route(self, path: str, params: Dict[str, List[str]], body: bytes):
+        raise NotImplementedError
+
+    def log_message(self, format, *args):
+        # one line per request would slow down the throughput measurements
+        pass
+
+
+class EbiHandler(StandInHandler):
+    def route(self, path, params, body):
+        """
+        Serve the EBI services by path, after the injected latency and errors
+        :param path: the url path
+        :param params: the query parameters
+        :param body: the request body
+        :return: the status, the payload and the headers
+        """
+        delay = LATENCY + random.uniform(0, JITTER)
+        if delay:
+            time.sleep(delay)
+        if ERROR_RATE and random.random() < ERROR_RATE:
+            return ERROR_STATUS, {'error': 'injected error'}, {'Retry-After': '1'}
+        recorded = find_recorded_payload(path)
+        if recorded is not None:
+            return 200, recorded, {'Content-Type': 'application/json'}
+        for name, prefix in SERVICE_PATHS.items():
+            if path.startswith(prefix):
+                return SERVICE_ROUTES[name](path[len(prefix):], params, body, self.headers)
+        return 404, {'error': f"unknown path {path}"}, dict()
+
+
+def find_recorded_payload(path: str):
+    """
+    Find the recorded payload of the url path in the data directory
+    :param path: the url path
+    :return: the content of the file, None if not recorded
+    """
+    if DATA_DIR is None:
+        return None
+    data_dir = os.path.abspath(DATA_DIR)
+    filename = os.path.abspath(os.path.join(data_dir, path.lstrip('/')))
+    # never serve the files outside the data directory
+    if not filename.startswith(data_dir + os.sep):
+        return None
+    for candidate in (filename, f"{filename}.json"):
+        if os.path.isfile(candidate):
+            with open(candidate, 'rb') as f:
+                return f.read()
+    return None
+
+
+def serve_biosamples(path, params, body, headers):
+    """
+    Serve the accession list, the search pages and the single records of BioSamples
+    """
+    samples = DATASET.get('samples', list())
+    if path == '/accessions':
+        return 200, {'_embedded': {'accessions': [sample['accession'] for sample in samples]}}, dict()
+    if path == '/samples':
+        size = int(params.get('size', [BIOSAMPLES_PAGE_SIZE])[0])
+        number = int(params.get('page', ['0'])[0])
+        page = {
+            '_embedded': {'samples': samples[number * size:(number + 1) * size]},
+            '_links': dict(),
+            'page': {'size': size, 'totalElements': len(samples), 'totalPages': -(-len(samples) // size),
+                     'number': number}
+        }
+        if (number + 1) * size < len(samples):
+            query = '&'.join(f"{key}={value}" for key, values in params.items() if key != 'page' for value in values)
+            page['_links']['next'] = {'href': f"http://{headers['Host']}{SERVICE_PATHS['BIOSAMPLES_API_URL']}"
+                                              f"/samples?{query}&page={number + 1}"}
+        return 200, page, dict()
+    match = re.match(r'^/samples/(SAM\w+?)(\.json)?$', path)
+    if match:
+        for sample in find_samples(match.group(1)):
+            payload = json.dumps(sample).encode('utf-8')
+            return 200, payload, {'Content-Type': 'application/json', 'ETag': f'"{md5(payload.decode())}"'}
+    return 404, {'error': f"unknown sample {path}"}, dict()
+
+
+def find_samples(accession: str) -> List[Dict]:
+    """
+    Find the synthetic FAANG or legacy sample by accession, the accessions are numbered in order
+    """
+    match = re.match(r'^SAMEA(\d+)$', accession)
+    if not match:
+        return list()
+    for start, samples in ((FAANG_SAMPLE_START, DATASET.get('samples', list())),
+                           (LEGACY_SAMPLE_START, DATASET.get('legacy_samples', list()))):
+        if 0 <= int(match.group(1)) - start < len(samples):
+            return [samples[int(match.group(1)) - start]]
+    return list()
+
+
+def serve_ena_portal(path, params, body, headers):
+    """
+    Serve the ENA portal search with the requested fields of the runs (read_run, read_experiment, analysis) or the
+    studies (study), filtered by the field="value" and tax_eq() constraints of the query, 204 if nothing matched.
+    The FAANG data portal (dataPortal=faang) only has the FAANG studies, the general one (dataPortal=ena) has all
+    """
+    if path.rstrip('/') != '/search':
+        return 404, {'error': f"unknown path {path}"}, dict()
+    result = params.get('result', ['read_run'])[0]
+    records = DATASET.get('studies' if result == 'study' else 'runs', list())
+    if params.get('dataPortal', ['ena'])[0] == 'faang':
+        records = [record for record in records if record['study_accession'] in DATASET.get('faang_studies', set())]
+    query = params.get('query', [''])[0]
+    constraints = dict()
+    for field, value in re.findall(r'(\w+)\s*=\s*"([^"]*)"', query):
+        constraints.setdefault(field, set()).add(value)
+    for taxonomy in re.findall(r'tax_eq\(([\d,\s]+)\)', query):
+        constraints.setdefault('tax_id', set()).update(value.strip() for value in taxonomy.split(','))
+    fields = params.get('fields', ['all'])[0].split(',')
+    if fields == ['all']:
+        fields = sorted(set(records[0].keys()) | set(ENA_FIELD_VALUES.keys())) if records else list()
+    matched = list()
+    for record in records:
+        full = dict(ENA_FIELD_VALUES, **record)
+        if all(full.get(field, '') in values for field, values in constraints.items()):
+            matched.append({field: full.get(field, '') for field in fields})
+    if not matched:
+        return 204, b'', dict()
+    if params.get('format', ['JSON'])[0].upper() == 'TSV':
+        lines = ['\t'.join(fields)] + ['\t'.join(record[field] for field in fields) for record in matched]
+        return 200, '\n'.join(lines) + '\n', {'Content-Type': 'text/plain'}
+    return 200, matched, dict()
+
+
+def serve_ena_xref(path, params, body, headers):
+    """
+    Serve the publications annotated for the studies in the ENA, only some studies have one
+    """
+    accession = params.get('accession', [''])[0]
+    if is_published(accession):
+        return 200, [{'Source': 'EuropePMC', 'Source Primary Accession': f"PMC{accession[5:]}"}], dict()
+    return 200, list(), dict()
+
+
+def serve_europe_pmc(path, params, body, headers):
+    """
+    Serve the Europe PMC search, the studies with a publication and the PMC ids have one hit
+    """
+    query = params.get('query', [''])[0]
+    hits = list()
+    if is_published(query) or query.startswith('PMC'):
+        number = re.sub(r'\D', '', query)
+        hits.append({
+            'id': number, 'source': 'MED', 'pmid': number, 'pmcid': f"PMC{number}",
+            'doi': f"10.0000/standin.{number}", 'title': f"Stand-in article {number}",
+            'authorString': 'Stand-in A, Stand-in B.', 'journalTitle': 'Stand-in Journal', 'issue': '1',
+            'journalVolume': '1', 'pubYear': '2020', 'pageInfo': '1-10', 'isOpenAccess': 'Y',
+            'pubType': 'journal article'
+        })
+    return 200, {'hitCount': len(hits), 'resultList': {'result': hits}}, dict()
+
+
+def is_published(study_accession: str) -> bool:
+    """
+    Whether the synthetic study has a publication, decided by its number so that all services agree
+    """
+    match = re.match(r'^PRJEB(\d+)$', study_accession)
+    return bool(match) and int(match.group(1)) % 100 < PUBLISHED_RATIO * 100
+
+
+def serve_ols(path, params, body, headers):
+    """
+    Serve the term details and the child terms of the material types in OLS
+    """
+    term_id = params.get('id', [''])[0]
+    label = next((material for material, term in MATERIALS.items() if term == term_id), term_id)
+    if path == '/terms':
+        terms = [{'label': label, 'ontology_name': 'obi', 'is_defining_ontology': True,
+                  'iri': f"http://purl.obolibrary.org/obo/{term_id}"}]
+    elif re.match(r'^/ontologies/\w+/children$', path):
+        terms = [{'label': f"{label} child {i}", 'ontology_name': 'obi', 'is_defining_ontology': True}
+                 for i in range(OLS_CHILDREN)]
+    else:
+        return 404, {'error': f"unknown path {path}"}, dict()
+    return 200, {'_embedded': {'terms': terms}, 'page': {'totalElements': len(terms)}}, dict()
+
+
+def serve_eva(path, params, body, headers):
+    """
+    Serve the list of EVA studies and their summaries
+    """
+    if path == '/meta/studies/all':
+        studies = [{'id': study['study_accession']} for study in DATASET.get('studies', list())]
+        return 200, {'response': [{'numResults': len(studies), 'result': studies}]}, dict()
+    match = re.match(r'^/studies/(\w+)/summary$', path)
+    if match:
+        summary = {'id': match.group(1), 'experimentType': 'Whole genome sequencing', 'platform': 'Illumina HiSeq 2500'}
+        return 200, {'response': [{'numResults': 1, 'result': [summary]}]}, dict()
+    return 404, {'error': f"unknown path {path}"}, dict()
+
+
+def serve_validation(path, params, body, headers):
+    """
+    Serve the FAANG validator, every record and attribute in the uploaded metadata file passes
+    """
+    if path != '/validate':
+        return 404, {'error': f"unknown path {path}"}, dict()
+    message = email.parser.BytesParser().parsebytes(
+        f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode('utf-8') + body)
+    records = list()
+    for part in message.get_payload():
+        if part.get_param('name', header='content-disposition') == 'metadata_file':
+            records = json.loads(part.get_payload(decode=True))
+    entities = [{
+        'id': record.get('id'),
+        '_outcome': {'status': 'pass'},
+        'attributes': [{'name': attribute.get('name'), 'value': attribute.get('value'),
+                        '_outcome': {'status': 'pass', 'warnings': list(), 'errors': list()}}
+                       for attribute in record.get('attributes', list())]
+    } for record in records]
+    return 200, {'entities': entities}, dict()
+
+
+SERVICE_ROUTES = {
+    'BIOSAMPLES_API_URL': serve_biosamples,
+    'ENA_PORTAL_API_URL': serve_ena_portal,
+    'ENA_XREF_API_URL': serve_ena_xref,
+    'EUROPE_PMC_API_URL': serve_europe_pmc,
+    'OLS_API_URL': serve_ols,
+    'EVA_API_URL': serve_eva,
+    'VALIDATION_API_URL': serve_validation
+}
+
+
+class ElasticsearchHandler(StandInHandler):
+    """
+    The minimal Elasticsearch 6 api used by the import scripts: bulk, single documents and their _update, search with
+    scroll and count. Only the match_all, term, terms, ids, exists and bool queries and the terms, missing and filter
+    aggregations are applied, other clauses are rejected with 400. Values are compared exactly like keyword fields,
+    sort is ignored and the hits are in the order of indexing. The _mapping, _settings and _alias(es) requests are
+    acknowledged without any effect, ids starting with _ are rejected and any other path gets 400
+    """
+    def route(self, path, params, body):
+        """
+        Serve the Elasticsearch api by path and method
+        :param path: the url path
+        :param params: the query parameters
+        :param body: the request body
+        :return: the status, the payload and the headers
+        """
+        if ES_LATENCY:
+            time.sleep(ES_LATENCY)
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            return 200, {'version': {'number': '6.3.1'}, 'tagline': 'You Know, for Search'}, dict()
+        if parts[-1] == '_bulk':
+            return 200, es_bulk(body.decode('utf-8'), parts[0] if len(parts) > 1 else None), dict()
+        if parts[0] == '_search' and len(parts) > 1 and parts[1] == 'scroll':
+            request = json.loads(body) if body else dict()
+            if self.command == 'DELETE':
+                for scroll_id in request.get('scroll_id', list()):
+                    ES_SCROLLS.pop(scroll_id, None)
+                return 200, {'succeeded': True}, dict()
+            return 200, es_scroll(request.get('scroll_id') or params.get('scroll_id', [''])[0]), dict()
+        if parts[-1] == '_refresh':
+            return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}, dict()
+        if any(part in ES_NO_OP_APIS for part in parts):
+            return 200, {'acknowledged': True}, dict()
+        index = parts[0]
+        if len(parts) == 1:
+            if self.command == 'DELETE':
+                with ES_LOCK:
+                    ES_INDICES.pop(index, None)
+                return 200, {'acknowledged': True}, dict()
+            if self.command == 'PUT':
+                with ES_LOCK:
+                    ES_INDICES.setdefault(index, dict())
+                return 200, {'acknowledged': True, 'index': index}, dict()
+            return (200 if index in ES_INDICES else 404), {index: dict()}, dict()
+        if parts[-1] in ('_count', '_search'):
+            request = json.loads(body) if body else dict()
+            try:
+                if parts[-1] == '_count':
+                    return 200, {'count': len(find_documents(index, request.get('query')))}, dict()
+                return 200, es_search(index, request, params), dict()
+            except UnsupportedQueryError as e:
+                return 400, {'error': {'type': 'parsing_exception', 'reason': str(e)}, 'status': 400}, dict()
+        if len(parts) == 3 or (len(parts) == 4 and parts[3] == '_update'):
+            if parts[2].startswith('_'):
+                return 400, {'error': {'type': 'invalid_type_name_exception',
+                                       'reason': f"unsupported document id or api {parts[2]}"}, 'status': 400}, dict()
+            method = '_update' if len(parts) == 4 else self.command
+            return es_document(method, index, parts[1], parts[2], json.loads(body) if body else dict())
+        return 400, {'error': f"unsupported path {path}"}, dict()
+
+
+def es_document(method: str, index: str, doc_type: str, doc_id: str, body: Dict):
+    """
+    Get, index, update or delete one document, method is _update for the partial updates
+    """
+    with ES_LOCK:
+        documents = ES_INDICES.setdefault(index, dict())
+        if method == '_update':
+            status = update_document(documents, doc_id, body)
+            if status == 404:
+                return 404, {'error': {'type': 'document_missing_exception', 'reason': f"[_doc][{doc_id}]: "
+                                       f"document missing"}, 'status': 404}, dict()
+            return 200, {'_index': index, '_type': doc_type, '_id': doc_id, 'result': 'updated'}, dict()
+        if method in ('PUT', 'POST'):
+            result = 'updated' if doc_id in documents else 'created'
+            documents[doc_id] = body
+            return 200, {'_index': index, '_type': doc_type, '_id': doc_id, 'result': result}, dict()
+        if doc_id not in documents:
+            return 404, {'_index': index, '_type': doc_type, '_id': doc_id, 'found': False}, dict()
+        if method == 'DELETE':
+            del documents[doc_id]
+            return 200, {'_index': index, '_type': doc_type, '_id': doc_id, 'result': 'deleted'}, dict()
+        return 200, {'_index': index, '_type': doc_type, '_id': doc_id, 'found': True,
+                     '_source': documents[doc_id]}, dict()
+
+
+def es_bulk(body: str, default_index: str = None) -> Dict:
+    """
+    Apply the index, create, update (doc and doc_as_upsert) and delete actions of one bulk request
+    """
+    lines = [line for line in body.split('\n') if line.strip()]
+    items = list()
+    position = 0
+    with ES_LOCK:
+        while position < len(lines):
+            op_type, meta = json.loads(lines[position]).popitem()
+            position += 1
+            index = meta.get('_index', default_index)
+            documents = ES_INDICES.setdefault(index, dict())
+            doc_id = meta['_id']
+            item = {'_index': index, '_type': meta.get('_type', '_doc'), '_id': doc_id, 'status': 200}
+            if op_type == 'delete':
+                if documents.pop(doc_id, None) is None:
+                    item['status'] = 404
+            else:
+                source = json.loads(lines[position])
+                position += 1
+                if op_type == 'update':
+                    item['status'] = update_document(documents, doc_id, source)
+                else:
+                    if doc_id not in documents:
+                        item['status'] = 201
+                    documents[doc_id] = source
+            items.append({op_type: item})
+    return {'took': 1, 'errors': any(item[op]['status'] >= 300 and op != 'delete' for item in items for op in item),
+            'items': items}
+
+
+def update_document(documents: Dict, doc_id: str, request: Dict) -> int:
+    """
+    Apply the partial update (doc, doc_as_upsert and upsert) to the documents of one index
+    :return: the status, 404 if the document does not exist and there is nothing to upsert
+    """
+    if doc_id in documents:
+        documents[doc_id] = dict(documents[doc_id], **request.get('doc', dict()))
+    elif request.get('doc_as_upsert'):
+        documents[doc_id] = request.get('doc', dict())
+    elif 'upsert' in request:
+        documents[doc_id] = request['upsert']
+    else:
+        return 404
+    return 200
+
+
+def es_search(index: str, request: Dict, params: Dict[str, List[str]]) -> Dict:
+    """
+    Return the first page of the documents matching the query and the aggregations, the remaining documents are
+    kept for the scroll if asked
+    """
+    size = int(params.get('size', [request.get('size', 10)])[0])
+    start = int(params.get('from', [request.get('from', 0)])[0])
+    source_fields = request.get('_source', params.get('_source', [None])[0])
+    if isinstance(source_fields, str):
+        source_fields = source_fields.split(',')
+    documents = find_documents(index, request.get('query'))
+    hits = [{'_index': index, '_type': '_doc', '_id': doc_id, '_score': 1.0,
+             '_source': filter_source(document, source_fields)} for doc_id, document in documents]
+    response = {'took': 1, 'timed_out': False, '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+                'hits': {'total': len(hits), 'max_score': 1.0, 'hits': hits[start:start + size]}}
+    aggs = request.get('aggs', request.get('aggregations'))
+    if aggs:
+        response['aggregations'] = aggregate(documents, aggs)
+    if 'scroll' in params:
+        scroll_id = md5(f"{index}{time.monotonic()}{random.random()}")
+        ES_SCROLLS[scroll_id] = (hits[start + size:], size)
+        response['_scroll_id'] = scroll_id
+    return response
+
+
+def find_documents(index: str, query: Dict = None) -> List:
+    """
+    Get the documents of the index matching the query
+    :return: list of pairs of id and document
+    """
+    with ES_LOCK:
+        documents = list(ES_INDICES.get(index, dict()).items())
+    return [(doc_id, document) for doc_id, document in documents if match_query(doc_id, document, query)]
+
+
+def get_field_values(document: Dict, field: str) -> List:
+    """
+    Get all values of a dotted field, the lists on the way are flattened as Elasticsearch does
+    """
+    values = [document]
+    for key in field.split('.'):
+        found = list()
+        for value in values:
+            if isinstance(value, dict) and key in value:
+                found.extend(value[key] if isinstance(value[key], list) else [value[key]])
+        values = found
+    return [normalize_value(value) for value in values if value is not None]
+
+
+def normalize_value(value):
+    # boolean fields match their string form, e.g. term paperPublished: 'true'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def match_query(doc_id: str, document: Dict, query: Dict = None) -> bool:
+    """
+    Whether the document matches the query, the supported clauses are match_all, term, terms, ids, exists and bool
+    """
+    if not query:
+        return True
+    if len(query) != 1:
+        raise UnsupportedQueryError(f"query with several clauses {sorted(query.keys())}")
+    kind, clause = next(iter(query.items()))
+    if kind == 'match_all':
+        return True
+    if kind == 'ids':
+        return doc_id in clause['values']
+    if kind == 'exists':
+        return bool(get_field_values(document, clause['field']))
+    if kind in ('term', 'terms'):
+        field, expected = next((key, value) for key, value in clause.items() if key != 'boost')
+        if kind == 'term':
+            expected = [expected['value'] if isinstance(expected, dict) else expected]
+        expected = [normalize_value(value) for value in expected]
+        return any(value in expected for value in get_field_values(document, field))
+    if kind == 'bool':
+        def clauses(name):
+            value = clause.get(name, list())
+            return value if isinstance(value, list) else [value]
+        if not all(match_query(doc_id, document, sub) for sub in clauses('must') + clauses('filter')):
+            return False
+        if any(match_query(doc_id, document, sub) for sub in clauses('must_not')):
+            return False
+        should = clauses('should')
+        required = int(clause.get('minimum_should_match', 0 if clause.get('must') or clause.get('filter') else 1))
+        return not should or sum(match_query(doc_id, document, sub) for sub in should) >= required
+    raise UnsupportedQueryError(f"query {kind} is not supported by the stand-in")
+
+
+def aggregate(documents: List, aggs: Dict) -> Dict:
+    """
+    Compute the terms (with size and missing), missing and filter aggregations, including their sub aggregations
+    :param documents: list of pairs of id and document
+    :param aggs: the aggregations of the request
+    :return: the aggregation results
+    """
+    results = dict()
+    for name, definition in aggs.items():
+        sub_aggs = definition.get('aggs', definition.get('aggregations', dict()))
+        kinds = [key for key in definition if key not in ('aggs', 'aggregations')]
+        if len(kinds) != 1:
+            raise UnsupportedQueryError(f"aggregation {name} needs exactly one type")
+        kind = kinds[0]
+        params = definition[kind]
+        if kind == 'terms':
+            buckets = dict()
+            for doc_id, document in documents:
+                values = set(get_field_values(document, params['field']))
+                if not values and 'missing' in params:
+                    values = {params['missing']}
+                for value in values:
+                    buckets.setdefault(value, list()).append((doc_id, document))
+            ordered = sorted(buckets.items(), key=lambda bucket: (-len(bucket[1]), str(bucket[0])))
+            size = params.get('size', 10)
+            results[name] = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(len(bucket_documents) for _, bucket_documents in ordered[size:]),
+                'buckets': [dict(aggregate(bucket_documents, sub_aggs), key=key, doc_count=len(bucket_documents))
+                            for key, bucket_documents in ordered[:size]]
+            }
+        elif kind in ('missing', 'filter'):
+            if kind == 'missing':
+                selected = [(doc_id, document) for doc_id, document in documents
+                            if not get_field_values(document, params['field'])]
+            else:
+                selected = [(doc_id, document) for doc_id, document in documents
+                            if match_query(doc_id, document, params)]
+            results[name] = dict(aggregate(selected, sub_aggs), doc_count=len(selected))
+        else:
+            raise UnsupportedQueryError(f"aggregation {kind} is not supported by the stand-in")
+    return results
+
+
+def es_scroll(scroll_id: str) -> Dict:
+    """
+    Return the next page of an open scroll
+    """
+    hits, size = ES_SCROLLS.get(scroll_id, (list(), 10))
+    ES_SCROLLS[scroll_id] = (hits[size:], size)
+    return {'_scroll_id': scroll_id, 'took': 1, 'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+            'hits': {'total': len(hits), 'max_score': 1.0, 'hits': hits[:size]}}
+
+
+def filter_source(document: Dict, source_fields) -> Dict:
+    """
+    Keep only the requested fields of the document, a dotted field keeps its top level field
+    """
+    if source_fields is None or source_fields is True:
+        return document
+    if source_fields is False:
+        return dict()
+    top_fields = {field.split('.')[0] for field in source_fields}
+    return {key: value for key, value in document.items() if key in top_fields}
+
+
+if __name__ == "__main__":
+    main()
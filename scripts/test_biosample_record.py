@@ -0,0 +1,28 @@
+import unittest
+from biosample_record import CompactBioSample
+
+
+class TestBioSampleRecord(unittest.TestCase):
+    def test_compact_biosample(self):
+        record = {
+            'accession': 'SAMEA1', 'name': 'animal 1', 'etag': '"abc"', 'release': '2019-01-01T00:00:00Z',
+            'update': '2019-01-02T00:00:00Z', 'taxId': 9913, '_links': {'self': {'href': 'https://biosamples'}},
+            'characteristics': {
+                'Material': [{'text': 'organism', 'ontologyTerms': ['OBI_0100026'], 'tag': 'attribute'}],
+                'birth weight': [{'text': '30', 'unit': 'kilogram'}]
+            },
+            'relationships': [{'source': 'SAMEA1', 'type': 'child of', 'target': 'SAMEA2', 'extra': 'x'}]
+        }
+        item = CompactBioSample(record)
+        self.assertEqual(item['accession'], 'SAMEA1')
+        self.assertDictEqual(item['characteristics']['Material'][0],
+                             {'text': 'organism', 'ontologyTerms': ['OBI_0100026']})
+        self.assertEqual(item['characteristics']['birth weight'][0]['unit'], 'kilogram')
+        self.assertListEqual(item['relationships'], [{'type': 'child of', 'source': 'SAMEA1', 'target': 'SAMEA2'}])
+        # the fields not in the original record behave as missing
+        self.assertNotIn('organization', item)
+        self.assertNotIn('taxId', item)
+        self.assertRaises(KeyError, lambda: item['organization'])
+        item['etag'] = '"def"'
+        self.assertEqual(item.get('etag'), '"def"')
+        self.assertFalse(hasattr(item, '__dict__'))
@@ -0,0 +1,27 @@
+import unittest
+import create_summary
+
+
+class TestCreateSummary(unittest.TestCase):
+    def test_parse_aggregations(self):
+        aggregations = {
+            'standard': {'buckets': [{'key': 'FAANG', 'doc_count': 3}]},
+            'standardMissing': {'doc_count': 1},
+            'paperPublished': {'doc_count': 1},
+            'sex': {'buckets': [{'key': 'male', 'doc_count': 1}, {'key': 'M', 'doc_count': 1},
+                                {'key': 'not determined', 'doc_count': 1}, {'key': 'unknown', 'doc_count': 1}]},
+            'organism': {'buckets': [{'key': 'Sus scrofa', 'doc_count': 4}]},
+            'breed': {'buckets': [{'key': 'Sus scrofa', 'doc_count': 4, 'breed': {'buckets': [
+                {'key': 'Large White', 'doc_count': 4}]}}]}
+        }
+        counts = create_summary.parse_aggregations(aggregations, 4,
+                                                   create_summary.SUMMARY_AGGREGATION_FIELDS['organism'])
+        self.assertDictEqual(counts['standard'], {'FAANG': 3, None: 1})
+        self.assertDictEqual(counts['paperPublished'], {'yes': 1, 'no': 3})
+        self.assertDictEqual(counts['sex'], {'male': 2, 'not determined': 2})
+        self.assertDictEqual(counts['organism'], {'Sus scrofa': 4})
+        self.assertDictEqual(counts['breed'], {'Sus scrofa': {'Large White': 4}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from etag_store import EtagStore
+
+
+class TestEtagStore(unittest.TestCase):
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.store = EtagStore(self.filename)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.filename)
+
+    def test_refresh(self):
+        refresh_started = datetime.now()
+        self.store.upsert_many([('SAMEA1', '"1"'), ('SAMEA2', '"2"')])
+        self.store.set_last_refresh(refresh_started)
+        self.assertDictEqual(self.store.get_all(), {'SAMEA1': '"1"', 'SAMEA2': '"2"'})
+        self.assertEqual(self.store.get('SAMEA1'), '"1"')
+        self.assertNotIn('SAMEA3', self.store)
+
+        # SAMEA2 no longer listed in the next refresh
+        refresh_started = datetime.now() + timedelta(seconds=1)
+        self.store.mark_seen(['SAMEA1'], refresh_started)
+        self.store.set_last_refresh(refresh_started)
+        self.assertDictEqual(self.store.get_all(), {'SAMEA1': '"1"'})
+        self.assertEqual(len(self.store), 2)
+
+    def test_stale_and_prune(self):
+        self.store.upsert_many([('SAMEA1', '"1"')], datetime.now() - timedelta(days=10))
+        self.store.upsert_many([('SAMEA2', '"2"')])
+        self.assertSetEqual(self.store.get_stale(7), {'SAMEA1'})
+        self.assertEqual(self.store.prune(7), 1)
+        self.assertSetEqual(self.store.get_accessions(), {'SAMEA2'})
+
+    def test_failed(self):
+        self.assertSetEqual(self.store.get_failed(), set())
+        self.store.set_failed({'SAMEA2', 'SAMEA1'})
+        self.assertSetEqual(self.store.get_failed(), {'SAMEA1', 'SAMEA2'})
+        self.store.set_failed(set())
+        self.assertSetEqual(self.store.get_failed(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
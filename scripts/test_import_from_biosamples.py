@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from functools import partial
+from unittest.mock import patch
+import requests
+import import_from_biosamples
+from local_cache import LocalCache
+
+
+class TestImportFromBiosamples(unittest.TestCase):
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        import_from_biosamples.to_es_flag = False
+        # OLS is down and the cache is in the temporary file
+        self.patches = [patch.object(import_from_biosamples, 'LocalCache', partial(LocalCache, filename=self.filename)),
+                        patch.object(import_from_biosamples, 'get_material_children',
+                                     side_effect=requests.exceptions.ConnectionError('OLS down'))]
+        for one_patch in self.patches:
+            one_patch.start()
+
+    def tearDown(self):
+        for one_patch in self.patches:
+            one_patch.stop()
+        os.remove(self.filename)
+
+    def test_material_types_without_cache(self):
+        all_material_types, complete = import_from_biosamples.get_all_material_types(None)
+        self.assertFalse(complete)
+        self.assertDictEqual(all_material_types, {base_material: base_material for base_material
+                                                  in import_from_biosamples.MATERIAL_TYPES.keys()})
+
+    def test_material_types_from_outdated_cache(self):
+        terms = {'organism': 'organism', 'primary cell culture': 'cell culture'}
+        key = f'{import_from_biosamples.MATERIAL_TYPES_CACHE_VERSION}|' \
+            f'{import_from_biosamples.content_hash(import_from_biosamples.MATERIAL_TYPES)}'
+        fetched_at = datetime.now() - timedelta(days=import_from_biosamples.MATERIAL_TYPES_CACHE_DAYS + 1)
+        cache = LocalCache('ols_material_types', self.filename)
+        cache.set(key, {'fetchedAt': fetched_at.strftime('%Y-%m-%d %H:%M:%S'), 'terms': terms})
+        cache.close()
+        self.assertEqual(import_from_biosamples.get_all_material_types(None), (terms, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import import_from_ena
+from datetime import datetime
 
 
 class TestImportFromEna(unittest.TestCase):
@@ -22,3 +23,11 @@ class TestImportFromEna(unittest.TestCase):
         self.assertEqual(import_from_ena.replace_alias_with_accession('PRJEB31482', 'SSRX357350'), '')
         self.assertEqual(import_from_ena.replace_alias_with_accession('PRJEB31482', 'DRX000228wrong'), '')
 
+    def test_get_updated_since(self):
+        watermark = {'lastUpdated': '2020-03-10', 'lastFullImport': '2020-03-05'}
+        today = datetime(2020, 3, 11)
+        self.assertEqual(import_from_ena.get_updated_since(watermark, True, 7, today), '2020-03-10')
+        # full import when not requested, never imported or the last full import is too old
+        self.assertIsNone(import_from_ena.get_updated_since(watermark, False, 7, today))
+        self.assertIsNone(import_from_ena.get_updated_since(None, True, 7, today))
+        self.assertIsNone(import_from_ena.get_updated_since(watermark, True, 6, today))
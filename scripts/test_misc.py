@@ -34,3 +34,7 @@ class TestMisc(unittest.TestCase):
     def test_from_lower_camel_case_types(self):
         self.assertRaises(TypeError, misc.from_lower_camel_case, 34)
         self.assertRaises(TypeError, misc.from_lower_camel_case, True)
+
+    def test_content_hash(self):
+        self.assertEqual(misc.content_hash({'a': 1, 'b': [1, 2]}), misc.content_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(misc.content_hash({'a': 1}), misc.content_hash({'a': 2}))
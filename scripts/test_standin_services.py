@@ -0,0 +1,149 @@
+import os
+import unittest
+import requests
+from click.testing import CliRunner
+from elasticsearch import Elasticsearch, helpers
+from elasticsearch.exceptions import RequestError
+import constants
+import clean_articles
+import create_summary
+import initialize_es_index
+import standin_services
+import utils
+from misc import get_filename_from_url
+
+
+class TestStandInServices(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        standin_services.DATASET.update(standin_services.build_dataset(10, 100))
+        cls.servers = standin_services.start_servers('localhost', 0, 0)
+        cls.ebi = f"http://localhost:{cls.servers[0].server_address[1]}"
+        cls.es_host = f"localhost:{cls.servers[1].server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+
+    def tearDown(self):
+        standin_services.ERROR_RATE = 0.0
+
+    def test_biosamples_pages(self):
+        url = f"{self.ebi}/biosamples/samples?size=2&filter=attr%3Aproject%3AFAANG"
+        accessions = list()
+        while url:
+            page = requests.get(url).json()
+            accessions.extend(sample['accession'] for sample in page['_embedded']['samples'])
+            url = page['_links']['next']['href'] if 'next' in page['_links'] else ''
+        self.assertEqual(accessions, [f"SAMEA900000{i}" for i in range(10)])
+        response = requests.head(f"{self.ebi}/biosamples/samples/SAMEA9000001")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response.headers)
+
+    def test_ena_search(self):
+        query = 'query=study_accession%3D%22PRJEB90003%22'
+        url = f"{self.ebi}/ena/portal/api/search/?result=read_run&format=TSV&limit=0&{query}" \
+            f"&fields=run_accession,study_accession,tax_id&dataPortal=faang"
+        records = list(utils.iterate_ena_tsv(url))
+        self.assertEqual(len(records), 10)
+        self.assertEqual(set(record['study_accession'] for record in records), {'PRJEB90003'})
+        self.assertEqual(records[0]['tax_id'], '9823')
+        url = f"{self.ebi}/ena/portal/api/search/?result=read_run&format=JSON&limit=0" \
+            f"&query=study_accession%3D%22PRJEB1%22&fields=run_accession&dataPortal=faang"
+        self.assertEqual(requests.get(url).status_code, 204)
+
+    def test_legacy_studies(self):
+        # the legacy studies are only in the general ENA portal and refer to samples not listed as FAANG
+        query = 'query=library_strategy%3D%22RNA-Seq%22%20AND%20tax_eq(9823,9913,9031)'
+        url = f"{self.ebi}/ena/portal/api/search/?result=read_run&format=JSON&limit=0&{query}" \
+            f"&fields=study_accession,sample_accession,tax_id,project_name"
+        records = requests.get(f"{url}&dataPortal=faang").json()
+        self.assertEqual(set(record['study_accession'] for record in records), {'PRJEB90009'})
+        records = requests.get(f"{url}&dataPortal=ena").json()
+        self.assertEqual(set(record['study_accession'] for record in records), {'PRJEB90001', 'PRJEB90009'})
+        records = [record for record in records if record['study_accession'] == 'PRJEB90001']
+        self.assertEqual(set(record['project_name'] for record in records), {''})
+        self.assertGreater(len(set(record['tax_id'] for record in records)), 1)
+        sample = requests.get(f"{self.ebi}/biosamples/samples/{records[0]['sample_accession']}").json()
+        self.assertNotIn('project', sample['characteristics'])
+        self.assertEqual(sample['relationships'][0]['type'], 'derived from')
+        self.assertEqual(requests.get(f"{self.ebi}/biosamples/samples/{sample['relationships'][0]['target']}")
+                         .status_code, 200)
+
+    def test_analysis_conversion(self):
+        # the query of import_analysis
+        url = utils.generate_ena_api_endpoint('analysis', 'faang', 'all')
+        url = url.replace(constants.ENA_PORTAL_API_URL, f"{self.ebi}/ena/portal/api")
+        records = requests.get(url).json()
+        self.assertEqual(len(records), 70)
+        for record in records:
+            es_doc = utils.convert_analysis(record, set())
+            self.assertEqual(es_doc['accession'], record['analysis_accession'])
+            for field in ['project_name', 'secondary_project', 'experiment_accession', 'run_accession',
+                          'related_analysis_accession', 'analysis_description', 'assay_type', 'reference_genome',
+                          'analysis_date', 'analysis_code_repository', 'sample_accession']:
+                self.assertIn(field, record)
+            self.assertTrue(get_filename_from_url(record['analysis_protocol'], record['analysis_accession']))
+
+    def test_error_injection(self):
+        standin_services.ERROR_RATE = 1.0
+        response = requests.get(f"{self.ebi}/eva/webservices/rest/v1/meta/studies/all")
+        self.assertEqual(response.status_code, standin_services.ERROR_STATUS)
+
+    def test_elasticsearch(self):
+        es = Elasticsearch([self.es_host])
+        actions = [{'_index': 'standin_organism', '_type': '_doc', '_id': f"SAMEA{i}",
+                    '_source': {'biosampleId': f"SAMEA{i}", 'etag': str(i)}} for i in range(25)]
+        helpers.bulk(es, actions)
+        hits = list(utils.iterate_records(es, 'standin_organism', ['etag'], page_size=10))
+        self.assertEqual(len(hits), 25)
+        self.assertEqual(hits[3]['_source'], {'etag': '3'})
+        self.assertEqual(es.count(index='standin_organism')['count'], 25)
+        self.assertEqual(es.count(index='standin_organism', body={'query': {'term': {'etag': '3'}}})['count'], 1)
+        with self.assertRaises(RequestError):
+            es.search(index='standin_organism', body={'query': {'match': {'etag': '3'}}})
+
+    def test_initialize_es_index(self):
+        # the mapping is acknowledged but not stored as a document
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        try:
+            result = CliRunner().invoke(initialize_es_index.main, ['--es_host', f"http://{self.es_host}",
+                                                                   '--target_type', 'organism', 'initialized'])
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(result.exit_code, 0)
+        es = Elasticsearch([self.es_host])
+        self.assertTrue(es.indices.exists('initialized_organism'))
+        self.assertEqual(es.count(index='initialized_organism')['count'], 0)
+        with self.assertRaises(RequestError):
+            es.index(index='initialized_organism', doc_type='_doc', id='_doc', body={})
+
+    def test_document_update(self):
+        es = Elasticsearch([self.es_host])
+        es.index(index='standin_dataset', doc_type='_doc', id='PRJEB1',
+                 body={'accession': 'PRJEB1', 'paperPublished': 'true', 'publishedArticles': [{'pmcId': 'PMC1'}]})
+        clean_articles.clean_records('standin_dataset', ['PRJEB1'], es)
+        self.assertEqual(es.get(index='standin_dataset', doc_type='_doc', id='PRJEB1')['_source'],
+                         {'accession': 'PRJEB1', 'paperPublished': 'false', 'publishedArticles': []})
+
+    def test_summary_aggregations(self):
+        es = Elasticsearch([self.es_host])
+        actions = [{'_index': 'organism', '_type': '_doc', '_id': f"SAMEA{i}",
+                    '_source': {'standardMet': 'FAANG' if i % 3 else 'Legacy',
+                                'paperPublished': 'true' if i % 2 else 'false',
+                                'sex': {'text': 'male' if i % 4 else 'female'}, 'organism': {'text': 'Sus scrofa'},
+                                'breed': {'text': 'Large White'}}} for i in range(12)]
+        helpers.bulk(es, actions)
+        # the aggregations give the same counts as reading all documents with the FAANG only query
+        summary = create_summary.CreateSummary(es, None)
+        expected = summary.get_counts('organism', summary.count_organism_records)
+        summary.use_aggregations = True
+        self.assertEqual(summary.get_counts('organism', summary.count_organism_records), expected)
+        self.assertEqual(expected[True]['standard'], {'FAANG': 8})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import json
+import unittest
+from types import SimpleNamespace
+from elasticsearch.serializer import JSONSerializer
+import utils
+
+
+class FakeElasticsearch:
+    """
+    Minimal stand-in for the Elasticsearch client which records the bulk requests
+    Documents with id starting with 'bad' are rejected unless written into the log index
+    """
+    def __init__(self):
+        self.bulk_requests = list()
+        # the bulk helpers use the serializer of the transport
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+
+    def bulk(self, body, **kwargs):
+        lines = body.strip().split('\n')
+        self.bulk_requests.append(lines)
+        items = list()
+        for line in lines:
+            action = json.loads(line)
+            if len(action) != 1 or list(action.keys())[0] not in ('index', 'update', 'delete', 'create'):
+                # data line
+                continue
+            op_type, meta = action.popitem()
+            if meta['_id'].startswith('bad') and not meta['_index'].endswith('_log'):
+                items.append({op_type: {'_id': meta['_id'], 'status': 400, 'error': 'mapper_parsing_exception'}})
+            else:
+                items.append({op_type: {'_id': meta['_id'], 'status': 201}})
+        return {'errors': False, 'items': items}
+
+    def count(self, index):
+        return {'count': 10}
+
+
+class TestBulkWriter(unittest.TestCase):
+    def test_flush_on_chunk_size(self):
+        es = FakeElasticsearch()
+        writer = utils.BulkWriter(es, chunk_size=2)
+        writer.index('faang_build_3', 'organism', 'SAMEA1', {'biosampleId': 'SAMEA1'})
+        self.assertEqual(len(es.bulk_requests), 0)
+        writer.index('faang_build_3', 'organism', 'SAMEA2', '{"biosampleId": "SAMEA2"}')
+        self.assertEqual(len(es.bulk_requests), 1)
+        # one action line and one data line per document
+        self.assertEqual(len(es.bulk_requests[0]), 4)
+        self.assertEqual(json.loads(es.bulk_requests[0][0])['index']['_index'], 'faang_build_3_organism')
+        self.assertEqual(writer.succeeded, 2)
+
+    def test_flush_on_bytes(self):
+        es = FakeElasticsearch()
+        writer = utils.BulkWriter(es, chunk_size=100, max_chunk_bytes=10)
+        writer.index('faang_build_3', 'file', 'ERR1', {'name': 'a long enough file name'})
+        self.assertEqual(len(es.bulk_requests), 1)
+
+    def test_upsert(self):
+        es = FakeElasticsearch()
+        writer = utils.BulkWriter(es)
+        writer.upsert('faang_build_3', 'dataset', 'PRJEB1', {'paperPublished': 'true'})
+        writer.flush()
+        action, data = es.bulk_requests[0]
+        self.assertIn('update', json.loads(action))
+        self.assertDictEqual(json.loads(data), {'doc': {'paperPublished': 'true'}, 'doc_as_upsert': True})
+
+    def test_update(self):
+        es = FakeElasticsearch()
+        writer = utils.BulkWriter(es)
+        writer.update('faang_build_3', 'file', 'ERR1', {'paperPublished': 'true'})
+        writer.flush()
+        action, data = es.bulk_requests[0]
+        self.assertIn('update', json.loads(action))
+        self.assertDictEqual(json.loads(data), {'doc': {'paperPublished': 'true'}})
+
+    def test_delete(self):
+        es = FakeElasticsearch()
+        writer = utils.BulkWriter(es)
+        writer.delete('faang_build_3', 'specimen', 'SAMEA1')
+        writer.flush()
+        # no data line for delete
+        self.assertEqual(len(es.bulk_requests[0]), 1)
+        self.assertEqual(json.loads(es.bulk_requests[0][0])['delete']['_id'], 'SAMEA1')
+        self.assertEqual(writer.succeeded, 1)
+
+    def test_failure_reported_into_log_index(self):
+        es = FakeElasticsearch()
+        writer = utils.BulkWriter(es)
+        writer.index('faang_build_3', 'specimen', 'bad1', {'biosampleId': 'bad1'})
+        writer.index('faang_build_3', 'specimen', 'SAMEA2', {'biosampleId': 'SAMEA2'})
+        writer.flush()
+        self.assertEqual(writer.succeeded, 2)
+        self.assertEqual(writer.failed, 1)
+        # the second request carries the error log entry
+        self.assertEqual(len(es.bulk_requests), 2)
+        action, data = es.bulk_requests[1]
+        self.assertEqual(json.loads(action)['index']['_index'], 'faang_build_3_log')
+        log_doc = json.loads(data)
+        self.assertEqual(log_doc['accession'], 'bad1')
+        self.assertEqual(log_doc['status'], 'error')
+
+
+class TestSystemLogSink(unittest.TestCase):
+    def test_serial_and_bulk_write(self):
+        es = FakeElasticsearch()
+        sink = utils.SystemLogSink(es, flush_size=100, flush_interval=60)
+        sink.write('import_from_ena', 'info', 10, 'Start', '2019-01-01 00:00:00')
+        sink.write('import_from_ena', 'info', 20, 'Finish', '2019-01-01 00:00:01')
+        self.assertEqual(len(es.bulk_requests), 0)
+        sink.close()
+        self.assertEqual(len(es.bulk_requests), 1)
+        actions = [json.loads(line) for line in es.bulk_requests[0]]
+        self.assertEqual(actions[0]['create']['_index'], 'sys_log')
+        self.assertEqual([actions[1]['serial'], actions[3]['serial']], [11, 12])
+
+
+class FakeSession:
+    """
+    Minimal stand-in for the requests session which returns the given status codes in turn
+    """
+    def __init__(self, status_codes):
+        self.status_codes = list(status_codes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(status_code=self.status_codes.pop(0), headers=dict())
+
+
+class TestRequestWithRetry(unittest.TestCase):
+    def test_retry_on_server_error(self):
+        session = FakeSession([503, 429, 200])
+        response = utils.request_with_retry(session, 'http://localhost', backoff=0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.calls, 3)
+
+    def test_no_retry_on_client_error(self):
+        session = FakeSession([404, 200])
+        response = utils.request_with_retry(session, 'http://localhost', backoff=0)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(session.calls, 1)
+
+    def test_last_response_returned(self):
+        session = FakeSession([500, 500])
+        response = utils.request_with_retry(session, 'http://localhost', retries=2, backoff=0)
+        self.assertEqual(response.status_code, 500)
+
+
+class TestParseEnaTsv(unittest.TestCase):
+    def test_parse_ena_tsv(self):
+        lines = ['run_accession\tfastq_ftp\tstudy_title', '', 'ERR1\tftp.sra.ebi.ac.uk/ERR1.fastq.gz\tTitle one',
+                 'ERR2\t']
+        records = list(utils.parse_ena_tsv(lines))
+        self.assertEqual(len(records), 2)
+        self.assertDictEqual(records[0], {'run_accession': 'ERR1', 'fastq_ftp': 'ftp.sra.ebi.ac.uk/ERR1.fastq.gz',
+                                          'study_title': 'Title one'})
+        self.assertDictEqual(records[1], {'run_accession': 'ERR2', 'fastq_ftp': '', 'study_title': ''})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+import validate_record
+
+
+class TestValidateRecord(unittest.TestCase):
+    def test_build_cached_results(self):
+        cached = [
+            {'id': 'SAMEA1', 'detail': {'status': 'pass', 'message': ''}, 'errors': []},
+            {'id': 'SAMEA2', 'detail': {'status': 'error', 'message': '(ERROR)sex:wrong'}, 'errors': ['sex:wrong']},
+            {'id': 'SAMEA3', 'detail': {'status': 'error', 'message': '(ERROR)sex:wrong'}, 'errors': ['sex:wrong']}
+        ]
+        result = validate_record.build_cached_results(cached)
+        self.assertDictEqual(result['summary'], {'pass': 1, 'error': 2})
+        self.assertDictEqual(result['errors'], {'sex:wrong': 2})
+        self.assertDictEqual(result['detail']['SAMEA2'], {'status': 'error', 'message': '(ERROR)sex:wrong'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,17 @@
 """
 Different function that could be used in any faang backend script
 """
+import atexit
 import json
 import logging
+import random
+import threading
+import time
 from typing import Set, List, Dict
 import requests
-from constants import STANDARDS, STANDARD_FAANG, TYPES
-from elasticsearch import Elasticsearch
+from constants import STANDARDS, STANDARD_FAANG, TYPES, ENA_PORTAL_API_URL
+from elasticsearch import Elasticsearch, helpers
+from elasticsearch.serializer import JSONSerializer
 from misc import convert_readable
 from datetime import datetime
 from inspect import currentframe
@@ -44,19 +49,19 @@ def create_logging_instance(name, level=logging.INFO, to_file=True):
 
 
 def write_system_log(es, script, level: str, line, detail, to_es=True):
+    """
+    Write one system log entry either into the sys_log index or to the terminal
+    The entries for the sys_log index are buffered and written in bulk by the shared SystemLogSink
+    :param es: elasticsearch python library instance
+    :param script: the name of the script writing the log
+    :param level: the level of the log entry, e.g. info, warning, error
+    :param line: the line number where the log is written
+    :param detail: the log message
+    :param to_es: indicates whether write to the sys_log index (True, default value) or the terminal (False)
+    """
     now = datetime.now()
     if to_es:
-        tmp = es.count(index='sys_log')
-        current_count = tmp['count'] + 1
-        doc = {
-            'serial': current_count,
-            'script': script,
-            'level': level,
-            'timestamp': now,
-            'line': line,
-            'detail': detail
-        }
-        es.create(index='sys_log', doc_type='_doc', body=doc, id=f'{script}-{now}', refresh=True)
+        get_system_log_sink(es).write(script, level, line, detail, now)
     else:
         print(f'{now} - {script} - {level.upper()} - line {line} - {detail}')
 
@@ -69,10 +74,315 @@ def get_line_number():
 logger = create_logging_instance('utils')
 logging.getLogger('elasticsearch').setLevel(logging.WARNING)
 
+# default size of one bulk request, whichever of the two limits is reached first triggers sending the buffer
+BULK_CHUNK_SIZE = 500
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+# one shared bulk writer per Elasticsearch instance, keys are id() of the instance
+BULK_WRITERS = dict()
+
+
+class BulkWriter:
+    """
+    Buffer the document operations and send them to Elasticsearch with the bulk API
+    The buffer is flushed when either the number of buffered operations or their total size reaches the limit,
+    or when flush() is called explicitly. Failed operations are reported into the <es_index_prefix>_log index
+    """
+    def __init__(self, es, chunk_size=BULK_CHUNK_SIZE, max_chunk_bytes=BULK_MAX_CHUNK_BYTES):
+        """
+        :param es: elasticsearch python library instance
+        :param chunk_size: the maximum number of operations sent in one bulk request
+        :param max_chunk_bytes: the maximum size (in bytes) of the documents sent in one bulk request
+        """
+        self.es = es
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.actions = list()
+        # the extra information (index prefix and type) needed to report the errors of the buffered actions
+        self.action_details = list()
+        self.buffered_bytes = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.lock = threading.RLock()
+        # the same serializer used by the elasticsearch library, e.g. converting datetime into ISO format
+        self.serializer = JSONSerializer()
+
+    def index(self, es_index_prefix, doc_type, doc_id, body):
+        """
+        Create the document or replace the existing one with the same id
+        :param es_index_prefix: combined with doc_type to determine which index to write into
+        :param doc_type: combined with es_index_prefix to determine which index to write into
+        :param doc_id: the id of the document to be indexed
+        :param body: the data of the document to be indexed, either dict or already serialized JSON string
+        """
+        self.add(es_index_prefix, doc_type, doc_id, body, 'index')
+
+    def upsert(self, es_index_prefix, doc_type, doc_id, body):
+        """
+        Merge the given fields into the existing document, create the document if it does not exist yet
+        :param es_index_prefix: combined with doc_type to determine which index to write into
+        :param doc_type: combined with es_index_prefix to determine which index to write into
+        :param doc_id: the id of the document to be updated
+        :param body: the fields to be updated, either dict or already serialized JSON string
+        """
+        self.add(es_index_prefix, doc_type, doc_id, body, 'upsert')
+
+    def update(self, es_index_prefix, doc_type, doc_id, body):
+        """
+        Merge the given fields into the existing document, the operation fails if the document does not exist
+        :param es_index_prefix: combined with doc_type to determine which index to write into
+        :param doc_type: combined with es_index_prefix to determine which index to write into
+        :param doc_id: the id of the document to be updated
+        :param body: the fields to be updated, either dict or already serialized JSON string
+        """
+        self.add(es_index_prefix, doc_type, doc_id, body, 'update')
+
+    def delete(self, es_index_prefix, doc_type, doc_id):
+        """
+        Remove the document, a document already removed is not treated as a failure
+        :param es_index_prefix: combined with doc_type to determine which index to delete from
+        :param doc_type: combined with es_index_prefix to determine which index to delete from
+        :param doc_id: the id of the document to be removed
+        """
+        self.add(es_index_prefix, doc_type, doc_id, None, 'delete')
+
+    def add(self, es_index_prefix, doc_type, doc_id, body, op_type):
+        """
+        Buffer one operation and send the buffer if the limits have been reached
+        :param es_index_prefix: combined with doc_type to determine which index to write into
+        :param doc_type: combined with es_index_prefix to determine which index to write into
+        :param doc_id: the id of the document
+        :param body: the data of the document, either dict or already serialized JSON string, None for delete
+        :param op_type: one of index, upsert, update and delete
+        """
+        if body is not None and not isinstance(body, str):
+            body = self.serializer.dumps(body)
+        action = {
+            '_index': f'{es_index_prefix}_{doc_type}',
+            '_type': '_doc',
+            '_id': doc_id
+        }
+        if op_type == 'index':
+            action['_op_type'] = 'index'
+            action['_source'] = body
+        elif op_type == 'upsert':
+            action['_op_type'] = 'update'
+            action['_source'] = f'{{"doc": {body}, "doc_as_upsert": true}}'
+        elif op_type == 'update':
+            action['_op_type'] = 'update'
+            action['_source'] = f'{{"doc": {body}}}'
+        elif op_type == 'delete':
+            action['_op_type'] = 'delete'
+        else:
+            raise ValueError(f'Unsupported bulk operation {op_type}')
+        with self.lock:
+            self.actions.append(action)
+            self.action_details.append((es_index_prefix, doc_type, doc_id))
+            self.buffered_bytes += len(action.get('_source', ''))
+            if len(self.actions) >= self.chunk_size or self.buffered_bytes >= self.max_chunk_bytes:
+                self.flush()
+
+    def flush(self):
+        """
+        Send all buffered operations to Elasticsearch
+        Failed operations are logged and written into the log index of the same index prefix
+        """
+        with self.lock:
+            if not self.actions:
+                return
+            actions = self.actions
+            action_details = self.action_details
+            self.actions = list()
+            self.action_details = list()
+            self.buffered_bytes = 0
+            failures = list()
+            try:
+                results = helpers.streaming_bulk(self.es, actions, chunk_size=self.chunk_size,
+                                                 max_chunk_bytes=self.max_chunk_bytes,
+                                                 raise_on_error=False, raise_on_exception=False)
+                for (ok, item), detail in zip(results, action_details):
+                    if ok or item.get('delete', {}).get('status') == 404:
+                        self.succeeded += 1
+                    else:
+                        self.failed += 1
+                        failures.append((detail, item))
+            except Exception as e:
+                self.failed += len(actions)
+                logger.error(f"Error when sending {len(actions)} bulk operations: " + str(e.args))
+                return
+            for (es_index_prefix, doc_type, doc_id), item in failures:
+                op_type, info = item.copy().popitem()
+                reason = info.get('error', '')
+                logger.error(f"Error when try to {op_type} {doc_id} into index {es_index_prefix}_{doc_type}: "
+                             f"{reason}")
+                # avoid endless loop when writing the log index itself fails
+                if doc_type != 'log':
+                    self.index(es_index_prefix, 'log', doc_id,
+                               generate_es_log(doc_type, doc_id, 'error',
+                                               f'failed to write into {es_index_prefix}_{doc_type}: {reason}'))
+            if failures:
+                self.flush()
+
+
+def get_bulk_writer(es) -> BulkWriter:
+    """
+    Get the bulk writer shared by all functions writing into the given Elasticsearch instance
+    :param es: elasticsearch python library instance
+    :return: the shared bulk writer
+    """
+    key = id(es)
+    if key not in BULK_WRITERS:
+        BULK_WRITERS[key] = BulkWriter(es)
+    return BULK_WRITERS[key]
+
+
+def flush_bulk_writer(es, refresh=False):
+    """
+    Send all buffered operations for the given Elasticsearch instance, which must be called before reading back
+    the documents written in the same run
+    :param es: elasticsearch python library instance
+    :param refresh: if True, also refresh all indices to make the written documents searchable straightaway
+    """
+    get_bulk_writer(es).flush()
+    if refresh:
+        es.indices.refresh(index='_all')
+
+
+@atexit.register
+def flush_all_bulk_writers():
+    """
+    Make sure no buffered operation is lost when the script exits
+    """
+    for writer in BULK_WRITERS.values():
+        writer.flush()
+
+
+# the system log entries are written when this many entries are waiting or every this many seconds
+SYS_LOG_FLUSH_SIZE = 200
+SYS_LOG_FLUSH_INTERVAL = 5
+# one shared system log sink per Elasticsearch instance, keys are id() of the instance
+SYS_LOG_SINKS = dict()
+
+
+class SystemLogSink:
+    """
+    Collect the system log entries in memory and write them into the sys_log index in bulk from a background thread
+    The serial number is only counted from the sys_log index once, then assigned locally.
+    The index is not refreshed on writing, the entries become searchable with the normal refresh interval
+    """
+    def __init__(self, es, flush_size=SYS_LOG_FLUSH_SIZE, flush_interval=SYS_LOG_FLUSH_INTERVAL):
+        """
+        :param es: elasticsearch python library instance
+        :param flush_size: the number of waiting entries which triggers writing
+        :param flush_interval: the maximum number of seconds an entry waits before being written
+        """
+        self.es = es
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.entries = list()
+        self.next_serial = None
+        self.lock = threading.Lock()
+        # only one thread sends the entries at a time to keep the serial order
+        self.flush_lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.stopped = False
+        self.worker = None
+
+    def write(self, script, level, line, detail, timestamp):
+        """
+        Add one entry to the buffer, the actual writing happens in the background
+        :param script: the name of the script writing the log
+        :param level: the level of the log entry
+        :param line: the line number where the log is written
+        :param detail: the log message
+        :param timestamp: the time when the log is written
+        """
+        with self.lock:
+            if self.next_serial is None:
+                self.next_serial = self.es.count(index='sys_log')['count'] + 1
+            doc = {
+                'serial': self.next_serial,
+                'script': script,
+                'level': level,
+                'timestamp': timestamp,
+                'line': line,
+                'detail': detail
+            }
+            self.next_serial += 1
+            self.entries.append({
+                '_op_type': 'create',
+                '_index': 'sys_log',
+                '_type': '_doc',
+                '_id': f'{script}-{timestamp}',
+                '_source': doc
+            })
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name='sys_log', daemon=True)
+                self.worker.start()
+            if len(self.entries) >= self.flush_size:
+                self.wake_up.set()
+
+    def run(self):
+        """
+        The background loop which writes the entries on size or on interval
+        """
+        while not self.stopped:
+            self.wake_up.wait(self.flush_interval)
+            self.wake_up.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Write all waiting entries into the sys_log index
+        """
+        with self.flush_lock:
+            with self.lock:
+                entries = self.entries
+                self.entries = list()
+            if not entries:
+                return
+            try:
+                _, errors = helpers.bulk(self.es, entries, raise_on_error=False, raise_on_exception=False)
+                for error in errors:
+                    logger.error(f"Error when writing system log: {error}")
+            except Exception as e:
+                logger.error(f"Error when writing {len(entries)} system log entries: " + str(e.args))
+
+    def close(self):
+        """
+        Stop the background thread and write the remaining entries
+        """
+        self.stopped = True
+        self.wake_up.set()
+        if self.worker is not None:
+            self.worker.join()
+        self.flush()
+
+
+def get_system_log_sink(es) -> SystemLogSink:
+    """
+    Get the system log sink shared by all scripts writing into the given Elasticsearch instance
+    :param es: elasticsearch python library instance
+    :return: the shared system log sink
+    """
+    key = id(es)
+    if key not in SYS_LOG_SINKS:
+        SYS_LOG_SINKS[key] = SystemLogSink(es)
+    return SYS_LOG_SINKS[key]
+
+
+@atexit.register
+def close_all_system_log_sinks():
+    """
+    Make sure no system log entry is lost when the script exits
+    """
+    for sink in SYS_LOG_SINKS.values():
+        sink.close()
+
 
 def insert_into_es(es, es_index_prefix, doc_type, doc_id, body):
     """
-    index data into ES
+    index data into ES, the document replaces any existing document with the same id
+    The document is buffered and sent in bulk, use flush_bulk_writer before reading it back
     :param es: elasticsearch python library instance
     :param es_index_prefix: combined with doc_type to determine which index to write into
     :param doc_type: combined with es_index_prefix to determine which index to write into
@@ -80,13 +390,20 @@ def insert_into_es(es, es_index_prefix, doc_type, doc_id, body):
     :param body: the data of the document to be indexed
     :return:
     """
-    try:
-        existing_flag = es.exists(index=f'{es_index_prefix}_{doc_type}', doc_type="_doc", id=doc_id)
-        if existing_flag:
-            es.delete(index=f'{es_index_prefix}_{doc_type}', doc_type="_doc", id=doc_id)
-        es.create(index=f'{es_index_prefix}_{doc_type}', doc_type="_doc", id=doc_id, body=body)
-    except Exception as e:
-        logger.error(f"Error when try to insert into index {es_index_prefix}_{doc_type}: " + str(e.args))
+    get_bulk_writer(es).index(es_index_prefix, doc_type, doc_id, body)
+
+
+def delete_from_es(es, es_index_prefix, doc_type, doc_id):
+    """
+    delete the document from ES
+    The deletion is buffered and sent in bulk, use flush_bulk_writer to make sure it has been sent
+    :param es: elasticsearch python library instance
+    :param es_index_prefix: combined with doc_type to determine which index to delete from
+    :param doc_type: combined with es_index_prefix to determine which index to delete from
+    :param doc_id: the id of the document to be deleted
+    :return:
+    """
+    get_bulk_writer(es).delete(es_index_prefix, doc_type, doc_id)
 
 
 def insert_es_log(es, es_index_prefix, doc_type, doc_id, status, detail):
@@ -99,6 +416,18 @@ def insert_es_log(es, es_index_prefix, doc_type, doc_id, status, detail):
     :param status: the status of the data record during importation, one of 'pass', 'warning', 'error'
     :param detail: the detail of the import log, empty if the status is pass
     """
+    insert_into_es(es, es_index_prefix, 'log', doc_id, generate_es_log(doc_type, doc_id, status, detail))
+
+
+def generate_es_log(doc_type, doc_id, status, detail):
+    """
+    generate the log entry document for the data record
+    :param doc_type: the type of the data record
+    :param doc_id: the id of the data record
+    :param status: the status of the data record during importation, one of 'pass', 'warning', 'error'
+    :param detail: the detail of the import log, empty if the status is pass
+    :return: the log entry document
+    """
     now = datetime.now()
     doc = {
         'accession': doc_id,
@@ -107,7 +436,7 @@ def insert_es_log(es, es_index_prefix, doc_type, doc_id, status, detail):
         'detail': detail,
         'last_update': now
     }
-    insert_into_es(es, es_index_prefix, 'log', doc_id, doc)
+    return doc
 
 
 def get_record_ids(host: str, es_index_prefix: str, data_type: str, only_faang=True) -> Set[str]:
@@ -149,6 +478,32 @@ def get_record_number(host: str, es_index_prefix: str, data_type: str) -> int:
     return response['hits']['total']
 
 
+# the number of documents fetched per page when streaming an index
+SCAN_PAGE_SIZE = 1000
+
+
+def iterate_records(es, index: str, source_fields: List = None, query: Dict = None, page_size=SCAN_PAGE_SIZE):
+    """
+    Stream all documents of one index page by page with the scroll api, so that neither Elasticsearch nor the script
+    need to hold the whole index in memory and the result is not limited by max_result_window
+    :param es: elasticsearch python library instance
+    :param index: the name of the index
+    :param source_fields: the list of fields to return, None means the whole document
+    :param query: the optional query clause, by default all documents
+    :param page_size: the number of documents retrieved per scroll request
+    :return: generator of hits, each having _id and _source
+    """
+    body = dict()
+    if query is not None:
+        body['query'] = query
+    if source_fields is not None:
+        body['_source'] = source_fields
+    # without preserve_order the scan is sorted by _doc, the cheapest order to scroll
+    for hit in helpers.scan(es, query=body, index=index, size=page_size):
+        hit.setdefault('_source', dict())
+        yield hit
+
+
 def get_record_details(host: str, es_index_prefix: str, data_type: str, return_fields: List) -> Dict:
     """
     Get the subset of record details
@@ -158,15 +513,12 @@ def get_record_details(host: str, es_index_prefix: str, data_type: str, return_f
     :param return_fields: the list of fields containing the wanted information
     :return: a dict having record id as keys, and all field values as values
     """
-    total_number = get_record_number(host, es_index_prefix, data_type)
-    if total_number == 0:
+    if data_type not in TYPES:
         return dict()
     es = Elasticsearch(host)
     index_name = f'{es_index_prefix}_{data_type}'
-    source_str = ','.join(return_fields)
-    data = es.search(index=index_name, size=total_number, _source=source_str)
     results = dict()
-    for hit in data['hits']['hits']:
+    for hit in iterate_records(es, index_name, return_fields):
         results[hit['_id']] = hit['_source']
     return results
 
@@ -226,38 +578,6 @@ def convert_analysis(record, existing_datasets):
     return es_doc
 
 
-def get_number_of_published_papers(data):
-    """
-    This function will return number of ids that have associated published papers
-    :param data:
-    :return: dict with yes and no as keys and number of documents for each category
-    """
-    paper_published_data = {
-        'yes': 0,
-        'no': 0
-    }
-    for item in data:
-        if 'paperPublished' in item['_source'] and item['_source']['paperPublished'] == 'true':
-            paper_published_data['yes'] += 1
-        else:
-            paper_published_data['no'] += 1
-    return paper_published_data
-
-
-def get_standard(data):
-    """
-    This function will return number of documents for each existing standard
-    :param data: data to parse
-    :return: dict with standards names as keys and number of documents with each standard as values
-    """
-    standard_data = dict()
-    for item in data:
-        standard = item['_source'].get('standardMet', None)
-        standard_data.setdefault(standard, 0)
-        standard_data[standard] += 1
-    return standard_data
-
-
 def create_summary_document_for_es(data):
     """
     This function will create document structure appropriate for es
@@ -341,21 +661,54 @@ def remove_underscore_from_end_prefix(es_index_prefix: str) -> str:
     return es_index_prefix
 
 
-def generate_ena_api_endpoint(result: str, data_portal: str, fields: str, optional: str = ''):
+def generate_ena_api_endpoint(result: str, data_portal: str, fields: str, optional: str = '', data_format='JSON'):
     """
     Generate the url for ENA API endpoint
     :param result: either be read_run (for experiment, file, dataset import) or analysis (for analysis import)
     :param data_portal: either ena (legacy data) or faang (faang data)
     :param fields: all (only faang data supports all) or list of fields separated by ',' (for legacy data)
     :param optional: optional constraint, e.g. species
+    :param data_format: the format of the response, JSON (default value) or TSV
     :return: the generated url
     """
     if optional == "":
-        return f"https://www.ebi.ac.uk/ena/portal/api/search/?" \
-           f"result={result}&format=JSON&limit=0&fields={fields}&dataPortal={data_portal}"
+        return f"{ENA_PORTAL_API_URL}/search/?" \
+           f"result={result}&format={data_format}&limit=0&fields={fields}&dataPortal={data_portal}"
     else:
-        return f"https://www.ebi.ac.uk/ena/portal/api/search/?" \
-           f"result={result}&format=JSON&limit=0&{optional}&fields={fields}&dataPortal={data_portal}"
+        return f"{ENA_PORTAL_API_URL}/search/?" \
+           f"result={result}&format={data_format}&limit=0&{optional}&fields={fields}&dataPortal={data_portal}"
+
+
+def iterate_ena_tsv(url: str):
+    """
+    Download the TSV response of ENA portal API and yield the records one by one while downloading,
+    so that the whole response never needs to be held in memory
+    :param url: the ENA portal API url with format=TSV
+    :return: generator of records, each a dict having the header columns as keys, missing values as empty strings
+    """
+    with requests.get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        yield from parse_ena_tsv(response.iter_lines(decode_unicode=True))
+
+
+def parse_ena_tsv(lines):
+    """
+    Convert the lines of ENA portal API TSV response into records
+    :param lines: the lines of the response, the first line is the header
+    :return: generator of records, each a dict having the header columns as keys, missing values as empty strings
+    """
+    header = None
+    for line in lines:
+        if not line:
+            continue
+        values = line.rstrip('\r').split('\t')
+        if header is None:
+            header = values
+            continue
+        if len(values) < len(header):
+            values.extend([''] * (len(header) - len(values)))
+        yield dict(zip(header, values))
 
 
 def process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, rulesets, to_es_flag):
@@ -404,3 +757,84 @@ def process_validation_result(analyses, es, es_index_prefix, validation_results,
         insert_es_log(es, es_index_prefix, 'analysis', analysis_accession, status, ";".join(msgs))
 
 
+# the default number of attempts and the base waiting time in seconds between them for the remote apis
+HTTP_RETRIES = 5
+HTTP_BACKOFF = 1
+HTTP_TIMEOUT = 60
+# status codes for which the request is tried again, too many requests and server side errors
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Limit the number of requests per second shared by all threads using the same instance
+    """
+    def __init__(self, rate):
+        """
+        :param rate: the maximum number of requests per second, 0 or negative means no limit
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next request is allowed to be sent
+        """
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def create_http_session(pool_size=10):
+    """
+    Create a requests session which keeps the connections alive and can be shared by several threads
+    :param pool_size: the number of connections kept per host, normally the number of threads
+    :return: the session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def request_with_retry(session, url, method='GET', retries=HTTP_RETRIES, backoff=HTTP_BACKOFF,
+                       rate_limiter=None, **kwargs):
+    """
+    Send the request and try again with exponential backoff and jitter on connection errors, time outs,
+    too many requests and server side errors
+    :param session: the requests session, or the requests module itself
+    :param url: the url to request
+    :param method: the http method
+    :param retries: the maximum number of attempts
+    :param backoff: the base waiting time in seconds, doubled after each failed attempt
+    :param rate_limiter: the optional rate limiter shared with other requests
+    :param kwargs: other parameters passed to requests
+    :return: the response of the last attempt
+    """
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    for attempt in range(retries):
+        last_attempt = attempt == retries - 1
+        if rate_limiter:
+            rate_limiter.wait()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if last_attempt:
+                raise
+            wait = backoff * 2 ** attempt
+        else:
+            if response.status_code not in HTTP_RETRY_STATUS or last_attempt:
+                return response
+            wait = backoff * 2 ** attempt
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                wait = max(wait, int(retry_after))
+        # jitter avoids all threads coming back to the server at the same time
+        time.sleep(wait + random.uniform(0, backoff))
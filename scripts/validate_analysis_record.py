@@ -24,11 +24,11 @@ logger = utils.create_logging_instance("validate_analysis")
 
 
 class ValidateAnalysisRecord(validate_record.ValidateRecord):
-    def __init__(self, records, rulesets, batch_size=600):
+    def __init__(self, records, rulesets, batch_size=600, max_workers=validate_record.VALIDATION_WORKERS):
         """
         inherited constructor, call the parental constructor directly with type set as analysis
         """
-        super().__init__('analysis', records, rulesets, batch_size)
+        super().__init__('analysis', records, rulesets, batch_size, max_workers)
 
     def convert_data(self, item):
         """
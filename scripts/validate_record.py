@@ -3,15 +3,22 @@ The base class which deals with validation records against the ruleset
 """
 
 import json
-import os
-import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List
 import utils
-from misc import from_lower_camel_case
+from local_cache import LocalCache
+from constants import VALIDATION_API_URL
+from misc import from_lower_camel_case, content_hash
 
 
 logger = utils.create_logging_instance("validate_record")
 
+VALIDATION_API = f'{VALIDATION_API_URL}/validate'
+# the number of batches sent to the validation server at the same time
+VALIDATION_WORKERS = 4
+# the cached validation results are used for this number of days, after that the records are validated again
+VALIDATION_CACHE_DAYS = 30
+
 
 def parse_ontology_term(ontology_term):
     """
@@ -33,7 +40,8 @@ def parse_ontology_term(ontology_term):
 
 
 class ValidateRecord:
-    def __init__(self, record_type: str, records: Dict, rulesets: List, batch_size: int):
+    def __init__(self, record_type: str, records: Dict, rulesets: List, batch_size: int,
+                 max_workers: int = VALIDATION_WORKERS, use_cache: bool = True):
         """
         constructor method
         :param record_type: indicates the type of records, could be one of experiment, analysis
@@ -42,11 +50,17 @@ class ValidateRecord:
         :param batch_size: the list of records to be validated could be very long and to make it possible to transfer to
         the validation server without timeout, it needs to split into small batches. The batch size determines how many
         records are contained in a batch
+        :param max_workers: the number of batches sent to the validation server at the same time
+        :param use_cache: only send the records which are not validated with the same content and ruleset version
+        before (True, default value) or send all records (False)
         """
         self.record_type = record_type
         self.records = records
         self.rulesets = rulesets
         self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        self.session = utils.create_http_session(max_workers)
 
     def get_record_type(self):
         """
@@ -142,36 +156,42 @@ class ValidateRecord:
     def validate(self) -> Dict:
         """
         Validate all records
-        This function mainly splits all records into small batches, validate each batch and put the results together
+        The records are looked up in the local validation cache by the ruleset, the ruleset version and the hash
+        of the converted record first. This function then splits the remaining records into small batches,
+        validate each batch against each ruleset in parallel and put the results together as they come back
         :return: the total validation result
         """
         total_results = dict()
-        ids = sorted(list(self.records.keys()))
-        total_size = len(ids)
-        num_portions = (total_size - total_size % self.batch_size) / self.batch_size
-        for i in range(int(num_portions)):
-            part = list()
-            for j in range(self.batch_size):
-                part.append(self.records[ids.pop()])
-            total_results = self.get_validation_results(total_results, part)
-
-        # Rest of the samples
-        part = list()
-        for record_id in ids:
-            part.append(self.records[record_id])
-        total_results = self.get_validation_results(total_results, part)
-        return total_results
-
-    def get_validation_results(self, total_results, part_records) -> Dict:
-        """
-        For the given batch, do the validation and merge the batch result into total result
-        :param total_results: the total validation result
-        :param part_records: the batch of records to be validated
-        :return: the updated total validation result
-        """
-        for ruleset in self.rulesets:
-            validation_results = self.validate_record_ruleset(part_records, ruleset)
-            total_results = self.merge_results(total_results, validation_results, ruleset)
+        ruleset_version = self.get_ruleset_version()
+        converted_records = [self.convert_data(self.records[record_id]) for record_id in sorted(self.records.keys())]
+        cache = LocalCache('validation') if self.use_cache else None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = dict()
+            for ruleset in self.rulesets:
+                cache_keys = dict()
+                for converted in converted_records:
+                    cache_keys[converted['id']] = f'{ruleset}|{ruleset_version}|{content_hash(converted)}'
+                cached = cache.get_many(cache_keys.values()) if cache else dict()
+                total_results = self.merge_results(total_results, build_cached_results(cached.values()), ruleset)
+                to_validate = [converted for converted in converted_records
+                               if cache_keys[converted['id']] not in cached]
+                for start in range(0, len(to_validate), self.batch_size):
+                    part = to_validate[start:start + self.batch_size]
+                    payload = json.dumps(part).encode('utf-8')
+                    batch_keys = {converted['id']: cache_keys[converted['id']] for converted in part}
+                    futures[executor.submit(self.post_batch, payload, ruleset)] = (ruleset, batch_keys)
+            for future in as_completed(futures):
+                ruleset, batch_keys = futures[future]
+                validation_results = future.result()
+                entity_errors = validation_results.pop('entityErrors', dict())
+                if cache:
+                    cache.set_many(((batch_keys[entity_id], {'id': entity_id, 'detail': detail,
+                                                             'errors': entity_errors.get(entity_id, list())})
+                                    for entity_id, detail in validation_results['detail'].items()
+                                    if entity_id in batch_keys), VALIDATION_CACHE_DAYS)
+                total_results = self.merge_results(total_results, validation_results, ruleset)
+        if cache:
+            cache.close()
         return total_results
 
     def merge_results(self, total_results, validation_results, ruleset):
@@ -201,37 +221,30 @@ class ValidateRecord:
         total_results[ruleset] = sub_results
         return total_results
 
-    def validate_record_ruleset(self, part_records, ruleset):
+    def post_batch(self, payload: bytes, ruleset):
         """
-        Convert the batch records to the format recognized by the validation server, save into file
-        and do the validation
-        :param part_records: the batch records
+        Send the converted batch to the validation server, the content is held in memory, so that the concurrent
+        batches and importers do not share any file
+        :param payload: the content of the JSON file
         :param ruleset: the ruleset name
         :return: the converted validation result of the batch record
         """
-        tmp_out_file = f'tmp_{self.record_type}_records.json'
-        with open(tmp_out_file, 'w') as w:
-            w.write("[\n")
-            for index, item in enumerate(part_records):
-                converted_data = self.convert_data(item)
-                converted_data = json.dumps(converted_data)
-                if index != 0:
-                    w.write(",\n")
-                w.write(f"{converted_data}\n")
-            w.write("]\n")
-        tmp_validation_result_file = f'{self.record_type}_{ruleset}_validation_result.json'
-        tmp_validation_result_file = tmp_validation_result_file.replace(' ', '_')
+        data = {
+            'format': 'json',
+            'rule_set_name': ruleset,
+            'file_format': 'JSON'
+        }
+        files = {
+            'metadata_file': (f'{self.record_type}_records.json', payload, 'application/json')
+        }
+        response = utils.request_with_retry(self.session, VALIDATION_API, method='POST', data=data, files=files)
         try:
-            command = f'curl -s -F "format=json" -F "rule_set_name={ruleset}" -F "file_format=JSON"' + \
-                      f' -F "metadata_file=@{tmp_out_file}" "https://www.ebi.ac.uk/vg/faang/validate" > ' \
-                          f'{tmp_validation_result_file}'
-            os.system(command)
-        except Exception:
-            logger.error("Validation Error!!!")
-            sys.exit(0)
-        with open(tmp_validation_result_file, 'r') as f:
-            data = json.load(f)
-        return self.parse_validation_results(data['entities'])
+            entities = response.json()['entities']
+        except (ValueError, KeyError):
+            logger.error(f"Validation Error!!! {self.record_type} against {ruleset} returns "
+                         f"status {response.status_code}: {response.text[:200]}")
+            raise
+        return self.parse_validation_results(entities)
 
     def parse_validation_results(self, entities):
         """
@@ -268,14 +281,17 @@ class ValidateRecord:
         summary = dict()
         errors = dict()
         result = dict()
+        result['detail'] = dict()
+        # the error messages of each entity, needed to rebuild the errors from the validation cache
+        result['entityErrors'] = dict()
         for entity in entities:
             status = entity['_outcome']['status']
             summary.setdefault(status, 0)
             summary[status] += 1
             entity_id = entity['id']
-            result.setdefault('detail', dict())
             result['detail'].setdefault(entity_id, dict())
             result['detail'][entity_id]['status'] = status
+            entity_errors = result['entityErrors'].setdefault(entity_id, list())
 
             backup_msg = ''
             tag = status + 's'
@@ -305,6 +321,7 @@ class ValidateRecord:
                 if field_status.upper() == 'ERROR':
                     errors.setdefault(msg, 0)
                     errors[msg] += 1
+                    entity_errors.append(msg)
                 msg = f"({field_status}){msg}"
                 msgs.append(msg)
             msgs = sorted(msgs)
@@ -314,6 +331,7 @@ class ValidateRecord:
                 if status == 'error':
                     errors.setdefault(backup_msg, 0)
                     errors[backup_msg] += 1
+                    entity_errors.append(backup_msg)
             # existing both errors and warnings, but attributes iteration does not contain error
             # means that error contained in the backup_msg, e.g. missing mandatory fields
             elif both_type_flag == 1 and contain_error_flag == 0:
@@ -323,3 +341,26 @@ class ValidateRecord:
         result['summary'] = summary
         result['errors'] = errors
         return result
+
+
+def build_cached_results(cached_entries) -> Dict:
+    """
+    Rebuild the intermediate validation result structure from the cached entries, so that it could be merged into
+    the total result in the same way as the result of one batch
+    :param cached_entries: the cached entries, each having the id, the detail and the error messages of one entity
+    :return: the result which is a dict having three fixed keys: summary, detail and errors
+    """
+    result = {
+        'summary': dict(),
+        'detail': dict(),
+        'errors': dict()
+    }
+    for entry in cached_entries:
+        detail = entry['detail']
+        result['summary'].setdefault(detail['status'], 0)
+        result['summary'][detail['status']] += 1
+        result['detail'][entry['id']] = detail
+        for msg in entry['errors']:
+            result['errors'].setdefault(msg, 0)
+            result['errors'][msg] += 1
+    return result
@@ -29,11 +29,11 @@ logger = create_logging_instance('validate_specimen')
 
 
 class ValidateSpecimenRecord(validate_record.ValidateRecord):
-    def __init__(self, records, rulesets, batch_size=600):
+    def __init__(self, records, rulesets, batch_size=600, max_workers=validate_record.VALIDATION_WORKERS):
         """
         inherited constructor, call the parental constructor directly with type set as experiment
         """
-        super().__init__('specimen', records, rulesets, batch_size)
+        super().__init__('specimen', records, rulesets, batch_size, max_workers)
 
     def convert_data(self, item):
         """